@@ -1,14 +1,22 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 from config import Config
 from services.video_analysis_service import VideoAnalysisService
-from services.query_service import QueryService
+from services.query_service import QueryService, SEARCH_MODES, FUSION_METHODS, RESULT_GROUPS, parse_time_window
 from services.storage_service import StorageService
+from services.upload_sessions import UploadSessionManager, UploadError
+from services.embedder import create_embedder
+from services.vector_index import create_vector_index
+from services.analysis_worker import AnalysisWorker
+from services.progress_stream import ProgressBroadcaster, format_event
+from services.video_deletion import VideoDeletionService
+from services import metrics
 from db.database import Database
 import logging
 import uuid
 import traceback
 import os
+from datetime import datetime
 
 app = Flask(__name__)
 CORS(app, origins= [
@@ -28,8 +36,21 @@ logger = logging.getLogger(__name__)
 # Initialize services
 db = Database(app.config)  
 storage_service = StorageService(app.config, db) #Pass db instance to storage service
-query_service = QueryService(app.config, db, storage_service)
-video_analysis_service = VideoAnalysisService(app.config, storage_service, db)
+embedder = create_embedder(app.config, db)
+vector_index = create_vector_index(app.config, db, embedder) # None when searching in AlloyDB
+query_service = QueryService(app.config, db, storage_service, vector_index=vector_index, embedder=embedder)
+video_analysis_service = VideoAnalysisService(app.config, storage_service, db, vector_index=vector_index)
+video_deletion_service = VideoDeletionService(app.config, db, storage_service).start()
+upload_sessions = UploadSessionManager(app.config.get('UPLOAD_SESSION_DIR'))
+progress_broadcaster = ProgressBroadcaster(db, app.config.get('PROGRESS_STREAM_INTERVAL', 1))
+metrics.registry.describe('progress_stream_subscribers', 'gauge', 'Clients connected to the analysis progress stream')
+metrics.registry.set_callback('progress_stream_subscribers', progress_broadcaster.subscriber_count)
+
+# Runs queued analysis jobs in this process too, disable when dedicated worker.py processes are deployed
+if app.config.get('ANALYSIS_EMBEDDED_WORKER', True):
+    analysis_worker = AnalysisWorker(app.config, db, video_analysis_service).start()
+    if int(app.config.get('VIDEO_DECODE_PROCESSES', 0)) > 1:
+        logger.warning("VIDEO_DECODE_PROCESSES only applies to worker.py, the embedded worker decodes on its analysis threads")
 
 
 @app.route('/api/videos', methods=['POST'])
@@ -53,33 +74,135 @@ def upload_video():
         traceback.print_exc()  # Print the full traceback for debugging
         return jsonify({'message': 'Failed to upload video'}), 500
 
-@app.route('/api/videos', methods=['GET'])
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Starts a resumable, chunked upload. Body: {filename, size, sha256 (optional)}."""
+    body = request.get_json(silent=True) or {}
+    try:
+        session = upload_sessions.create(body.get('filename'), body.get('size'), body.get('sha256'))
+        session['chunk_size'] = app.config.get('VIDEO_UPLOAD_CHUNK_SIZE')
+        return jsonify(session), 201
+    except UploadError as e:
+        return jsonify({'message': str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Error creating upload session: {e}")
+        return jsonify({'message': 'Failed to create upload'}), 500
 
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Returns the upload's current offset, i.e. where a resumed upload continues."""
+    try:
+        return jsonify(upload_sessions.status(upload_id)), 200
+    except UploadError as e:
+        return jsonify({'message': str(e)}), e.status
 
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Appends the raw request body at the offset given by the Content-Range header."""
+    try:
+        session = upload_sessions.write_chunk(
+            upload_id,
+            request.stream,
+            request.headers.get('Content-Range'),
+            request.headers.get('X-Chunk-SHA256'),
+        )
+        return jsonify(session), 200
+    except UploadError as e:
+        return jsonify({'message': str(e), 'offset': e.offset}), e.status
+    except Exception as e:
+        logger.error(f"Error receiving chunk for upload {upload_id}: {e}")
+        return jsonify({'message': 'Failed to store chunk'}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Verifies size and SHA-256 of a finished upload and turns it into a video."""
+    body = request.get_json(silent=True) or {}
+    try:
+        filepath, session = upload_sessions.complete(upload_id, body.get('sha256'))
+        video_id = str(uuid.uuid4())
+        storage_service.ingest_video_file(filepath, session['filename'], video_id, session['checksum'])
+        upload_sessions.discard(upload_id)
+        return jsonify({'message': 'Video uploaded successfully', 'video_id': video_id, 'sha256': session['checksum']}), 201
+    except UploadError as e:
+        return jsonify({'message': str(e), 'offset': e.offset}), e.status
+    except Exception as e:
+        logger.error(f"Error completing upload {upload_id}: {e}")
+        traceback.print_exc()
+        return jsonify({'message': 'Failed to upload video'}), 500
 
+VIDEO_LIST_STATUSES = ('NotAnalyzed', 'Pending', 'Running', 'Cancelling', 'Completed', 'Cancelled', 'Error')
+
+def _video_list_options(args):
+    """Validated list_videos keyword arguments of a GET /api/videos query string, raises ValueError with the message for a 400."""
+    max_limit = app.config.get('VIDEO_LIST_MAX_PAGE_SIZE', 200)
+    try:
+        limit = int(args.get('limit', app.config.get('VIDEO_LIST_PAGE_SIZE', 50)))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f'limit must be between 1 and {max_limit}')
+    sort = args.get('sort', 'upload_date')
+    if sort not in Database.VIDEO_SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(Database.VIDEO_SORT_COLUMNS)}")
+    order = args.get('order', 'desc' if sort == 'upload_date' else 'asc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    status = args.get('status') or None
+    if status is not None and status not in VIDEO_LIST_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(VIDEO_LIST_STATUSES)}")
+    return {'limit': limit, 'cursor': args.get('cursor') or None, 'sort': sort, 'order': order,
+            'status': status, 'filename_contains': args.get('q') or None}
+
+@app.route('/api/videos', methods=['GET'])
 def list_videos():
+    """One page of videos with their analysis status and frame count.
+
+    Query string: limit, sort (upload_date or filename), order (asc or desc), status, q (filename
+    substring) and cursor, the next_cursor of the previous page.
+    """
     try:
-        videos = storage_service.list_videos()
-        return jsonify(videos), 200
+        options = _video_list_options(request.args)
+        return jsonify(storage_service.list_videos(**options)), 200
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error listing videos: {e}")
+        logger.error(f"Error listing videos: {e}", exc_info=True)
         return jsonify({'message': 'Failed to list videos'}), 500
 
 @app.route('/api/videos/<video_id>', methods=['DELETE'])
 def delete_video(video_id):
+    """Deletes the video's rows right away and its blobs in the background, see GET /api/videos/<id>/deletion"""
     try:
-        storage_service.delete_video(video_id)
-        return jsonify({'message': 'Video deleted successfully'}), 200
+        deletion = video_deletion_service.delete_video(video_id)
+        if deletion is None:
+            return jsonify({'message': 'Video not found'}), 404
+        if vector_index is not None:
+            vector_index.drop(video_id)
+        return jsonify({'message': 'Video deletion started', 'deletion': deletion}), 202
     except Exception as e:
-        logger.error(f"Error deleting video {video_id}: {e}")
+        logger.error(f"Error deleting video {video_id}: {e}", exc_info=True)
         return jsonify({'message': 'Failed to delete video'}), 500
 
+@app.route('/api/videos/<video_id>/deletion', methods=['GET'])
+def get_deletion_progress(video_id):
+    try:
+        deletion = video_deletion_service.get_progress(video_id)
+        if deletion is None:
+            return jsonify({'message': 'No deletion found for this video'}), 404
+        return jsonify(deletion), 200
+    except Exception as e:
+        logger.error(f"Error getting deletion progress for {video_id}: {e}")
+        return jsonify({'message': 'Failed to get deletion progress'}), 500
+
 @app.route('/api/videos/<video_id>/analyze', methods=['POST'])
 def analyze_video(video_id):
 
     try:
-        video_analysis_service.start_analysis(video_id)
-        return jsonify({'message': 'Video analysis started'}), 202
+        body = request.get_json(silent=True) or {}
+        job_id = video_analysis_service.start_analysis(video_id, resume=bool(body.get('resume', True))) # resume=false starts over
+        return jsonify({'message': 'Video analysis started', 'job_id': job_id}), 202
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 409
     except Exception as e:
         logger.error(f"Error starting video analysis for {video_id}: {e}")
         return jsonify({'message': 'Failed to start video analysis'}), 500
@@ -93,6 +216,40 @@ def get_analysis_progress(video_id):
         logger.error(f"Error getting analysis progress for {video_id}: {e}")
         return jsonify({'message': 'Failed to get analysis progress'}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Stage latency histograms, queue depths and job gauges of this process, in the Prometheus text format"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/analysis-progress/stream', methods=['GET'])
+def stream_analysis_progress():
+    """Server-Sent Events stream of the analysis progress of the videos in ?video_ids=a,b"""
+    video_ids = [video_id for video_id in request.args.get('video_ids', '').split(',') if video_id]
+    if not video_ids:
+        return jsonify({'message': 'video_ids is required'}), 400
+    max_videos = app.config.get('PROGRESS_STREAM_MAX_VIDEOS', 100)
+    if len(video_ids) > max_videos:
+        return jsonify({'message': f'At most {max_videos} video_ids can be streamed'}), 400
+    try:
+        subscription = progress_broadcaster.subscribe(video_ids)
+    except Exception as e:
+        logger.error(f"Error subscribing to analysis progress for {video_ids}: {e}", exc_info=True)
+        return jsonify({'message': 'Failed to get analysis progress'}), 500
+    keepalive = app.config.get('PROGRESS_STREAM_KEEPALIVE', 15)
+
+    def events():
+        try:
+            while True:
+                states = subscription.get(keepalive)
+                if not states:
+                    yield ": keepalive\n\n" # Keeps proxies from closing an idle connection
+                for state in states:
+                    yield format_event(state)
+        finally: # Client disconnected
+            progress_broadcaster.unsubscribe(subscription)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/videos/<video_id>/cancel-analysis', methods=['POST'])
 def cancel_analysis(video_id):
     try:
@@ -102,6 +259,30 @@ def cancel_analysis(video_id):
         logger.error(f"Error cancelling analysis for {video_id}: {e}")
         return jsonify({'message': 'Failed to cancel analysis'}), 500
 
+def _search_options(body, default_top_k):
+    """Validated (mode, fusion, top_k) of a query request, raises ValueError with the message for a 400."""
+    mode = body.get('mode') # 'description', 'objects' or 'hybrid', defaults to QUERY_SEARCH_MODE
+    fusion = body.get('fusion') # 'rrf' or 'weighted', hybrid mode only
+    if mode is not None and mode not in SEARCH_MODES:
+        raise ValueError(f"mode must be one of {', '.join(SEARCH_MODES)}")
+    if fusion is not None and fusion not in FUSION_METHODS:
+        raise ValueError(f"fusion must be one of {', '.join(FUSION_METHODS)}")
+    try:
+        top_k = int(body.get('top_k', default_top_k))
+    except (TypeError, ValueError):
+        raise ValueError('top_k must be an integer')
+    if not 1 <= top_k <= 50:
+        raise ValueError('top_k must be between 1 and 50')
+    return mode, fusion, top_k
+
+def _time_options(body):
+    """Validated (start_ms, end_ms, group) of a query request: the time window searched and how results are grouped."""
+    start_ms, end_ms = parse_time_window(body.get('start'), body.get('end')) # Seconds or [H:]MM:SS
+    group = body.get('group') # 'frames' or 'segments', defaults to frames
+    if group is not None and group not in RESULT_GROUPS:
+        raise ValueError(f"group must be one of {', '.join(RESULT_GROUPS)}")
+    return start_ms, end_ms, group
+
 @app.route('/api/videos/<video_id>/query', methods=['POST'])
 def query_video(video_id):
     query_text = request.json.get('query')
@@ -109,13 +290,49 @@ def query_video(video_id):
         return jsonify({'message': 'Query text is required'}), 400
 
     try:
-        _top_k=1
-        results = query_service.query_video(video_id, query_text,_top_k)
+        mode, fusion, _top_k = _search_options(request.json, default_top_k=1)
+        start_ms, end_ms, group = _time_options(request.json)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        results = query_service.query_video(video_id, query_text, _top_k, mode=mode, fusion=fusion, start_ms=start_ms, end_ms=end_ms, group=group)
         return jsonify(results), 200
     except Exception as e:
         logger.error(f"Error querying video {video_id}: {e}")
         return jsonify({'message': 'Failed to process query'}), 500
 
+@app.route('/api/query', methods=['POST'])
+def query_library():
+    """Searches all analyzed videos, optionally limited to video_ids, an upload date range (ISO 8601) and a time window in the videos."""
+    query_text = request.json.get('query')
+    if not query_text:
+        return jsonify({'message': 'Query text is required'}), 400
+
+    try:
+        mode, fusion, _top_k = _search_options(request.json, default_top_k=10)
+        start_ms, end_ms, group = _time_options(request.json)
+        video_ids = request.json.get('video_ids')
+        if video_ids is not None and (not isinstance(video_ids, list) or not all(isinstance(v, str) for v in video_ids)):
+            raise ValueError('video_ids must be a list of video IDs')
+        uploaded_after = request.json.get('uploaded_after')
+        uploaded_before = request.json.get('uploaded_before')
+        uploaded_after = datetime.fromisoformat(uploaded_after) if uploaded_after else None
+        uploaded_before = datetime.fromisoformat(uploaded_before) if uploaded_before else None
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        results = query_service.query_library(
+            query_text, _top_k, mode=mode, fusion=fusion,
+            video_ids=video_ids, uploaded_after=uploaded_after, uploaded_before=uploaded_before,
+            start_ms=start_ms, end_ms=end_ms, group=group,
+        )
+        return jsonify(results), 200
+    except Exception as e:
+        logger.error(f"Error querying video library: {e}")
+        return jsonify({'message': 'Failed to process query'}), 500
+
 @app.route('/frames/<filename>')
 def get_frame_image(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER_FRAMES'], filename)
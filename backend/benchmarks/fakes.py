@@ -0,0 +1,190 @@
+"""Local stand-ins for Gemini, GCS and AlloyDB used by the benchmarks.
+
+They replace only the remote calls: LLMService, StorageService and the analysis pipeline
+run unchanged on top of them, so the measured throughput includes the scheduler, caches,
+encoding and batching of the real code paths.
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+from google.api_core import exceptions as google_exceptions
+from services.storage_service import StorageService
+
+
+class StageTimer:
+    """Collects the durations of the pipeline stages, from any thread."""
+
+    def __init__(self):
+        self._durations = {} # stage -> list of seconds
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._durations.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+    def summary(self):
+        """Per stage: call count, total and mean, p50, p95 and max latency in milliseconds."""
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self._durations.items()}
+        summary = {}
+        for stage, values in durations.items():
+            summary[stage] = {
+                'count': len(values),
+                'total_s': round(sum(values), 4),
+                'mean_ms': round(sum(values) * 1000 / len(values), 3),
+                'p50_ms': round(values[len(values) // 2] * 1000, 3),
+                'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3),
+            }
+        return summary
+
+
+class _FakeUsage:
+    def __init__(self, total_token_count):
+        self.total_token_count = total_token_count
+
+
+class _FakePart:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeResponse:
+    def __init__(self, text, total_token_count):
+        self.parts = [_FakePart(text)]
+        self.usage_metadata = _FakeUsage(total_token_count)
+
+    def resolve(self):
+        pass
+
+
+class FakeGenerativeModel:
+    """Answers generate_content like Gemini, after latency + latency_per_image seconds per image,
+    +/- jitter. error_rate of the calls raise ServiceUnavailable, which LLMScheduler retries."""
+
+    def __init__(self, latency=0.5, latency_per_image=0.0, jitter=0.1, error_rate=0.0, seed=0, timer=None):
+        self.latency = latency
+        self.latency_per_image = latency_per_image
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timer = timer
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def generate_content(self, contents):
+        started = time.perf_counter()
+        images = sum(1 for part in contents if isinstance(part, dict) and 'data' in part)
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self.latency_per_image * images + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(delay)
+        if self.timer is not None:
+            self.timer.record('llm_request', time.perf_counter() - started)
+        if fail:
+            raise google_exceptions.ServiceUnavailable('Injected benchmark error')
+
+        results = [{
+            'frame_index': frame_index,
+            'text_description': f"Synthetic frame {frame_index} showing a few colored shapes over a gradient background.",
+            'detected_objects': [{'object_type': 'shape', 'object_color': 'red', 'object_descrition': 'a moving shape'}],
+        } for frame_index in range(images)]
+        text = json.dumps(results[0] if images == 1 else results)
+        return _FakeResponse(text, total_token_count=images * 1300 + 200)
+
+
+class FakeStorageService(StorageService):
+    """StorageService on the local filesystem backend, with an optional delay per frame upload."""
+
+    def __init__(self, config, db, upload_latency=0.0, timer=None):
+        super().__init__(dict(config, STORAGE_BACKEND='local'), db)
+        self.upload_latency = upload_latency
+        self.timer = timer
+
+    def _upload_with_retry(self, blob_name, data, content_type):
+        started = time.perf_counter()
+        if self.upload_latency > 0:
+            time.sleep(self.upload_latency)
+        super()._upload_with_retry(blob_name, data, content_type)
+        if self.timer is not None:
+            self.timer.record('upload', time.perf_counter() - started)
+
+
+class FakeDatabase:
+    """In-memory SQLite stand-in for Database, covering the calls an analysis run makes."""
+
+    def __init__(self, path=':memory:', write_latency=0.0, timer=None):
+        self.write_latency = write_latency
+        self.timer = timer
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE videos (video_id TEXT PRIMARY KEY, filename TEXT, video_gcs_uri TEXT, upload_date TEXT, checksum TEXT);
+                CREATE TABLE frames (frame_id TEXT PRIMARY KEY, video_id TEXT, frame_gcs_uri TEXT, timeframe TEXT, timestamp_ms INTEGER,
+                                     detected_objects_json TEXT, text_description TEXT);
+                CREATE TABLE analysis_checkpoints (video_id TEXT PRIMARY KEY, frame_index INTEGER, timestamp_ms INTEGER, config_key TEXT);
+            """)
+
+    def close(self):
+        self._conn.close()
+
+    def store_video_metadata(self, video_metadata):
+        with self._lock:
+            self._conn.execute("INSERT INTO videos VALUES (?, ?, ?, ?, ?)", (
+                video_metadata['video_id'], video_metadata['filename'], video_metadata['video_gcs_uri'],
+                str(video_metadata['upload_date']), video_metadata.get('checksum')))
+            self._conn.commit()
+
+    def get_video_metadata(self, video_id):
+        with self._lock:
+            row = self._conn.execute("SELECT video_id, filename, video_gcs_uri, upload_date, checksum FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return dict(zip(['video_id', 'filename', 'video_gcs_uri', 'upload_date', 'checksum'], row)) if row else None
+
+    def store_frame_metadata_batch(self, frames_metadata):
+        started = time.perf_counter()
+        if self.write_latency > 0:
+            time.sleep(self.write_latency)
+        rows = [(
+            frame_metadata['frame_id'], frame_metadata['video_id'], frame_metadata['frame_gcs_uri'], frame_metadata['timeframe'],
+            frame_metadata['timestamp_ms'], json.dumps(frame_metadata['detected_objects']), frame_metadata['text_description'],
+        ) for frame_metadata in frames_metadata]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        if self.timer is not None:
+            self.timer.record('db_write', time.perf_counter() - started)
+
+    def count_frames(self, video_id):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM frames WHERE video_id = ?", (video_id,)).fetchone()[0]
+
+    def get_analysis_checkpoint(self, video_id):
+        with self._lock:
+            row = self._conn.execute("SELECT frame_index, timestamp_ms, config_key FROM analysis_checkpoints WHERE video_id = ?", (video_id,)).fetchone()
+        return dict(zip(['frame_index', 'timestamp_ms', 'config_key'], row)) if row else None
+
+    def save_analysis_checkpoint(self, video_id, frame_index, timestamp_ms, config_key):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO analysis_checkpoints VALUES (?, ?, ?, ?)", (video_id, frame_index, timestamp_ms, config_key))
+            self._conn.commit()
+
+    def delete_analysis_checkpoint(self, video_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis_checkpoints WHERE video_id = ?", (video_id,))
+            self._conn.commit()
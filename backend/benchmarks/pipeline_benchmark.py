@@ -0,0 +1,272 @@
+"""End-to-end analysis throughput benchmark, runs offline against local stand-ins.
+
+A synthetic clip is analyzed by the real VideoAnalysisService, with Gemini, GCS and
+AlloyDB replaced by the fakes in benchmarks/fakes.py. Reports frames/sec, per-stage
+latency and peak memory, and writes the results to a JSON file named after the commit so
+runs can be compared across commits. From backend/:
+
+    python -m benchmarks.pipeline_benchmark --duration 60 --resolution 1920x1080
+    python -m benchmarks.pipeline_benchmark --set LLM_BATCH_SIZE=4 --compare benchmarks/results/<baseline>.json
+
+Exits with status 1 when --compare finds a frames/sec drop larger than --max-regression.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+import cv2
+import numpy as np
+from config import Config
+import services.video_analysis_service as video_analysis_module
+from services.frame_source import FrameSource
+from services.segmented_frame_source import create_decode_pool
+from services.video_analysis_service import VideoAnalysisService
+from benchmarks.fakes import FakeDatabase, FakeGenerativeModel, FakeStorageService, StageTimer
+from benchmarks.synthetic_video import synthetic_video
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Overrides applied before the --set ones: no persistent caches, so every run does the same work
+BENCHMARK_CONFIG = {
+    'LLM_CACHE_ENABLED': False,
+    'LLM_CACHE_PATH': '',
+    'QUERY_EMBEDDING_CACHE_ENABLED': False,
+    'VECTOR_SEARCH_BACKEND': 'alloydb',
+    'GCS_BUCKET_NAME_VIDEOS': 'benchmark-videos',
+    'GCS_BUCKET_NAME_FRAMES': 'benchmark-frames',
+}
+
+
+def _parse_value(value):
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def _timed_frame_source(timer, base=FrameSource):
+    class TimedFrameSource(base):
+        def frames(self, *args, **kwargs):
+            frames = super().frames(*args, **kwargs)
+            while True:
+                started = time.perf_counter()
+                try:
+                    sampled_frame = next(frames)
+                except StopIteration:
+                    return
+                timer.record('decode', time.perf_counter() - started)
+                yield sampled_frame
+    return TimedFrameSource
+
+
+def run_once(args, config, video_path, duration):
+    """Analyzes the clip once in a fresh workspace and returns the run's measurements."""
+    workspace = tempfile.mkdtemp(prefix='video-analysis-benchmark-')
+    timer = StageTimer()
+    config = dict(config,
+                  LOCAL_STORAGE_ROOT=os.path.join(workspace, 'storage'),
+                  VIDEO_CACHE_DIR=os.path.join(workspace, 'video_cache'),
+                  UPLOAD_SESSION_DIR=os.path.join(workspace, 'upload_sessions'))
+    decode_pool = create_decode_pool(config) # Before the fakes start their threads, as in worker.py
+    db = FakeDatabase(write_latency=args.db_latency, timer=timer)
+    storage_service = FakeStorageService(config, db, upload_latency=args.upload_latency, timer=timer)
+    model = FakeGenerativeModel(args.llm_latency, args.llm_latency_per_image, args.llm_jitter, args.llm_error_rate, seed=args.seed, timer=timer)
+    original_frame_sources = (video_analysis_module.FrameSource, video_analysis_module.SegmentedFrameSource)
+    try:
+        video_id = str(uuid.uuid4())
+        input_path = os.path.join(workspace, os.path.basename(video_path))
+        shutil.copyfile(video_path, input_path) # The video cache takes ownership of the file
+        storage_service.ingest_video_file(input_path, os.path.basename(video_path), video_id)
+
+        service = VideoAnalysisService(config, storage_service, db, decode_pool=decode_pool)
+        service.llm_service.model = model
+        service.llm_service.analyze_image = timer.wrap('llm', service.llm_service.analyze_image)
+        service.llm_service.analyze_images = timer.wrap('llm', service.llm_service.analyze_images)
+        service.frame_preparer.prepare = timer.wrap('prepare', service.frame_preparer.prepare)
+        service._process_frames = timer.wrap('process_batch', service._process_frames)
+        video_analysis_module.FrameSource = _timed_frame_source(timer)
+        video_analysis_module.SegmentedFrameSource = _timed_frame_source(timer, original_frame_sources[1])
+
+        frames_sampled = 0
+
+        def on_progress(progress, frames_analyzed):
+            nonlocal frames_sampled
+            frames_sampled = frames_analyzed
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        status = service.run_analysis(video_id, threading.Event(), on_progress=on_progress, resume=False)
+        elapsed = time.perf_counter() - started
+        peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+
+        frames_stored = db.count_frames(video_id)
+        return {
+            'status': status,
+            'elapsed_s': round(elapsed, 3),
+            'frames_sampled': frames_sampled,
+            'frames_stored': frames_stored,
+            'frames_per_second': round(frames_stored / elapsed, 3) if elapsed > 0 else None,
+            'realtime_factor': round(duration / elapsed, 3) if elapsed > 0 else None, # Seconds of video analyzed per second
+            'stages': timer.summary(),
+            'peak_traced_memory_mb': round(peak_traced / 1024 ** 2, 2) if peak_traced is not None else None,
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2), # Process lifetime peak, Linux reports KiB
+            'llm_requests': model.calls,
+            'llm_injected_errors': model.errors,
+            'llm_scheduler': service.llm_service.scheduler.stats(),
+        }
+    finally:
+        video_analysis_module.FrameSource, video_analysis_module.SegmentedFrameSource = original_frame_sources
+        if decode_pool is not None:
+            decode_pool.shutdown()
+        db.close()
+        storage_service.upload_executor.shutdown(wait=True)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def compare(baseline, current, max_regression):
+    """Prints the change of every metric against baseline, returns True on a frames/sec regression."""
+    base_fps = baseline['summary']['frames_per_second']
+    fps = current['summary']['frames_per_second']
+    change = (fps - base_fps) / base_fps if base_fps else 0.0
+    print(f"\nAgainst {baseline.get('git_commit') or 'baseline'} ({baseline['timestamp']}):")
+    for key in sorted(set(baseline['params']) | set(current['params'])):
+        if key not in ('repeat', 'name', 'max_regression') and baseline['params'].get(key) != current['params'].get(key):
+            print(f"  warning: {key} differs ({baseline['params'].get(key)} -> {current['params'].get(key)})")
+    if baseline.get('config_overrides') != current['config_overrides']:
+        print(f"  warning: config overrides differ ({baseline.get('config_overrides')} -> {current['config_overrides']})")
+    print(f"  {'frames/sec':<22} {base_fps:>10.2f} -> {fps:>10.2f} ({change:+.1%})")
+    base_stages = baseline['runs'][0]['stages']
+    for stage, stats in current['runs'][0]['stages'].items():
+        if stage in base_stages and base_stages[stage]['p50_ms']:
+            stage_change = (stats['p50_ms'] - base_stages[stage]['p50_ms']) / base_stages[stage]['p50_ms']
+            print(f"  {stage + ' p50 ms':<22} {base_stages[stage]['p50_ms']:>10.2f} -> {stats['p50_ms']:>10.2f} ({stage_change:+.1%})")
+    regressed = change < -max_regression
+    if regressed:
+        print(f"  REGRESSION: frames/sec dropped by more than {max_regression:.0%}")
+    return regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    video = parser.add_argument_group('synthetic video')
+    video.add_argument('--duration', type=float, default=30.0, help='Clip length in seconds')
+    video.add_argument('--fps', type=float, default=30.0, help='Clip frame rate')
+    video.add_argument('--resolution', default='1280x720', help='WIDTHxHEIGHT')
+    video.add_argument('--scene-changes', type=int, default=5, help='Hard cuts in the clip')
+    video.add_argument('--seed', type=int, default=0)
+    fakes = parser.add_argument_group('stand-ins')
+    fakes.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per Gemini request')
+    fakes.add_argument('--llm-latency-per-image', type=float, default=0.05, help='Extra seconds per image in a request')
+    fakes.add_argument('--llm-jitter', type=float, default=0.1, help='Uniform +/- seconds added to each request')
+    fakes.add_argument('--llm-error-rate', type=float, default=0.0, help='Fraction of requests failing with a retryable error')
+    fakes.add_argument('--upload-latency', type=float, default=0.02, help='Seconds per frame upload')
+    fakes.add_argument('--db-latency', type=float, default=0.005, help='Seconds per frame batch insert')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='Config override, e.g. LLM_BATCH_SIZE=4 (repeatable)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs to make, the summary reports their median')
+    parser.add_argument('--no-tracemalloc', dest='tracemalloc', action='store_false', help='Skip Python allocation tracking, which slows the run down')
+    parser.add_argument('--name', default=None, help='Label stored with the results and used in the file name')
+    parser.add_argument('--output-dir', default=os.path.join(BENCHMARK_DIR, 'results'))
+    parser.add_argument('--video-cache-dir', default=os.path.join(BENCHMARK_DIR, '.cache'), help='Where generated clips are kept between runs')
+    parser.add_argument('--compare', default=None, metavar='RESULTS_JSON', help='Earlier results to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.1, help='Tolerated frames/sec drop for --compare (fraction)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=os.environ.get('BENCHMARK_LOG_LEVEL', 'WARNING'))
+    width, height = (int(value) for value in args.resolution.lower().split('x'))
+    baseline = None
+    if args.compare: # Read first, so a wrong path fails before the runs
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    overrides = {}
+    for assignment in args.set:
+        key, _, value = assignment.partition('=')
+        overrides[key.strip()] = _parse_value(value.strip())
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()} # Same keys as Flask's app.config
+    config.update(BENCHMARK_CONFIG)
+    config.update(overrides)
+
+    video_path = synthetic_video(args.video_cache_dir, args.duration, args.fps, width, height, args.scene_changes, args.seed)
+    runs = []
+    for run in range(args.repeat):
+        result = run_once(args, config, video_path, args.duration)
+        runs.append(result)
+        print(f"Run {run + 1}/{args.repeat}: {result['status']}, {result['frames_stored']} frames in {result['elapsed_s']:.2f}s, "
+              f"{result['frames_per_second']:.2f} frames/s, {result['realtime_factor']:.2f}x realtime, max RSS {result['max_rss_mb']:.0f} MB")
+
+    commit, dirty = _git_revision()
+    results = {
+        'benchmark': 'pipeline',
+        'name': args.name,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'git_dirty': dirty,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'params': {key: value for key, value in vars(args).items() if key not in ('set', 'output_dir', 'video_cache_dir', 'compare')},
+        'config_overrides': overrides,
+        'runs': runs,
+        'summary': {
+            'frames_per_second': statistics.median(run['frames_per_second'] for run in runs),
+            'elapsed_s': statistics.median(run['elapsed_s'] for run in runs),
+            'realtime_factor': statistics.median(run['realtime_factor'] for run in runs),
+        },
+    }
+
+    print("\nStage latency (first run):")
+    print(f"  {'stage':<22}{'count':>8}{'mean ms':>12}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}")
+    for stage, stats in runs[0]['stages'].items():
+        print(f"  {stage:<22}{stats['count']:>8}{stats['mean_ms']:>12.2f}{stats['p50_ms']:>12.2f}{stats['p95_ms']:>12.2f}{stats['max_ms']:>12.2f}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    label = f"_{args.name}" if args.name else ''
+    output_path = os.path.join(args.output_dir, f"{datetime.now():%Y%m%d-%H%M%S}_{(commit or 'nogit')[:8]}{label}.json")
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nResults written to {output_path}")
+
+    if baseline is not None and compare(baseline, results, args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Synthetic test clips for the benchmarks, written with OpenCV so no sample media is needed."""
+import hashlib
+import logging
+import os
+import random
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _scene(rng, width, height):
+    """A background gradient and a few shapes that drift across the frame."""
+    top = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    bottom = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    ramp = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    background = (top * (1 - ramp) + bottom * ramp).astype(np.uint8)
+    background = np.repeat(background, width, axis=1)
+    shapes = []
+    for _ in range(rng.randint(2, 5)):
+        shapes.append({
+            'circle': rng.random() < 0.5,
+            'size': rng.randint(max(4, min(width, height) // 20), max(8, min(width, height) // 5)),
+            'x': rng.uniform(0, width), 'y': rng.uniform(0, height),
+            'dx': rng.uniform(-1, 1) * width / 200, 'dy': rng.uniform(-1, 1) * height / 200,
+            'color': tuple(rng.randrange(256) for _ in range(3)),
+        })
+    return background, shapes
+
+
+def _draw(background, shapes, step):
+    frame = background.copy()
+    height, width = frame.shape[:2]
+    for shape in shapes:
+        x = int(shape['x'] + shape['dx'] * step) % width
+        y = int(shape['y'] + shape['dy'] * step) % height
+        if shape['circle']:
+            cv2.circle(frame, (x, y), shape['size'], shape['color'], -1)
+        else:
+            cv2.rectangle(frame, (x, y), (x + shape['size'], y + shape['size']), shape['color'], -1)
+    return frame
+
+
+def write_video(path, duration=30.0, fps=30.0, width=1280, height=720, scene_changes=5, seed=0):
+    """Writes an MPEG-4 clip of duration seconds with scene_changes hard cuts, evenly spaced.
+
+    Each scene has its own background and moving shapes, so scene-change samplers and the
+    perceptual-hash cache see the same kind of content changes as in real footage.
+    """
+    rng = random.Random(seed)
+    total_frames = max(1, int(round(duration * fps)))
+    scene_length = max(1, total_frames // (scene_changes + 1))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise IOError(f"Cannot write video file: {path}")
+    try:
+        for index in range(total_frames):
+            if index % scene_length == 0:
+                background, shapes = _scene(rng, width, height)
+            writer.write(_draw(background, shapes, index % scene_length))
+    finally:
+        writer.release()
+    return path
+
+
+def synthetic_video(cache_dir, duration=30.0, fps=30.0, width=1280, height=720, scene_changes=5, seed=0):
+    """Returns the path of a clip with these parameters, generating it on first use."""
+    params = f"{duration}:{fps}:{width}:{height}:{scene_changes}:{seed}"
+    name = f"synthetic_{width}x{height}_{duration:g}s_{hashlib.sha1(params.encode()).hexdigest()[:10]}.mp4"
+    path = os.path.join(cache_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        logger.info(f"Generating synthetic video {path}")
+        tmp_path = f"{path}.part.mp4"
+        write_video(tmp_path, duration, fps, width, height, scene_changes, seed)
+        os.replace(tmp_path, path)
+    return path
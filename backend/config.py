@@ -14,8 +14,40 @@ class Config:
     GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS','credential/agent-sa-key.json')
     GCP_VERTEX_AI_API_KEY = os.environ.get('GCP_VERTEX_AI_API_KEY')
     GEMINI_MODEL_NAME = os.environ.get('GEMINI_MODEL_NAME', 'gemini-2.0-flash') # Default model
+    LLM_BATCH_SIZE = int(os.environ.get('LLM_BATCH_SIZE', 1)) # Frames sent to Gemini per request, 1 disables batching
+    LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() == 'true' # Reuse results for near-identical frames
+    LLM_CACHE_MAX_DISTANCE = int(os.environ.get('LLM_CACHE_MAX_DISTANCE', 3)) # Max Hamming distance between frame hashes (0-7)
+    LLM_CACHE_MEMORY_SIZE = int(os.environ.get('LLM_CACHE_MEMORY_SIZE', 4096)) # Entries kept in the in-memory LRU
+    LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', 'cache/llm_results.sqlite') # SQLite file for the persistent tier, empty to disable
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8)) # Gemini calls in flight across all analyses of the process
+    LLM_REQUESTS_PER_MINUTE = int(os.environ.get('LLM_REQUESTS_PER_MINUTE', 0)) # Gemini requests/min quota of the process, 0 for no limit
+    LLM_TOKENS_PER_MINUTE = int(os.environ.get('LLM_TOKENS_PER_MINUTE', 0)) # Gemini tokens/min quota of the process, 0 for no limit
+    LLM_ESTIMATED_OUTPUT_TOKENS = int(os.environ.get('LLM_ESTIMATED_OUTPUT_TOKENS', 400)) # Output tokens reserved per frame, corrected by the actual usage
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 5)) # Retries of quota and transient errors before the analysis fails
+    LLM_RETRY_BASE_DELAY = float(os.environ.get('LLM_RETRY_BASE_DELAY', 1)) # seconds, doubled on every retry and jittered
+    LLM_RETRY_MAX_DELAY = float(os.environ.get('LLM_RETRY_MAX_DELAY', 60)) # seconds
+    LLM_FRAME_MAX_SIZE = int(os.environ.get('LLM_FRAME_MAX_SIZE', 1536)) # Longest side, in pixels, of frames sent to Gemini, 0 keeps the source resolution
+    LLM_FRAME_FORMAT = os.environ.get('LLM_FRAME_FORMAT', 'jpeg') # 'jpeg', 'webp' or 'png'
+    LLM_FRAME_QUALITY = int(os.environ.get('LLM_FRAME_QUALITY', 85)) # 1-100, for jpeg and webp
+    STORAGE_FRAME_MAX_SIZE = int(os.environ.get('STORAGE_FRAME_MAX_SIZE', LLM_FRAME_MAX_SIZE)) # Same settings as the LLM frames reuse their bytes for the upload
+    STORAGE_FRAME_FORMAT = os.environ.get('STORAGE_FRAME_FORMAT', LLM_FRAME_FORMAT)
+    STORAGE_FRAME_QUALITY = int(os.environ.get('STORAGE_FRAME_QUALITY', LLM_FRAME_QUALITY))
     GCS_BUCKET_NAME_VIDEOS = os.environ.get('GCS_BUCKET_NAME_VIDEOS')
     GCS_BUCKET_NAME_FRAMES = os.environ.get('GCS_BUCKET_NAME_FRAMES')
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'gcs') # 'gcs', or 'local' to keep buckets on the filesystem (tests, offline dev)
+    LOCAL_STORAGE_ROOT = os.environ.get('LOCAL_STORAGE_ROOT', 'uploads/storage') # Root directory of the local buckets
+    FRAME_UPLOAD_CONCURRENCY = int(os.environ.get('FRAME_UPLOAD_CONCURRENCY', 8)) # Parallel frame uploads
+    FRAME_UPLOAD_MAX_RETRIES = int(os.environ.get('FRAME_UPLOAD_MAX_RETRIES', 3))
+    FRAME_UPLOAD_BACKOFF_SECONDS = float(os.environ.get('FRAME_UPLOAD_BACKOFF_SECONDS', 0.5)) # Base delay, doubled on every retry
+    DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', 100)) # Blobs per batched GCS delete request (at most 100)
+    DELETE_CONCURRENCY = int(os.environ.get('DELETE_CONCURRENCY', 8)) # Batched delete requests in flight
+    VIDEO_DELETION_WORKERS = int(os.environ.get('VIDEO_DELETION_WORKERS', 2)) # Videos whose blobs are deleted at once
+    VIDEO_DELETION_PROGRESS_INTERVAL = float(os.environ.get('VIDEO_DELETION_PROGRESS_INTERVAL', 2)) # seconds between progress writes of a deletion
+    VIDEO_DELETION_STALE_SECONDS = float(os.environ.get('VIDEO_DELETION_STALE_SECONDS', 300)) # Unfinished deletions idle for this long are resumed at startup
+    SIGNED_URL_CACHE_TTL = float(os.environ.get('SIGNED_URL_CACHE_TTL', 2700)) # seconds, capped at 50 min since signatures expire after 1 hour
+    SIGNED_URL_CACHE_SIZE = int(os.environ.get('SIGNED_URL_CACHE_SIZE', 10000))
+    VIDEO_METADATA_CACHE_TTL = float(os.environ.get('VIDEO_METADATA_CACHE_TTL', 300)) # seconds, entries are also dropped on delete
+    VIDEO_METADATA_CACHE_SIZE = int(os.environ.get('VIDEO_METADATA_CACHE_SIZE', 1024))
 
     # AlloyDB Config (Example, adjust as needed for connection method)
     ALLOYDB_CONNECTION_STRING = os.environ.get('ALLOYDB_CONNECTION_STRING') # Or individual settings
@@ -25,12 +57,72 @@ class Config:
     ALLOYDB_PASSWORD = os.environ.get('ALLOYDB_PASSWORD')
     ALLOYDB_HOST = os.environ.get('ALLOYDB_HOST')
     ALLOYDB_PORT = os.environ.get('ALLOYDB_PORT')
+    DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', 'true').lower() == 'true' # Apply db/migrations.py at startup
+    DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1)) # Connections opened at startup
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10)) # Upper bound of concurrent connections
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30)) # seconds to wait for a free connection
+    DB_POOL_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', 60)) # seconds idle before a connection is pinged on checkout
+
+    # Vector Search Config
+    VECTOR_SEARCH_BACKEND = os.environ.get('VECTOR_SEARCH_BACKEND', 'alloydb') # 'alloydb' (SQL similarity search) or 'local' (in-process index)
+    EMBEDDER = os.environ.get('EMBEDDER', 'alloydb') # 'alloydb' (embedding() in the database) or 'local' (hashing, offline dev only)
+    EMBEDDING_MODEL_NAME = os.environ.get('EMBEDDING_MODEL_NAME', 'text-embedding-005') # Must match the model of the frames' generated columns
+    LOCAL_EMBEDDING_DIM = int(os.environ.get('LOCAL_EMBEDDING_DIM', 768))
+    QUERY_SEARCH_MODE = os.environ.get('QUERY_SEARCH_MODE', 'description') # Default of /query: 'description', 'objects' or 'hybrid'
+    QUERY_FUSION = os.environ.get('QUERY_FUSION', 'rrf') # Hybrid score fusion: 'rrf' (reciprocal rank) or 'weighted' (sum of similarities)
+    QUERY_HYBRID_DESCRIPTION_WEIGHT = float(os.environ.get('QUERY_HYBRID_DESCRIPTION_WEIGHT', 0.5)) # Weight of the description side, 0-1
+    QUERY_RRF_K = int(os.environ.get('QUERY_RRF_K', 60)) # Reciprocal rank fusion constant, higher flattens the rank weighting
+    QUERY_SEGMENT_MAX_GAP_MS = int(os.environ.get('QUERY_SEGMENT_MAX_GAP_MS', 2000)) # Matching frames at most this far apart are returned as one segment
+    QUERY_SEGMENT_CANDIDATES = int(os.environ.get('QUERY_SEGMENT_CANDIDATES', 50)) # Best frames collapsed into segments when a query asks for them
+    VECTOR_ANN_EF_SEARCH = int(os.environ.get('VECTOR_ANN_EF_SEARCH', 100)) # hnsw.ef_search of library searches, higher is more accurate and slower
+    VECTOR_ANN_CANDIDATES = int(os.environ.get('VECTOR_ANN_CANDIDATES', 100)) # Nearest frames per embedding fused by hybrid library searches
+    VECTOR_ANN_ITERATIVE_SCAN = os.environ.get('VECTOR_ANN_ITERATIVE_SCAN', 'off') # pgvector >= 0.8 'relaxed_order' fills filtered searches
+    QUERY_EMBEDDING_CACHE_ENABLED = os.environ.get('QUERY_EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true' # Embed each distinct query once
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', 1024)) # Queries kept in the in-memory LRU
+    QUERY_EMBEDDING_CACHE_PATH = os.environ.get('QUERY_EMBEDDING_CACHE_PATH', 'cache/query_embeddings.sqlite') # SQLite file for the persistent tier, empty to disable
+    VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', 'cache/vector_index') # Persisted per-video indexes, memory-mapped on load
+    VECTOR_INDEX_HNSW_THRESHOLD = int(os.environ.get('VECTOR_INDEX_HNSW_THRESHOLD', 5000)) # Frames above which a video uses HNSW instead of brute force
+    VECTOR_INDEX_HNSW_M = int(os.environ.get('VECTOR_INDEX_HNSW_M', 16)) # Graph links per node
+    VECTOR_INDEX_HNSW_EF_CONSTRUCTION = int(os.environ.get('VECTOR_INDEX_HNSW_EF_CONSTRUCTION', 100))
+    VECTOR_INDEX_HNSW_EF_SEARCH = int(os.environ.get('VECTOR_INDEX_HNSW_EF_SEARCH', 64)) # Higher is more accurate and slower
+    VECTOR_INDEX_SAVE_INTERVAL = float(os.environ.get('VECTOR_INDEX_SAVE_INTERVAL', 60)) # Seconds between saves of an index an analysis is adding to, also saved when it ends
 
     # Video Analysis Config
     VIDEO_UPLOAD_FOLDER_VIDEOS = 'uploads/videos' # Local upload folder for videos (for local dev)
     VIDEO_UPLOAD_FOLDER_FRAMES = 'uploads/frames' # Local folder for frames
+    UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', 'uploads/sessions') # Chunks of in-progress resumable uploads
+    VIDEO_UPLOAD_CHUNK_SIZE = int(os.environ.get('VIDEO_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)) # Chunk size suggested to upload clients
+    VIDEO_CACHE_DIR = os.environ.get('VIDEO_CACHE_DIR', 'uploads/video_cache') # Content-addressed local copies of videos
+    VIDEO_CACHE_MAX_BYTES = int(os.environ.get('VIDEO_CACHE_MAX_BYTES', 20 * 1024 ** 3)) # Least recently used videos are evicted beyond this
+    GCS_UPLOAD_CHUNK_SIZE = int(os.environ.get('GCS_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)) # Resumable GCS upload chunk, multiple of 256 KB
     VIDEO_SAMPLING_RATE = int(os.environ.get('VIDEO_SAMPLING_RATE', 5)) # Frames per second, default 5
+    VIDEO_FRAME_SEEK_MODE = os.environ.get('VIDEO_FRAME_SEEK_MODE', 'grab') # 'grab', 'keyframe' or 'timestamp'
+    VIDEO_DECODE_PROCESSES = int(os.environ.get('VIDEO_DECODE_PROCESSES', 0)) # Processes decoding segments of a video in parallel, 0 or 1 decodes on the analysis thread
+    VIDEO_DECODE_SEGMENT_FRAMES = int(os.environ.get('VIDEO_DECODE_SEGMENT_FRAMES', 16)) # Sampled frames per decoded segment, about (processes + 1) segments of frames are held at once
+    VIDEO_DECODE_HANDOFF = os.environ.get('VIDEO_DECODE_HANDOFF', 'shared_memory') # How decoded frames reach the analysis: 'shared_memory' or 'bytes' (pickled through a pipe)
+    VIDEO_DECODE_START_METHOD = os.environ.get('VIDEO_DECODE_START_METHOD', '') # multiprocessing start method of the decode processes, empty uses forkserver where available
+    FRAME_SAMPLER = os.environ.get('FRAME_SAMPLER', 'fixed') # 'fixed' (every sampled frame) or 'scene_change'
+    SCENE_CHANGE_PIXEL_THRESHOLD = float(os.environ.get('SCENE_CHANGE_PIXEL_THRESHOLD', 0.08)) # Mean grayscale difference, 0-1
+    SCENE_CHANGE_HISTOGRAM_THRESHOLD = float(os.environ.get('SCENE_CHANGE_HISTOGRAM_THRESHOLD', 0.25)) # Color histogram distance, 0-1
+    SCENE_CHANGE_MAX_GAP_SECONDS = float(os.environ.get('SCENE_CHANGE_MAX_GAP_SECONDS', 10)) # Always analyze at least one frame per gap
     ANALYSIS_PROGRESS_UPDATE_INTERVAL = 5 # seconds, interval to update analysis progress
+    ANALYSIS_LLM_WORKERS = int(os.environ.get('ANALYSIS_LLM_WORKERS', 4)) # Frames analyzed concurrently per video
+    ANALYSIS_QUEUE_SIZE = int(os.environ.get('ANALYSIS_QUEUE_SIZE', 16)) # Decoded frames buffered ahead of the LLM workers
+    FRAME_WRITER_BATCH_SIZE = int(os.environ.get('FRAME_WRITER_BATCH_SIZE', 50)) # Frame rows per bulk INSERT
+    FRAME_WRITER_FLUSH_INTERVAL = float(os.environ.get('FRAME_WRITER_FLUSH_INTERVAL', 5)) # seconds, max age of buffered frame rows
+    ANALYSIS_EMBEDDED_WORKER = os.environ.get('ANALYSIS_EMBEDDED_WORKER', 'true').lower() == 'true' # Run queued jobs in the API process too
+    ANALYSIS_WORKER_CONCURRENCY = int(os.environ.get('ANALYSIS_WORKER_CONCURRENCY', 1)) # Jobs run at once per worker process
+    ANALYSIS_WORKER_POLL_INTERVAL = float(os.environ.get('ANALYSIS_WORKER_POLL_INTERVAL', 2)) # seconds between claims when the queue is empty
+    ANALYSIS_JOB_LEASE_SECONDS = float(os.environ.get('ANALYSIS_JOB_LEASE_SECONDS', 60)) # A job without heartbeat for this long is claimed again
+    ANALYSIS_JOB_HEARTBEAT_INTERVAL = float(os.environ.get('ANALYSIS_JOB_HEARTBEAT_INTERVAL', 5)) # seconds, also how fast cancellation and progress propagate
+    ANALYSIS_CHECKPOINT_INTERVAL = float(os.environ.get('ANALYSIS_CHECKPOINT_INTERVAL', 10)) # seconds between saves of the resume position
+    ANALYSIS_JOB_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_JOB_MAX_ATTEMPTS', 3)) # Claims before a job whose workers keep dying is marked Error
+    WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', 0)) # Port worker.py serves /metrics on, 0 to disable (the API serves /api/metrics)
+    VIDEO_LIST_PAGE_SIZE = int(os.environ.get('VIDEO_LIST_PAGE_SIZE', 50)) # Videos per GET /api/videos page when the client sends no limit
+    VIDEO_LIST_MAX_PAGE_SIZE = int(os.environ.get('VIDEO_LIST_MAX_PAGE_SIZE', 200)) # Largest limit a client may ask for
+    PROGRESS_STREAM_INTERVAL = float(os.environ.get('PROGRESS_STREAM_INTERVAL', 1)) # seconds between polls of the job table for progress streams
+    PROGRESS_STREAM_KEEPALIVE = float(os.environ.get('PROGRESS_STREAM_KEEPALIVE', 15)) # seconds of silence before a keepalive comment is sent to stream clients
+    PROGRESS_STREAM_MAX_VIDEOS = int(os.environ.get('PROGRESS_STREAM_MAX_VIDEOS', 100)) # Videos one progress stream may subscribe to
 
     # Ensure upload folders exist
     os.makedirs(VIDEO_UPLOAD_FOLDER_VIDEOS, exist_ok=True)
@@ -1,8 +1,18 @@
 import logging
 import numpy as np
 import json
+import re
 import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+import threading
+import time
+from contextlib import contextmanager
 import traceback
+import uuid
+from db.migrations import MIGRATIONS, Concurrently
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +26,16 @@ def _create_connection_string(user,password,host,port,database):
 
     return conn_string
 
+_CONCURRENT_INDEX = re.compile(r'CREATE (?:UNIQUE )?INDEX CONCURRENTLY IF NOT EXISTS (\w+)', re.IGNORECASE)
+
+def _vector_literal(vector):
+    """Formats an embedding as a pgvector literal, '[0.1,0.2,...]'."""
+    return '[' + ','.join(f'{float(x):.7g}' for x in vector) + ']'
+
 class Database:
     def __init__(self, config):
         self.config = config
-        self.connection = None
+        self.pool = None
 
         # connection_string = self.config.get("ALLOYDB_CONNECTION_STRING")
 
@@ -30,20 +46,149 @@ class Database:
             self.config.get("ALLOYDB_PORT"),
             self.config.get("ALLOYDB_DATABASE_NAME")
         )
-        print(f" Connection String is {connection_string}")
+
+        min_size = int(self.config.get("DB_POOL_MIN_SIZE", 1))
+        max_size = int(self.config.get("DB_POOL_MAX_SIZE", 10))
+        self.pool_timeout = float(self.config.get("DB_POOL_TIMEOUT", 30))
+        self.healthcheck_interval = float(self.config.get("DB_POOL_HEALTHCHECK_INTERVAL", 60))
+        # ThreadedConnectionPool raises instead of waiting when exhausted, so callers queue on this semaphore
+        self._pool_slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {} # id(connection) -> monotonic time it was last returned to the pool
 
         try:
-            self.connection = psycopg2.connect(connection_string)
-            logger.info("Successfully connected to AlloyDB using connection string.")
+            self.pool = ThreadedConnectionPool(min_size, max_size, connection_string)
+            logger.info(f"Successfully connected to AlloyDB using connection string, pool size {min_size}-{max_size}.")
         except psycopg2.Error as e:
             logger.error(f"Error connecting to AlloyDB using connection string: {e}", exc_info=True)
             raise  # Re-raise the exception to halt application startup
 
+        if self.config.get("DB_AUTO_MIGRATE", True):
+            self.apply_migrations()
+
+    def close(self):
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+            logger.info("Database connection pool closed.")
+
     def __del__(self):
-        """Ensure database connection is closed when the object is destroyed."""
-        if self.connection:
-            self.connection.close()
-            logger.info("Database connection closed.")
+        """Ensure database connections are closed when the object is destroyed."""
+        self.close()
+
+    def apply_migrations(self):
+        """Applies the pending schema migrations from db/migrations.py, in version order.
+
+        Each migration is committed on its own, the statements of a Concurrently migration
+        run in autocommit and the migration is recorded once they all succeeded.
+        """
+        with self._connection() as conn, conn.cursor() as cur:
+            # Only one process migrates at a time, the others wait and then find nothing to do. A session
+            # lock rather than a transaction one, it is held across the migrations that run outside transactions
+            cur.execute("SELECT pg_advisory_lock(hashtext('video_analysis_schema_migrations'))")
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TIMESTAMP DEFAULT now()
+                    )
+                """)
+                cur.execute("SELECT version FROM schema_migrations")
+                applied = {row[0] for row in cur.fetchall()}
+                conn.commit()
+                for version, description, statements in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    logger.info(f"Applying schema migration {version}: {description}")
+                    if isinstance(statements, Concurrently):
+                        conn.autocommit = True
+                        try:
+                            for statement in statements:
+                                self._drop_invalid_index(cur, statement)
+                                cur.execute(statement)
+                        finally:
+                            conn.autocommit = False
+                    else:
+                        for statement in statements:
+                            cur.execute(statement)
+                    cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description))
+                    conn.commit()
+            finally:
+                if not conn.closed:
+                    conn.rollback()
+                    cur.execute("SELECT pg_advisory_unlock(hashtext('video_analysis_schema_migrations'))")
+
+    def _drop_invalid_index(self, cur, statement):
+        """Drops the index a CREATE INDEX CONCURRENTLY statement builds if an interrupted build left it invalid.
+
+        IF NOT EXISTS would otherwise keep the invalid index, which is maintained on writes but never used.
+        """
+        match = _CONCURRENT_INDEX.match(statement)
+        if match is None:
+            return
+        cur.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (match.group(1),))
+        row = cur.fetchone()
+        if row and row[0]:
+            logger.warning(f"Dropping index {match.group(1)} left invalid by an interrupted build")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        idle_for = time.monotonic() - self._last_used.get(id(connection), 0)
+        if idle_for < self.healthcheck_interval:
+            return True
+        try:
+            with connection.cursor() as cur:
+                cur.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding broken pooled connection: {e}")
+            return False
+
+    def _checkout(self):
+        connection = self.pool.getconn()
+        if self._is_healthy(connection):
+            return connection
+        # Reconnect once, the pool opens a fresh connection after a discarded one
+        self._discard(connection)
+        return self.pool.getconn()
+
+    def _discard(self, connection):
+        self._last_used.pop(id(connection), None)
+        self.pool.putconn(connection, close=True)
+
+    @contextmanager
+    def _connection(self):
+        """Checks a connection out of the pool for one operation.
+
+        Commits when the block succeeds and rolls back when it raises. Connections that
+        turn out to be broken are closed instead of being returned to the pool.
+        """
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            raise PoolError(f"Timed out after {self.pool_timeout}s waiting for a database connection")
+        connection = None
+        try:
+            connection = self._checkout()
+            try:
+                yield connection
+                connection.commit()
+            except BaseException:
+                if not connection.closed:
+                    try:
+                        connection.rollback()
+                    except psycopg2.Error:
+                        pass
+                raise
+        finally:
+            if connection is not None:
+                if connection.closed or connection.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+                    self._discard(connection)
+                else:
+                    self._last_used[id(connection)] = time.monotonic()
+                    self.pool.putconn(connection)
+            self._pool_slots.release()
             
 # - Table Name : videos
 # - Schema:
@@ -51,13 +196,15 @@ class Database:
 # 	video_id VARCHAR(255) PRIMARY KEY,
 # 	filename VARCHAR(255),
 # 	video_gcs_uri VARCHAR(255),
-# 	upload_date TIMESTAMP
+# 	upload_date TIMESTAMP,
+# 	checksum VARCHAR(64)
 	
 # create table videos (
 # 	video_id VARCHAR(255) PRIMARY KEY,
 # 	filename VARCHAR(255),
 # 	video_gcs_uri VARCHAR(255),
-# 	upload_date TIMESTAMP
+# 	upload_date TIMESTAMP,
+# 	checksum VARCHAR(64)
 # 					)
 
     def store_video_metadata(self, video_metadata):
@@ -67,15 +214,15 @@ class Database:
         video_gcs_uri = video_metadata['video_gcs_uri']
         filename = video_metadata['filename']
         upload_date = video_metadata['upload_date']
+        checksum = video_metadata.get('checksum')
         
         logger.debug(f"Storing video metadata for video ID: {video_id}, video Name: {filename}")
         try:
-            with self.connection.cursor() as cur:
+            with self._connection() as conn, conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO videos (video_id, video_gcs_uri, filename, upload_date)
-                    VALUES (%s, %s, %s, %s)
-                """, (video_id, video_gcs_uri, filename, upload_date))
-            self.connection.commit()
+                    INSERT INTO videos (video_id, video_gcs_uri, filename, upload_date, checksum)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (video_id, video_gcs_uri, filename, upload_date, checksum))
             logger.debug(f"Video metadata stored successfully for video ID: {video_id}")
         except Exception as e:
             logger.error(f"Error storing video metadata for video ID {video_id}: {e}", exc_info=True)
@@ -86,9 +233,9 @@ class Database:
         # Placeholder implementation - replace with actual AlloyDB vector search
         logger.debug(f"Get video metadata for video ID: {video_id}")
         try:
-            with self.connection.cursor() as cur:
+            with self._connection() as conn, conn.cursor() as cur:
                 cur.execute("""
-                    SELECT video_id, video_gcs_uri, filename, upload_date
+                    SELECT video_id, video_gcs_uri, filename, upload_date, checksum
                     FROM videos
                     WHERE video_id = %(video_id)s
                 """, {"video_id": video_id}) # Convert numpy array to list for psycopg2
@@ -98,90 +245,350 @@ class Database:
                     return None
                 else:
                     logger.debug(f"Found video with id {video_id}.")
-                    return dict(zip(['video_id', 'video_gcs_uri', 'filename', 'upload_date'], result))
+                    return dict(zip(['video_id', 'video_gcs_uri', 'filename', 'upload_date', 'checksum'], result))
                     # return result
         except Exception as e:
             logger.error(f"Error during video get operation for video {video_id}: {e}", exc_info=True)
             return None # Placeholder - return Null for now
     
-    def list_video_metadata(self):
-        """Lists all videos' metadata."""
-        logger.debug("Listing all video metadata")
+    def update_video_checksum(self, video_id, checksum):
+        """Records the SHA-256 of a video's content, for videos uploaded before checksums were kept."""
         try:
-            with self.connection.cursor() as cur:
-              cur.execute("""
-                  SELECT video_id, video_gcs_uri, filename, upload_date
-                  FROM videos
-              """)
-              results = cur.fetchall()
-              logger.debug(f"Found {len(results)} videos")
-              video_list = [dict(zip(['video_id', 'video_gcs_uri', 'filename', 'upload_date'], row)) for row in results]
-              return video_list
+            with self._connection() as conn, conn.cursor() as cur:
+                cur.execute("UPDATE videos SET checksum = %(checksum)s WHERE video_id = %(video_id)s", {"video_id": video_id, "checksum": checksum})
         except Exception as e:
-            logger.error(f"Error during list all video metadata: {e}", exc_info=True)
-            return []
+            logger.error(f"Error updating checksum for video ID {video_id}: {e}", exc_info=True)
+
+    # Columns the video list can be sorted by, each backed by a (column, video_id) index
+    VIDEO_SORT_COLUMNS = ('upload_date', 'filename')
+
+    def list_videos_page(self, limit=50, sort='upload_date', descending=True, after=None, status=None, filename_contains=None):
+        """Gets one page of videos with their analysis status and frame count.
 
-    def delete_video_metadata(self, video_id):
-        """Deletes a video's metadata."""
+        Keyset pagination: after is the (sort value, video_id) of the last video of the previous
+        page, so every page is an index seek whatever its depth. Returns (videos, has_more).
+        """
+        if sort not in self.VIDEO_SORT_COLUMNS:
+            raise ValueError(f"Cannot sort videos by {sort}")
+        conditions, params = [], {"limit": limit + 1}
+        if after is not None:
+            conditions.append(f"({sort}, video_id) {'<' if descending else '>'} (%(after_value)s, %(after_id)s)")
+            params.update(after_value=after[0], after_id=after[1])
+        if status is not None:
+            conditions.append("analysis_status = %(status)s")
+            params["status"] = status
+        if filename_contains:
+            conditions.append("filename ILIKE %(filename_pattern)s ESCAPE '\\'")
+            params["filename_pattern"] = '%' + filename_contains.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        direction = 'DESC' if descending else 'ASC'
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT video_id, video_gcs_uri, filename, upload_date, analysis_status, frame_count
+                FROM videos
+                {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+                ORDER BY {sort} {direction}, video_id {direction}
+                LIMIT %(limit)s
+            """, params)
+            results = cur.fetchall()
+        videos = [dict(zip(['video_id', 'video_gcs_uri', 'filename', 'upload_date', 'analysis_status', 'frame_count'], row)) for row in results[:limit]]
+        return videos, len(results) > limit
+
+    def delete_video_metadata(self, video_id, video_object, frame_prefix):
+        """Deletes a video's rows and records the deletion of its blobs, in one transaction.
+
+        Jobs and checkpoints go with the video (ON DELETE CASCADE). Returns the video_deletions
+        row the blobs are then deleted from, or None when the video does not exist.
+        """
         logger.debug(f"Deleting video metadata for video ID: {video_id}")
-        
-        # First, delete related frames
-        
-        try:
-            with self.connection.cursor() as cur:
-                cur.execute("""
-                    DELETE FROM frames
-                    WHERE video_id = %(video_id)s
-                """, {"video_id" : video_id})
-                self.connection.commit()
-                logger.debug(f"Frame metadata deleted successfully for video ID: {video_id}")
-                
-        except Exception as e:
-            logger.error(f"Error during delete frame operation for video {video_id}: {e}", exc_info=True)
-        
-        # Then delete video    
-        try:
-            with self.connection.cursor() as cur:
-                cur.execute("DELETE FROM videos WHERE video_id = %(video_id)s", {"video_id" : video_id})
-                self.connection.commit()  # Commit the deletion
-                
-                logger.debug(f"Video metadata deleted successfully for video ID: {video_id}")
-        except Exception as e:
-            logger.error(f"Error during video deletion operation for video {video_id}: {e}", exc_info=True)
-        return None # Placeholder - return Null for now
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM frames WHERE video_id = %(video_id)s", {"video_id": video_id})
+            cur.execute("DELETE FROM videos WHERE video_id = %(video_id)s RETURNING frame_count", {"video_id": video_id})
+            result = cur.fetchone()
+            if result is None:
+                return None
+            cur.execute("""
+                INSERT INTO video_deletions (video_id, video_object, frame_prefix, status, frames_total)
+                VALUES (%(video_id)s, %(video_object)s, %(frame_prefix)s, 'Pending', %(frames_total)s)
+                ON CONFLICT (video_id) DO UPDATE
+                SET video_object = EXCLUDED.video_object, frame_prefix = EXCLUDED.frame_prefix, status = 'Pending',
+                    frames_total = EXCLUDED.frames_total, blobs_deleted = 0, error = NULL, updated_at = now()
+                RETURNING video_id, video_object, frame_prefix, status, frames_total, blobs_deleted, error
+            """, {"video_id": video_id, "video_object": video_object, "frame_prefix": frame_prefix, "frames_total": result[0]})
+            logger.debug(f"Video metadata deleted successfully for video ID: {video_id}")
+            return dict(zip(self._VIDEO_DELETION_COLUMNS, cur.fetchone()))
 
+    _FRAME_COLUMNS = ['frame_id', 'video_id', 'frame_gcs_uri', 'timeframe', 'timestamp_ms', 'detected_objects_json', 'text_description']
 
     def get_frames_by_video_id(self, video_id):
         """Gets all frames associated with a video ID."""
         logger.debug(f"Fetching frames for video ID: {video_id}")
         try:
-            with self.connection.cursor() as cur:
+            with self._connection() as conn, conn.cursor() as cur:
                 cur.execute("""
-                    SELECT frame_id, video_id, frame_gcs_uri, timeframe, detected_objects_json, text_description
+                    SELECT frame_id, video_id, frame_gcs_uri, timeframe, timestamp_ms, detected_objects_json, text_description
                     FROM frames
                     WHERE video_id = %(video_id)s
+                    ORDER BY timestamp_ms
                 """, {"video_id" : video_id})
                 results = cur.fetchall()
-                frames = [dict(zip(['frame_id', 'video_id', 'frame_gcs_uri', 'timeframe','detected_objects_json','text_description'], row)) for row in results]
+                frames = [dict(zip(self._FRAME_COLUMNS, row)) for row in results]
                 return frames
         except Exception as e:
             logger.error(f"Error fetching frames for video ID {video_id}: {e}", exc_info=True)
             return []
 
-    def get_analyzed_video_list(self):
-        """Gets all videos associated with frames."""
-        logger.debug("Fetching analyzed Video IDs")
+# - Table Name : video_deletions
+# - Blob deletions of deleted videos, see VideoDeletionService. Status goes Pending -> Running -> Completed / Error.
+
+    _VIDEO_DELETION_COLUMNS = ['video_id', 'video_object', 'frame_prefix', 'status', 'frames_total', 'blobs_deleted', 'error']
+
+    def get_video_deletion(self, video_id):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT {', '.join(self._VIDEO_DELETION_COLUMNS)} FROM video_deletions WHERE video_id = %(video_id)s", {"video_id": video_id})
+            result = cur.fetchone()
+            return dict(zip(self._VIDEO_DELETION_COLUMNS, result)) if result else None
+
+    def update_video_deletion(self, video_id, status, blobs_deleted, error=None):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE video_deletions
+                SET status = %(status)s, blobs_deleted = %(blobs_deleted)s, error = %(error)s, updated_at = now()
+                WHERE video_id = %(video_id)s
+            """, {"video_id": video_id, "status": status, "blobs_deleted": blobs_deleted, "error": error})
+
+    def claim_stale_video_deletions(self, stale_seconds):
+        """Claims the unfinished deletions nobody updated for stale_seconds, left by a process that stopped.
+
+        Claiming touches updated_at, so other processes looking at the same time skip them.
+        """
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+                UPDATE video_deletions SET updated_at = now()
+                WHERE status IN ('Pending', 'Running') AND updated_at < now() - make_interval(secs => %(stale_seconds)s)
+                RETURNING {', '.join(self._VIDEO_DELETION_COLUMNS)}
+            """, {"stale_seconds": stale_seconds})
+            return [dict(zip(self._VIDEO_DELETION_COLUMNS, row)) for row in cur.fetchall()]
+
+# - Table Name : analysis_jobs
+# - Durable analysis queue, see worker.py. Status goes Pending -> Running -> Completed / Cancelled / Error,
+#   or Running -> Cancelling -> Cancelled. A Running job whose lease expires is claimed again by another worker.
+
+    def _sync_video_analysis_status(self, cur, video_ids):
+        """Copies the status of each video's latest job to videos.analysis_status, in the caller's transaction."""
+        if not video_ids:
+            return
+        cur.execute("""
+            UPDATE videos v SET analysis_status = j.status
+            FROM (
+                SELECT DISTINCT ON (video_id) video_id, status FROM analysis_jobs
+                WHERE video_id = ANY(%(video_ids)s)
+                ORDER BY video_id, created_at DESC
+            ) j
+            WHERE v.video_id = j.video_id AND v.analysis_status <> j.status
+        """, {"video_ids": list(set(video_ids))})
+
+    def create_analysis_job(self, video_id, resume=True):
+        """Queues an analysis job, raises ValueError when the video already has a queued or running job.
+
+        resume=False makes the worker ignore the video's checkpoint and start from the first frame.
+        """
+        job_id = str(uuid.uuid4())
         try:
-            with self.connection.cursor() as cur:
+            with self._connection() as conn, conn.cursor() as cur:
                 cur.execute("""
-                   SELECT distinct(video_id) FROM frames
-                """)
-                results = cur.fetchall()
-                frames = [dict(zip(['video_id'], row)) for row in results]
-                return frames
+                    INSERT INTO analysis_jobs (job_id, video_id, status, resume)
+                    VALUES (%(job_id)s, %(video_id)s, 'Pending', %(resume)s)
+                """, {"job_id": job_id, "video_id": video_id, "resume": resume})
+                self._sync_video_analysis_status(cur, [video_id])
+        except psycopg2.errors.UniqueViolation:
+            raise ValueError(f"Analysis already queued or running for video ID: {video_id}")
+        logger.debug(f"Queued analysis job {job_id} for video ID: {video_id}")
+        return job_id
+
+    def claim_analysis_job(self, worker_id, lease_seconds, max_attempts=3):
+        """Claims the oldest pending job, or a running one whose lease expired, for worker_id.
+
+        FOR UPDATE SKIP LOCKED lets any number of workers poll concurrently without blocking
+        each other or claiming the same job. Expired jobs that were being cancelled, or that
+        already used max_attempts, are closed instead of being handed out again.
+        """
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE analysis_jobs
+                SET status = CASE WHEN status = 'Cancelling' THEN 'Cancelled' ELSE 'Error' END,
+                    error = CASE WHEN status = 'Cancelling' THEN error ELSE 'Lease expired after ' || attempts || ' attempts' END,
+                    worker_id = NULL, lease_expires_at = NULL, updated_at = now()
+                WHERE status IN ('Running', 'Cancelling') AND lease_expires_at < now()
+                  AND (status = 'Cancelling' OR attempts >= %(max_attempts)s)
+                RETURNING video_id
+            """, {"max_attempts": max_attempts})
+            self._sync_video_analysis_status(cur, [row[0] for row in cur.fetchall()])
+            cur.execute("""
+                WITH next_job AS (
+                    SELECT job_id FROM analysis_jobs
+                    WHERE status = 'Pending' OR (status = 'Running' AND lease_expires_at < now())
+                    ORDER BY created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE analysis_jobs j
+                SET status = 'Running', worker_id = %(worker_id)s, attempts = j.attempts + 1,
+                    lease_expires_at = now() + make_interval(secs => %(lease_seconds)s),
+                    heartbeat_at = now(), updated_at = now()
+                FROM next_job
+                WHERE j.job_id = next_job.job_id
+                RETURNING j.job_id, j.video_id, j.attempts, j.resume
+            """, {"worker_id": worker_id, "lease_seconds": lease_seconds})
+            result = cur.fetchone()
+            if result is None:
+                return None
+            self._sync_video_analysis_status(cur, [result[1]])
+            return dict(zip(['job_id', 'video_id', 'attempts', 'resume'], result))
+
+    def heartbeat_analysis_job(self, job_id, worker_id, lease_seconds, progress, frames_analyzed=0, frames_per_second=None, eta_seconds=None):
+        """Extends the lease and records progress and throughput.
+
+        Returns whether cancellation was requested, or None when worker_id no longer holds
+        the job (lease expired and re-claimed, or video deleted) and must stop working on it.
+        """
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE analysis_jobs
+                SET lease_expires_at = now() + make_interval(secs => %(lease_seconds)s),
+                    heartbeat_at = now(), progress = %(progress)s, frames_analyzed = %(frames_analyzed)s,
+                    frames_per_second = %(frames_per_second)s, eta_seconds = %(eta_seconds)s, updated_at = now()
+                WHERE job_id = %(job_id)s AND worker_id = %(worker_id)s AND status IN ('Running', 'Cancelling')
+                RETURNING cancel_requested
+            """, {"job_id": job_id, "worker_id": worker_id, "lease_seconds": lease_seconds, "progress": progress,
+                  "frames_analyzed": frames_analyzed, "frames_per_second": frames_per_second, "eta_seconds": eta_seconds})
+            result = cur.fetchone()
+            return result[0] if result else None
+
+    def finish_analysis_job(self, job_id, worker_id, status, error=None):
+        """Records the final status of a job held by worker_id."""
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE analysis_jobs
+                SET status = %(status)s, error = %(error)s,
+                    progress = CASE WHEN %(status)s = 'Completed' THEN 100 ELSE progress END, eta_seconds = NULL,
+                    worker_id = NULL, lease_expires_at = NULL, updated_at = now()
+                WHERE job_id = %(job_id)s AND worker_id = %(worker_id)s
+                RETURNING video_id
+            """, {"job_id": job_id, "worker_id": worker_id, "status": status, "error": error})
+            self._sync_video_analysis_status(cur, [row[0] for row in cur.fetchall()])
+
+    def release_analysis_job(self, job_id, worker_id):
+        """Hands a job back to the queue, used by workers that shut down mid-job."""
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE analysis_jobs
+                SET status = CASE WHEN cancel_requested THEN 'Cancelled' ELSE 'Pending' END,
+                    attempts = GREATEST(attempts - 1, 0),
+                    worker_id = NULL, lease_expires_at = NULL, updated_at = now()
+                WHERE job_id = %(job_id)s AND worker_id = %(worker_id)s
+                RETURNING video_id
+            """, {"job_id": job_id, "worker_id": worker_id})
+            self._sync_video_analysis_status(cur, [row[0] for row in cur.fetchall()])
+
+    def request_analysis_job_cancel(self, video_id):
+        """Flags the video's active job for cancellation, returns False when there is none.
+
+        Pending jobs are cancelled right away, running ones when their worker next heartbeats.
+        """
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE analysis_jobs
+                SET cancel_requested = TRUE,
+                    status = CASE WHEN status = 'Pending' THEN 'Cancelled' ELSE 'Cancelling' END,
+                    updated_at = now()
+                WHERE video_id = %(video_id)s AND status IN ('Pending', 'Running', 'Cancelling')
+            """, {"video_id": video_id})
+            cancelled = cur.rowcount > 0
+            if cancelled:
+                self._sync_video_analysis_status(cur, [video_id])
+            return cancelled
+
+    def get_analysis_job_states(self, video_ids):
+        """Gets status, progress and throughput of the latest job of each video, in one query."""
+        if not video_ids:
+            return []
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT ON (video_id) video_id, status, progress, frames_analyzed, frames_per_second, eta_seconds
+                FROM analysis_jobs
+                WHERE video_id = ANY(%(video_ids)s)
+                ORDER BY video_id, created_at DESC
+            """, {"video_ids": list(video_ids)})
+            return [dict(zip(['video_id', 'status', 'progress', 'frames_analyzed', 'frames_per_second', 'eta_seconds'], row)) for row in cur.fetchall()]
+
+    def get_latest_analysis_job(self, video_id):
+        """Gets the most recent analysis job of a video, None when it was never analyzed."""
+        try:
+            with self._connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT job_id, video_id, status, progress, frames_analyzed, frames_per_second, eta_seconds, worker_id, attempts, error, created_at, updated_at
+                    FROM analysis_jobs
+                    WHERE video_id = %(video_id)s
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                """, {"video_id": video_id})
+                result = cur.fetchone()
+                return dict(zip(['job_id', 'video_id', 'status', 'progress', 'frames_analyzed', 'frames_per_second', 'eta_seconds', 'worker_id', 'attempts', 'error', 'created_at', 'updated_at'], result)) if result else None
         except Exception as e:
-            logger.error(f"Error fetching analyzed videos : {e}", exc_info=True)
+            logger.error(f"Error fetching analysis job for video ID {video_id}: {e}", exc_info=True)
+            return None
+
+    def get_analysis_checkpoint(self, video_id):
+        """Gets the last durably analyzed frame of a video, None when there is no checkpoint."""
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT frame_index, timestamp_ms, config_key FROM analysis_checkpoints WHERE video_id = %(video_id)s
+            """, {"video_id": video_id})
+            result = cur.fetchone()
+            return dict(zip(['frame_index', 'timestamp_ms', 'config_key'], result)) if result else None
+
+    def save_analysis_checkpoint(self, video_id, frame_index, timestamp_ms, config_key):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO analysis_checkpoints (video_id, frame_index, timestamp_ms, config_key)
+                VALUES (%(video_id)s, %(frame_index)s, %(timestamp_ms)s, %(config_key)s)
+                ON CONFLICT (video_id) DO UPDATE
+                SET frame_index = EXCLUDED.frame_index, timestamp_ms = EXCLUDED.timestamp_ms,
+                    config_key = EXCLUDED.config_key, updated_at = now()
+            """, {"video_id": video_id, "frame_index": frame_index, "timestamp_ms": timestamp_ms, "config_key": config_key})
+
+    def delete_analysis_checkpoint(self, video_id):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM analysis_checkpoints WHERE video_id = %(video_id)s", {"video_id": video_id})
+
+    def embed_texts(self, texts, model_name='text-embedding-005'):
+        """Embeds texts with the AlloyDB embedding() function in a single round trip."""
+        if not texts:
             return []
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT embedding(%(model_name)s, t.text)::vector::text
+                FROM unnest(%(texts)s::text[]) WITH ORDINALITY AS t(text, position)
+                ORDER BY t.position
+            """, {"model_name": model_name, "texts": list(texts)})
+            return [json.loads(row[0]) for row in cur.fetchall()]
+
+    def get_frame_embeddings(self, video_id, field='description', frame_ids=None):
+        """Returns (frame, vector) pairs of a video's stored frame_embedding or objects_embedding."""
+        column = {'description': 'frame_embedding', 'objects': 'objects_embedding'}[field]
+        query = f"""
+            SELECT frame_id, video_id, frame_gcs_uri, timeframe, timestamp_ms, detected_objects_json, text_description, {column}::text
+            FROM frames
+            WHERE video_id = %(video_id)s AND {column} IS NOT NULL
+        """
+        if frame_ids is not None:
+            query += " AND frame_id = ANY(%(frame_ids)s)"
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(query, {"video_id": video_id, "frame_ids": list(frame_ids or [])})
+            return [
+                (dict(zip(self._FRAME_COLUMNS, row[:7])), json.loads(row[7]))
+                for row in cur.fetchall()
+            ]
 
 # - Table Name : frames
 # - Schema:
@@ -206,73 +613,255 @@ class Database:
 # 	objects_embedding vector(768) GENERATED ALWAYS AS (embedding('text-embedding-005', detected_objects_json)) STORED
 # 	)
 
+    # Frame ids are derived from the video id and timestamp, so re-analyzed frames replace their previous row
+    _FRAME_UPSERT = """
+        ON CONFLICT (frame_id) DO UPDATE
+        SET frame_gcs_uri = EXCLUDED.frame_gcs_uri, timeframe = EXCLUDED.timeframe, timestamp_ms = EXCLUDED.timestamp_ms,
+            detected_objects_json = EXCLUDED.detected_objects_json, text_description = EXCLUDED.text_description
+        RETURNING video_id, (xmax = 0) AS inserted
+    """
+    # Follows a WITH upserted AS (INSERT ... _FRAME_UPSERT), adds the rows that were inserted rather than replaced to videos.frame_count
+    _FRAME_COUNT_UPDATE = """
+        UPDATE videos v SET frame_count = v.frame_count + counts.inserted
+        FROM (SELECT video_id, count(*) AS inserted FROM upserted WHERE inserted GROUP BY video_id) counts
+        WHERE v.video_id = counts.video_id
+    """
+
+    def _frame_row(self, frame_metadata):
+        detected_objects_json = frame_metadata.get('detected_objects', []) # Example: store detected objects as JSON
+        return (
+            frame_metadata['frame_id'],
+            frame_metadata['video_id'],
+            frame_metadata['frame_gcs_uri'],
+            frame_metadata['timeframe'],
+            frame_metadata.get('timestamp_ms'),
+            json.dumps(detected_objects_json),
+            frame_metadata.get('text_description', ''),
+        )
+
     def store_frame_metadata(self, frame_metadata):
         """Stores frame metadata and its embedding vector."""
-        # Placeholder implementation - replace with actual AlloyDB insert
         frame_id = frame_metadata['frame_id']
         video_id = frame_metadata['video_id']
-        frame_gcs_uri = frame_metadata['frame_gcs_uri']
-        timeframe = frame_metadata['timeframe']
-        detected_objects_json = frame_metadata.get('detected_objects', []) # Example: store detected objects as JSON
-        text_description = frame_metadata.get('text_description', '')
 
         logger.debug(f"Storing frame metadata for frame ID: {frame_id}, video ID: {video_id}")
         try:
-            with self.connection.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO frames (frame_id, video_id, frame_gcs_uri, timeframe, detected_objects_json, text_description)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (frame_id, video_id, frame_gcs_uri, timeframe, json.dumps(detected_objects_json), text_description))
-            self.connection.commit()
+            with self._connection() as conn, conn.cursor() as cur:
+                cur.execute(f"""
+                    WITH upserted AS (
+                        INSERT INTO frames (frame_id, video_id, frame_gcs_uri, timeframe, timestamp_ms, detected_objects_json, text_description)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        {self._FRAME_UPSERT}
+                    )
+                    {self._FRAME_COUNT_UPDATE}
+                """, self._frame_row(frame_metadata))
             logger.debug(f"Frame metadata stored successfully for frame ID: {frame_id}")
         except Exception as e:
             logger.error(f"Error storing frame metadata for frame ID {frame_id}: {e}", exc_info=True)
 
+    def store_frame_metadata_batch(self, frames_metadata):
+        """Upserts many frames with a single multi-row INSERT and one commit.
+
+        Unlike store_frame_metadata, errors are rolled back and re-raised so the caller
+        can decide how to isolate the failing rows.
+        """
+        if not frames_metadata:
+            return
+        # One statement cannot upsert the same frame twice, the last result for a frame id wins
+        rows = list({frame_metadata['frame_id']: self._frame_row(frame_metadata) for frame_metadata in frames_metadata}.values())
+        logger.debug(f"Storing batch of {len(rows)} frames")
+        with self._connection() as conn, conn.cursor() as cur:
+            execute_values(cur, f"""
+                WITH upserted AS (
+                    INSERT INTO frames (frame_id, video_id, frame_gcs_uri, timeframe, timestamp_ms, detected_objects_json, text_description)
+                    VALUES %s
+                    {self._FRAME_UPSERT}
+                )
+                {self._FRAME_COUNT_UPDATE}
+            """, rows, page_size=len(rows))
+
+    @staticmethod
+    def _time_window(params, start_ms=None, end_ms=None, column='timestamp_ms'):
+        """SQL condition keeping frames presented in [start_ms, end_ms), None without bounds. Adds its parameters to params."""
+        conditions = []
+        if start_ms is not None:
+            conditions.append(f"{column} >= %(start_ms)s")
+            params["start_ms"] = int(start_ms)
+        if end_ms is not None:
+            conditions.append(f"{column} < %(end_ms)s")
+            params["end_ms"] = int(end_ms)
+        return " AND ".join(conditions) or None
+
+    def _video_similarity_search(self, column, query_embedding, video_id, top_k, start_ms=None, end_ms=None):
+        """The top_k frames of a video nearest to query_embedding on column, optionally within a time window.
+
+        A window's frames are read through frames_video_timestamp_idx into a materialized CTE and
+        ranked exactly, so the planner cannot post-filter an ANN scan of every frame instead.
+        """
+        params = {
+            "video_id": video_id,
+            "query_embedding": _vector_literal(query_embedding),  # Computed (and cached) by QueryService, not per statement
+            "top_k": top_k,
+        }
+        window = self._time_window(params, start_ms, end_ms)
+        cte, source = "", "frames"
+        if window:
+            cte, source = f"WITH windowed AS MATERIALIZED (SELECT * FROM frames WHERE video_id = %(video_id)s AND {window})", "windowed"
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+                {cte}
+                SELECT frame_id, video_id, frame_gcs_uri, timeframe, timestamp_ms, detected_objects_json, text_description,
+                       1 - ({column} <=> %(query_embedding)s::vector) AS score
+                FROM {source}
+                WHERE video_id = %(video_id)s
+                ORDER BY {column} <=> %(query_embedding)s::vector
+                LIMIT %(top_k)s
+            """, params)
+            return [dict(zip(self._FRAME_COLUMNS + ['score'], row)) for row in cur.fetchall()]
 
-    def frame_description_similarity_search(self, query_str, video_id, top_k=3):
+    def frame_description_similarity_search(self, query_embedding, video_id, top_k=3, start_ms=None, end_ms=None):
         """Performs vector similarity search in AlloyDB to find similar frames."""
-        # Placeholder implementation - replace with actual AlloyDB vector search
         logger.debug(f"Performing Frame Similarity Search for video ID: {video_id}")
         try:
-            with self.connection.cursor() as cur:
-                cur.execute("""
-                    SELECT frame_id, video_id, frame_gcs_uri, timeframe, detected_objects_json, text_description
-                    FROM frames
-                    WHERE video_id = %(video_id)s
-                    ORDER BY frame_embedding <=> embedding('text-embedding-005', %(query_str)s)::vector
-                    LIMIT %(top_k)s
-                """, {
-                    "video_id":video_id, 
-                    "query_str":query_str, 
-                    "top_k":top_k
-                }) # Convert numpy array to list for psycopg2
-                results = cur.fetchall()
-                similar_frames = [dict(zip(['frame_id', 'video_id', 'frame_gcs_uri', 'timeframe','detected_objects_json','text_description'], row)) for row in results]
-                return similar_frames
+            return self._video_similarity_search('frame_embedding', query_embedding, video_id, top_k, start_ms, end_ms)
         except Exception as e:
             logger.error(f"Error during Frame Similarity Search for video {video_id}: {e}", exc_info=True)
-        return [] # Placeholder - return empty list for now
+        return []
 
-    def objects_similarity_search(self, query_str, video_id, top_k=3):
+    def objects_similarity_search(self, query_embedding, video_id, top_k=3, start_ms=None, end_ms=None):
         """Performs vector similarity search in AlloyDB to find similar frames."""
-        # Placeholder implementation - replace with actual AlloyDB vector search
         logger.debug(f"Performing Detected Objects Similarity Search for video ID: {video_id}")
         try:
-            with self.connection.cursor() as cur:
-                cur.execute("""
-                    SELECT frame_id, video_id, frame_gcs_uri, timeframe, detected_objects_json, text_description
-                    FROM frames
-                    WHERE video_id = %(video_id)s
-                    ORDER BY objects_embedding <=> embedding('text-embedding-005', %(query_str)s)::vector
+            return self._video_similarity_search('objects_embedding', query_embedding, video_id, top_k, start_ms, end_ms)
+        except Exception as e:
+            logger.error(f"Error during Detected Objects Similarity Search for video {video_id}: {e}", exc_info=True)
+        return []
+
+    def hybrid_similarity_search(self, query_embedding, video_id, top_k=3, fusion='rrf', description_weight=0.5, rrf_k=60, start_ms=None, end_ms=None):
+        """Ranks frames on frame_embedding and objects_embedding together in one statement.
+
+        fusion='weighted' orders by the weighted sum of both cosine similarities, fusion='rrf'
+        by weighted reciprocal rank fusion, description_weight / (rrf_k + rank) plus the same
+        for the objects rank, which needs no score calibration between the two embeddings.
+        Only frames in [start_ms, end_ms) are ranked when a window is given.
+        """
+        score = {
+            'weighted': "%(weight)s * COALESCE(description_score, 0) + (1 - %(weight)s) * COALESCE(objects_score, 0)",
+            'rrf': "%(weight)s / (%(rrf_k)s + description_rank) + (1 - %(weight)s) / (%(rrf_k)s + objects_rank)",
+        }[fusion]
+        params = {
+            "video_id": video_id,
+            "query_embedding": _vector_literal(query_embedding),
+            "weight": float(description_weight),
+            "rrf_k": int(rrf_k),
+            "top_k": top_k,
+        }
+        window = self._time_window(params, start_ms, end_ms) or "TRUE"
+        logger.debug(f"Performing Hybrid Similarity Search ({fusion}) for video ID: {video_id}")
+        try:
+            with self._connection() as conn, conn.cursor() as cur:
+                cur.execute(f"""
+                    WITH scored AS (
+                        SELECT frame_id, video_id, frame_gcs_uri, timeframe, timestamp_ms, detected_objects_json, text_description,
+                               1 - (frame_embedding <=> %(query_embedding)s::vector) AS description_score,
+                               1 - (objects_embedding <=> %(query_embedding)s::vector) AS objects_score
+                        FROM frames
+                        WHERE video_id = %(video_id)s AND {window}
+                    ), ranked AS (
+                        SELECT *,
+                               RANK() OVER (ORDER BY description_score DESC NULLS LAST) AS description_rank,
+                               RANK() OVER (ORDER BY objects_score DESC NULLS LAST) AS objects_rank
+                        FROM scored
+                    )
+                    SELECT frame_id, video_id, frame_gcs_uri, timeframe, timestamp_ms, detected_objects_json, text_description,
+                           ({score})::float AS score
+                    FROM ranked
+                    ORDER BY score DESC
                     LIMIT %(top_k)s
-                 """, {
-                    "video_id":video_id, 
-                    "query_str":query_str, 
-                    "top_k":top_k
-                }) # Convert numpy array to list for psycopg2
+                """, params)
                 results = cur.fetchall()
-                similar_frames = [dict(zip(['frame_id', 'video_id', 'frame_gcs_uri', 'timeframe','detected_objects_json','text_description'], row)) for row in results]
-                return similar_frames
+                return [dict(zip(self._FRAME_COLUMNS + ['score'], row)) for row in results]
         except Exception as e:
-            logger.error(f"Error during Detected Objects Similarity Search for video {video_id}: {e}", exc_info=True)
-        return [] # Placeholder - return empty list for now
\ No newline at end of file
+            logger.error(f"Error during Hybrid Similarity Search for video {video_id}: {e}", exc_info=True)
+        return []
+
+    def _set_ann_parameters(self, cur, candidates):
+        """Per-transaction HNSW search settings, ef_search is raised to at least the number of rows asked for."""
+        cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(max(int(self.config.get("VECTOR_ANN_EF_SEARCH", 100)), candidates)),))
+        iterative_scan = self.config.get("VECTOR_ANN_ITERATIVE_SCAN", 'off')
+        if iterative_scan and iterative_scan != 'off':
+            # pgvector >= 0.8: keeps scanning the graph until filtered queries fill their LIMIT
+            cur.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (iterative_scan,))
+
+    def library_similarity_search(self, query_embedding, mode='description', top_k=10, video_ids=None, uploaded_after=None, uploaded_before=None,
+                                  fusion='rrf', description_weight=0.5, rrf_k=60, start_ms=None, end_ms=None):
+        """Searches the frames of all videos through the HNSW indexes, optionally filtered by video, upload date and time in the video.
+
+        mode 'hybrid' takes the VECTOR_ANN_CANDIDATES nearest frames on each embedding and fuses them
+        like hybrid_similarity_search, frames missing from one side rank just after its last candidate.
+        """
+        filters = ["TRUE"]
+        params = {
+            "query_embedding": _vector_literal(query_embedding),
+            "top_k": top_k,
+            "weight": float(description_weight),
+            "rrf_k": int(rrf_k),
+        }
+        if video_ids:
+            filters.append("f.video_id = ANY(%(video_ids)s)")
+            params["video_ids"] = list(video_ids)
+        if uploaded_after:
+            filters.append("v.upload_date >= %(uploaded_after)s")
+            params["uploaded_after"] = uploaded_after
+        if uploaded_before:
+            filters.append("v.upload_date < %(uploaded_before)s")
+            params["uploaded_before"] = uploaded_before
+        window = self._time_window(params, start_ms, end_ms, column='f.timestamp_ms')
+        if window:
+            filters.append(window)
+        where = " AND ".join(filters)
+
+        def nearest(column, limit):
+            return f"""
+                SELECT f.frame_id, 1 - (f.{column} <=> %(query_embedding)s::vector) AS score
+                FROM frames f JOIN videos v ON v.video_id = f.video_id
+                WHERE {where}
+                ORDER BY f.{column} <=> %(query_embedding)s::vector
+                LIMIT {int(limit)}
+            """
+
+        if mode == 'hybrid':
+            candidates = max(int(self.config.get("VECTOR_ANN_CANDIDATES", 100)), top_k)
+            fused = {
+                'weighted': "%(weight)s * COALESCE(d.score, 0) + (1 - %(weight)s) * COALESCE(o.score, 0)",
+                'rrf': f"%(weight)s / (%(rrf_k)s + COALESCE(d.rank, {candidates + 1})) + (1 - %(weight)s) / (%(rrf_k)s + COALESCE(o.rank, {candidates + 1}))",
+            }[fusion]
+            ranked = f"""
+                WITH d AS (SELECT frame_id, score, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank FROM ({nearest('frame_embedding', candidates)}) description_candidates),
+                     o AS (SELECT frame_id, score, ROW_NUMBER() OVER (ORDER BY score DESC) AS rank FROM ({nearest('objects_embedding', candidates)}) objects_candidates)
+                SELECT COALESCE(d.frame_id, o.frame_id) AS frame_id, ({fused})::float AS score
+                FROM d FULL OUTER JOIN o ON d.frame_id = o.frame_id
+                ORDER BY score DESC
+                LIMIT %(top_k)s
+            """
+        else:
+            candidates = top_k
+            ranked = nearest({'description': 'frame_embedding', 'objects': 'objects_embedding'}[mode], top_k)
+
+        logger.debug(f"Performing Library Similarity Search ({mode}) over {len(video_ids) if video_ids else 'all'} videos")
+        try:
+            with self._connection() as conn, conn.cursor() as cur:
+                self._set_ann_parameters(cur, candidates)
+                cur.execute(f"""
+                    SELECT f.frame_id, f.video_id, f.frame_gcs_uri, f.timeframe, f.timestamp_ms, f.detected_objects_json, f.text_description,
+                           v.filename, r.score
+                    FROM ({ranked}) r
+                    JOIN frames f ON f.frame_id = r.frame_id
+                    JOIN videos v ON v.video_id = f.video_id
+                    ORDER BY r.score DESC
+                """, params)
+                results = cur.fetchall()
+                return [dict(zip(self._FRAME_COLUMNS + ['filename', 'score'], row)) for row in results]
+        except Exception as e:
+            logger.error(f"Error during Library Similarity Search: {e}", exc_info=True)
+        return []
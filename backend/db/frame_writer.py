@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FrameWriter:
+    """Write-behind buffer for frame rows.
+
+    Frames are collected in memory and written with Database.store_frame_metadata_batch
+    once batch_size rows are buffered, once flush_interval seconds have passed since the
+    last flush (checked by a background thread, so slow jobs still land in the DB), and
+    when the writer is closed at the end of the job or on cancellation.
+
+    A failing batch is split in halves and retried, so one bad row only loses itself.
+    on_flush, when given, is called with every list of rows that was written.
+    """
+
+    def __init__(self, db, batch_size=50, flush_interval=5.0, name='frames', on_flush=None):
+        self.db = db
+        self.on_flush = on_flush
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.name = name
+        self.written = 0
+        self.failed = 0
+
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Serializes batches so rows land in insertion order
+        self._last_flush = time.monotonic()
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._flush_periodically, name=f"{name}-writer", daemon=True)
+        self._timer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def add(self, frame_metadata):
+        with self._buffer_lock:
+            self._buffer.append(frame_metadata)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+            if batch:
+                self._write(batch)
+
+    def pending(self):
+        """Rows buffered and not written yet."""
+        with self._buffer_lock:
+            return len(self._buffer)
+
+    def close(self):
+        """Stops the flush thread and writes whatever is still buffered."""
+        self._closed.set()
+        self._timer.join()
+        self.flush()
+        logger.info(f"[{self.name}] Frame writer closed, {self.written} rows written, {self.failed} rows failed")
+
+    def _flush_periodically(self):
+        while not self._closed.wait(timeout=min(1.0, self.flush_interval)):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def _write(self, batch):
+        try:
+            with metrics.timed(metrics.STAGE_DB_INSERT, batch[0].get('video_id')):
+                self.db.store_frame_metadata_batch(batch)
+            self.written += len(batch)
+            logger.debug(f"[{self.name}] Flushed {len(batch)} frame rows")
+        except Exception as e:
+            error = e
+        else:
+            if self.on_flush:
+                try:
+                    self.on_flush(batch)
+                except Exception as e:
+                    logger.error(f"[{self.name}] Error in flush callback: {e}", exc_info=True)
+            return
+
+        if len(batch) == 1:
+            self.failed += 1
+            logger.error(f"[{self.name}] Dropping frame {batch[0].get('frame_id')}: {error}")
+            return
+        logger.warning(f"[{self.name}] Batch of {len(batch)} frame rows failed, retrying in halves: {error}")
+        middle = len(batch) // 2
+        self._write(batch[:middle])
+        self._write(batch[middle:])
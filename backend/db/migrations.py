@@ -0,0 +1,111 @@
+# Schema migrations applied by Database.apply_migrations() at startup.
+#
+# schema_initialization.sql creates a fresh database at the latest schema; the
+# migrations below bring existing databases forward. Every statement must be
+# idempotent (IF NOT EXISTS, ...) because a fresh database runs them as well.
+# Append new migrations with the next version number, never edit applied ones.
+#
+# A migration's statements run in one transaction, except those of a Concurrently
+# migration: indexes on the large tables are built with CREATE INDEX CONCURRENTLY,
+# which does not block writes but cannot run in a transaction block, so they run one
+# by one in autocommit. A build that fails leaves an invalid index behind, it is
+# dropped and built again when the migration is retried.
+
+
+class Concurrently(list):
+    """Statements of a migration that run outside a transaction, one at a time."""
+
+
+MIGRATIONS = [
+    (1, "Add videos.checksum for the content-addressed local video cache", [
+        "ALTER TABLE videos ADD COLUMN IF NOT EXISTS checksum VARCHAR(64)",
+    ]),
+    (2, "Add HNSW indexes on the frame embeddings for library-wide search", Concurrently([
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS frames_video_id_idx ON frames (video_id)",
+        # m / ef_construction trade build time and size for recall, hnsw.ef_search is tuned per query (VECTOR_ANN_EF_SEARCH)
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS frames_frame_embedding_hnsw_idx ON frames USING hnsw (frame_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS frames_objects_embedding_hnsw_idx ON frames USING hnsw (objects_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS videos_upload_date_idx ON videos (upload_date)",
+    ])),
+    (3, "Add analysis_jobs, the durable queue claimed by analysis workers", [
+        """CREATE TABLE IF NOT EXISTS analysis_jobs (
+            job_id VARCHAR(64) PRIMARY KEY,
+            video_id VARCHAR(255) NOT NULL REFERENCES videos(video_id) ON DELETE CASCADE,
+            status VARCHAR(32) NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+            worker_id VARCHAR(255),
+            lease_expires_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT now(),
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )""",
+        # At most one queued or running job per video
+        "CREATE UNIQUE INDEX IF NOT EXISTS analysis_jobs_active_video_idx ON analysis_jobs (video_id) WHERE status IN ('Pending', 'Running', 'Cancelling')",
+        "CREATE INDEX IF NOT EXISTS analysis_jobs_claim_idx ON analysis_jobs (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS analysis_jobs_video_idx ON analysis_jobs (video_id, created_at DESC)",
+        # Videos analyzed before the job table existed keep reporting Completed
+        """INSERT INTO analysis_jobs (job_id, video_id, status, progress)
+           SELECT 'migrated-' || v.video_id, v.video_id, 'Completed', 100
+           FROM videos v WHERE EXISTS (SELECT 1 FROM frames f WHERE f.video_id = v.video_id)
+           ON CONFLICT DO NOTHING""",
+    ]),
+    (4, "Add analysis_checkpoints and analysis_jobs.resume for resumable analyses", [
+        """CREATE TABLE IF NOT EXISTS analysis_checkpoints (
+            video_id VARCHAR(255) PRIMARY KEY REFERENCES videos(video_id) ON DELETE CASCADE,
+            frame_index INTEGER NOT NULL,
+            timestamp_ms BIGINT NOT NULL,
+            config_key VARCHAR(255) NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )""",
+        "ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS resume BOOLEAN NOT NULL DEFAULT TRUE",
+    ]),
+    (5, "Add analysis throughput columns reported by worker heartbeats", [
+        "ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS frames_analyzed INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS frames_per_second REAL",
+        "ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS eta_seconds REAL",
+    ]),
+    (6, "Keep analysis status and frame count on videos for the paginated video list", [
+        "ALTER TABLE videos ADD COLUMN IF NOT EXISTS analysis_status VARCHAR(32) NOT NULL DEFAULT 'NotAnalyzed'",
+        "ALTER TABLE videos ADD COLUMN IF NOT EXISTS frame_count INTEGER NOT NULL DEFAULT 0",
+        # Keyset pagination seeks on (sort column, video_id)
+        "CREATE INDEX IF NOT EXISTS videos_upload_date_video_id_idx ON videos (upload_date, video_id)",
+        "CREATE INDEX IF NOT EXISTS videos_filename_video_id_idx ON videos (filename, video_id)",
+        "CREATE INDEX IF NOT EXISTS videos_analysis_status_idx ON videos (analysis_status, upload_date, video_id)",
+        # One last scan of frames, the counts are maintained by the frame upserts from now on
+        """UPDATE videos v SET frame_count = f.frames
+           FROM (SELECT video_id, count(*) AS frames FROM frames GROUP BY video_id) f
+           WHERE v.video_id = f.video_id""",
+        """UPDATE videos v SET analysis_status = j.status
+           FROM (SELECT DISTINCT ON (video_id) video_id, status FROM analysis_jobs ORDER BY video_id, created_at DESC) j
+           WHERE v.video_id = j.video_id""",
+    ]),
+    (7, "Add video_deletions, the blob deletions left after a video's rows are deleted", [
+        # No foreign key: the video row is deleted when its deletion is recorded
+        """CREATE TABLE IF NOT EXISTS video_deletions (
+            video_id VARCHAR(255) PRIMARY KEY,
+            video_object VARCHAR(1024),
+            frame_prefix VARCHAR(512) NOT NULL,
+            status VARCHAR(32) NOT NULL,
+            frames_total INTEGER NOT NULL DEFAULT 0,
+            blobs_deleted INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT now(),
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )""",
+        "CREATE INDEX IF NOT EXISTS video_deletions_status_idx ON video_deletions (status, updated_at)",
+    ]),
+    (8, "Add frames.timestamp_ms, the presentation time of frames", [
+        # Not backfilled: the timeframe text of older rows cannot be told apart from a sample count (the original
+        # analysis wrote 'Frame 0.25s' for the first sample at one sample every 4 frames), so those rows stay
+        # NULL: time-range search leaves them out and segment collapsing keeps them as single frames.
+        "ALTER TABLE frames ADD COLUMN IF NOT EXISTS timestamp_ms BIGINT",
+    ]),
+    (9, "Index frames by video and timestamp_ms for time-range search", Concurrently([
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS frames_video_timestamp_idx ON frames (video_id, timestamp_ms)",
+        # Covered by frames_video_timestamp_idx
+        "DROP INDEX CONCURRENTLY IF EXISTS frames_video_id_idx",
+    ])),
+]
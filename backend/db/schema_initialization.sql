@@ -1,4 +1,6 @@
 -- Target Database : video_analysis
+-- Creates the latest schema. Existing databases are upgraded by db/migrations.py,
+-- which the backend applies at startup (DB_AUTO_MIGRATE).
 
 CREATE EXTENSION IF NOT EXISTS vector;
 CREATE EXTENSION IF NOT EXISTS alloydb_scann;
@@ -8,16 +10,75 @@ create table videos (
 	video_id VARCHAR(255) PRIMARY KEY,
 	filename VARCHAR(255),
 	video_gcs_uri VARCHAR(255),
-	upload_date TIMESTAMP
-)
+	upload_date TIMESTAMP,
+	checksum VARCHAR(64),
+	analysis_status VARCHAR(32) NOT NULL DEFAULT 'NotAnalyzed', -- status of the latest analysis job
+	frame_count INTEGER NOT NULL DEFAULT 0
+);
 
 create table frames (
 	frame_id VARCHAR(255) PRIMARY KEY,
 	video_id VARCHAR(255) REFERENCES videos(video_id),
 	frame_gcs_uri VARCHAR(255),
 	timeframe VARCHAR(255),
+	timestamp_ms BIGINT, -- presentation time of the frame in the video
 	detected_objects_json TEXT,
 	text_description TEXT,
 	frame_embedding vector(768) GENERATED ALWAYS AS (embedding('text-embedding-005', text_description)) STORED,
 	objects_embedding vector(768) GENERATED ALWAYS AS (embedding('text-embedding-005', detected_objects_json)) STORED
-)
+);
+
+CREATE INDEX frames_video_timestamp_idx ON frames (video_id, timestamp_ms);
+CREATE INDEX frames_frame_embedding_hnsw_idx ON frames USING hnsw (frame_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+CREATE INDEX frames_objects_embedding_hnsw_idx ON frames USING hnsw (objects_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+CREATE INDEX videos_upload_date_idx ON videos (upload_date);
+CREATE INDEX videos_upload_date_video_id_idx ON videos (upload_date, video_id);
+CREATE INDEX videos_filename_video_id_idx ON videos (filename, video_id);
+CREATE INDEX videos_analysis_status_idx ON videos (analysis_status, upload_date, video_id);
+
+create table analysis_jobs (
+	job_id VARCHAR(64) PRIMARY KEY,
+	video_id VARCHAR(255) NOT NULL REFERENCES videos(video_id) ON DELETE CASCADE,
+	status VARCHAR(32) NOT NULL,
+	progress INTEGER NOT NULL DEFAULT 0,
+	frames_analyzed INTEGER NOT NULL DEFAULT 0,
+	frames_per_second REAL,
+	eta_seconds REAL,
+	cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+	worker_id VARCHAR(255),
+	lease_expires_at TIMESTAMP,
+	heartbeat_at TIMESTAMP,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	error TEXT,
+	resume BOOLEAN NOT NULL DEFAULT TRUE,
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE UNIQUE INDEX analysis_jobs_active_video_idx ON analysis_jobs (video_id) WHERE status IN ('Pending', 'Running', 'Cancelling');
+CREATE INDEX analysis_jobs_claim_idx ON analysis_jobs (status, created_at);
+CREATE INDEX analysis_jobs_video_idx ON analysis_jobs (video_id, created_at DESC);
+
+-- Last frame of each video whose analysis results are durable, analyses resume after it
+create table analysis_checkpoints (
+	video_id VARCHAR(255) PRIMARY KEY REFERENCES videos(video_id) ON DELETE CASCADE,
+	frame_index INTEGER NOT NULL,
+	timestamp_ms BIGINT NOT NULL,
+	config_key VARCHAR(255) NOT NULL,
+	updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Blobs of deleted videos, removed in the background after the video's rows are gone
+create table video_deletions (
+	video_id VARCHAR(255) PRIMARY KEY,
+	video_object VARCHAR(1024),
+	frame_prefix VARCHAR(512) NOT NULL,
+	status VARCHAR(32) NOT NULL,
+	frames_total INTEGER NOT NULL DEFAULT 0,
+	blobs_deleted INTEGER NOT NULL DEFAULT 0,
+	error TEXT,
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX video_deletions_status_idx ON video_deletions (status, updated_at);
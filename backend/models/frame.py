@@ -1,10 +1,11 @@
 # backend/models/frame.py
 
 class Frame:
-    def __init__(self, frame_id, video_id, frame_gcs_uri, timeframe, detected_objects=None, text_description=None):
+    def __init__(self, frame_id, video_id, frame_gcs_uri, timeframe, detected_objects=None, text_description=None, timestamp_ms=None):
         self.frame_id = frame_id
         self.video_id = video_id
         self.frame_gcs_uri = frame_gcs_uri
         self.timeframe = timeframe
+        self.timestamp_ms = timestamp_ms # Presentation time in the video, in milliseconds
         self.detected_objects = detected_objects or [] # List of detected objects
         self.text_description = text_description
\ No newline at end of file
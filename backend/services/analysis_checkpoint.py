@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Namespace of the deterministic frame ids, never change it or re-analyses stop replacing old rows
+FRAME_ID_NAMESPACE = uuid.UUID('5b0f8f7e-3c1a-4f0e-9a43-6f1d2c7b8e91')
+
+
+def frame_id_for(video_id, timestamp_ms):
+    """Frame id derived from the video and the frame's presentation time, stable across re-runs."""
+    return str(uuid.uuid5(FRAME_ID_NAMESPACE, f"{video_id}/{int(timestamp_ms)}"))
+
+
+class AnalysisCheckpoint:
+    """Tracks the last sampled frame of an analysis whose results are durable and saves it periodically.
+
+    A frame is durable once its row was flushed by FrameWriter (written) and its image upload
+    finished; frames without an analysis result only need to have been consumed. Frames are
+    consumed in order, so the checkpoint is the last frame of the longest durable prefix and a
+    resumed analysis can safely start right after it.
+    """
+
+    def __init__(self, db, video_id, config_key, save_interval=10.0):
+        self.db = db
+        self.video_id = video_id
+        self.config_key = config_key
+        self.save_interval = float(save_interval)
+        self.frame_index = None
+        self.timestamp_ms = None
+
+        self._pending = deque() # (frame_index, timestamp_ms, frame_id or None, upload future or None), in consumption order
+        self._written = set()
+        self._saved_index = None
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consumed(self, sampled_frame, frame_id=None, upload_future=None):
+        with self._lock:
+            self._pending.append((sampled_frame.index, sampled_frame.timestamp_ms, frame_id, upload_future))
+        self.save()
+
+    def written(self, frames_metadata):
+        """FrameWriter on_flush callback."""
+        with self._lock:
+            self._written.update(frame_metadata['frame_id'] for frame_metadata in frames_metadata)
+
+    def _advance(self):
+        while self._pending:
+            frame_index, timestamp_ms, frame_id, upload_future = self._pending[0]
+            if frame_id is not None:
+                if frame_id not in self._written:
+                    return
+                if upload_future is not None and (not upload_future.done() or upload_future.exception() is not None):
+                    return # A failed upload pins the checkpoint, so a resumed run analyzes the frame again
+                self._written.discard(frame_id)
+            self._pending.popleft()
+            self.frame_index, self.timestamp_ms = frame_index, timestamp_ms
+
+    def save(self, force=False):
+        """Persists the checkpoint when it moved, at most every save_interval seconds unless forced."""
+        with self._lock:
+            self._advance()
+            if self.frame_index is None or self.frame_index == self._saved_index:
+                return
+            if not force and time.monotonic() - self._last_save < self.save_interval:
+                return
+            frame_index, timestamp_ms = self.frame_index, self.timestamp_ms
+            self._last_save = time.monotonic()
+        try:
+            self.db.save_analysis_checkpoint(self.video_id, frame_index, timestamp_ms, self.config_key)
+            self._saved_index = frame_index
+            logger.debug(f"Checkpoint of video {self.video_id} saved at frame {frame_index} ({timestamp_ms} ms)")
+        except Exception as e:
+            logger.error(f"Error saving checkpoint of video {self.video_id}: {e}", exc_info=True)
@@ -0,0 +1,160 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_END = object() # Marks the end of the work / result stream
+_SKIPPED = object() # Results of a batch that was dropped because the pipeline was cancelled or failed
+
+_POLL_INTERVAL = 0.1 # seconds, how often blocked stages re-check for cancellation
+
+
+class AnalysisPipeline:
+    """Runs produce -> process -> consume as a staged, concurrent pipeline.
+
+    - produce : an iterable of work items, iterated on a dedicated producer thread
+                (e.g. decoding frames).
+    - process : called with a list of up to batch_size consecutive items on a pool of
+                worker threads, returns the list of their results (e.g. the LLM call and
+                frame upload).
+    - consume : called with (item, result) on the calling thread, strictly in the order
+                the items were produced (e.g. the DB write and progress update).
+
+    Batches travel through a bounded queue, and at most queue_size + workers batches are
+    in flight at any time, so a slow worker cannot make the producer run away with memory.
+    Setting cancel_event stops the producer; items that were not yet processed are dropped,
+    while results that are already back are still consumed.
+    """
+
+    def __init__(self, produce, process, consume, workers=4, queue_size=16, cancel_event=None, name='analysis', batch_size=1):
+        self.produce = produce
+        self.process = process
+        self.consume = consume
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.batch_size = max(1, int(batch_size))
+        self.cancel_event = cancel_event or threading.Event()
+        self.name = name
+
+        self._work_queue = queue.Queue(maxsize=self.queue_size)
+        self._result_queue = queue.Queue()
+        self._in_flight = threading.BoundedSemaphore(self.queue_size + self.workers)
+        self._stop_event = threading.Event() # Set on cancellation or on a stage error
+        self._error = None
+        self.produced = 0
+        self.consumed = 0
+
+    def work_queue_depth(self):
+        """Batches decoded and waiting for a worker."""
+        return self._work_queue.qsize()
+
+    def result_queue_depth(self):
+        """Processed batches waiting to be consumed."""
+        return self._result_queue.qsize()
+
+    def _stopped(self):
+        return self._stop_event.is_set() or self.cancel_event.is_set()
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop_event.set()
+
+    def _put_work(self, entry):
+        while True:
+            try:
+                self._work_queue.put(entry, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                # Keep trying even when stopped, workers are still draining the queue
+                continue
+
+    def _batches(self):
+        batch = []
+        for item in self.produce:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _producer(self):
+        try:
+            for sequence, batch in enumerate(self._batches()):
+                while not self._in_flight.acquire(timeout=_POLL_INTERVAL):
+                    if self._stopped():
+                        break
+                if self._stopped():
+                    break
+                self._put_work((sequence, batch))
+                self.produced += len(batch)
+        except Exception as e:
+            logger.error(f"[{self.name}] Producer failed: {e}", exc_info=True)
+            self._fail(e)
+        finally:
+            for _ in range(self.workers):
+                self._put_work(_END)
+
+    def _worker(self):
+        while True:
+            entry = self._work_queue.get()
+            if entry is _END:
+                self._result_queue.put(_END)
+                return
+            sequence, batch = entry
+            if self._stopped():
+                self._result_queue.put((sequence, batch, _SKIPPED))
+                continue
+            try:
+                results = self.process(batch)
+                if len(results) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} results, got {len(results)}")
+            except Exception as e:
+                logger.error(f"[{self.name}] Worker failed on batch {sequence}: {e}", exc_info=True)
+                self._fail(e)
+                results = _SKIPPED
+            self._result_queue.put((sequence, batch, results))
+
+    def run(self):
+        """Runs the pipeline to completion and returns the number of consumed items."""
+        threads = [threading.Thread(target=self._producer, name=f"{self.name}-producer", daemon=True)]
+        threads += [threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        pending = {}
+        next_sequence = 0
+        finished_workers = 0
+        try:
+            while finished_workers < self.workers:
+                entry = self._result_queue.get()
+                if entry is _END:
+                    finished_workers += 1
+                    continue
+                pending[entry[0]] = entry
+                # Consume every result that is next in line
+                while next_sequence in pending:
+                    _, batch, results = pending.pop(next_sequence)
+                    next_sequence += 1
+                    self._in_flight.release()
+                    if results is _SKIPPED:
+                        continue
+                    for item, result in zip(batch, results):
+                        if self._error is not None:
+                            break
+                        try:
+                            self.consume(item, result)
+                            self.consumed += 1
+                        except Exception as e:
+                            logger.error(f"[{self.name}] Consumer failed on batch {next_sequence - 1}: {e}", exc_info=True)
+                            self._fail(e)
+        finally:
+            self._stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+        return self.consumed
@@ -0,0 +1,159 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _RunningJob:
+    def __init__(self, job):
+        self.job_id = job['job_id']
+        self.video_id = job['video_id']
+        self.cancel_event = threading.Event()
+        self.progress = 0
+        self.frames_analyzed = 0
+        self.started = time.monotonic()
+        self.start_progress = None # Progress when the first frame came back, a resumed run starts part way
+        self.resume = job.get('resume', True)
+        self.lease_lost = False
+        self.done = threading.Event()
+
+    def throughput(self):
+        """Frames analyzed per second and estimated seconds left, None until they can be measured."""
+        elapsed = time.monotonic() - self.started
+        if elapsed <= 0 or self.frames_analyzed == 0:
+            return None, None
+        frames_per_second = self.frames_analyzed / elapsed
+        gained = self.progress - (self.start_progress or 0)
+        eta_seconds = (100 - self.progress) * elapsed / gained if gained > 0 else None
+        return frames_per_second, eta_seconds
+
+
+class AnalysisWorker:
+    """Claims analysis jobs from the analysis_jobs table and runs them with VideoAnalysisService.
+
+    Any number of workers, in any number of processes and machines, can poll the same
+    database. Every running job is kept alive by a heartbeat thread that extends its lease
+    and writes its progress and throughput; a worker that dies stops heartbeating, its lease expires and
+    the job is claimed again by another worker. The heartbeat is also how cancellation
+    requests (and lost leases) reach the analysis, through its cancel event.
+    """
+
+    def __init__(self, config, db, video_analysis_service, worker_id=None):
+        self.db = db
+        self.video_analysis_service = video_analysis_service
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.concurrency = max(1, int(config.get('ANALYSIS_WORKER_CONCURRENCY', 1)))
+        self.poll_interval = float(config.get('ANALYSIS_WORKER_POLL_INTERVAL', 2))
+        self.lease_seconds = float(config.get('ANALYSIS_JOB_LEASE_SECONDS', 60))
+        self.heartbeat_interval = float(config.get('ANALYSIS_JOB_HEARTBEAT_INTERVAL', 5))
+        self.max_attempts = int(config.get('ANALYSIS_JOB_MAX_ATTEMPTS', 3))
+        if self.heartbeat_interval * 2 > self.lease_seconds:
+            logger.warning(f"Heartbeat interval {self.heartbeat_interval}s is more than half the lease ({self.lease_seconds}s), jobs may be re-claimed while running")
+
+        self._running = {} # job_id -> _RunningJob
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        metrics.registry.describe('analysis_active_jobs', 'gauge', 'Analysis jobs running in this worker')
+        metrics.registry.set_callback('analysis_active_jobs', lambda: len(self._running), worker_id=self.worker_id)
+
+    def start(self):
+        """Runs the claim loop on a daemon thread, used to embed a worker in the API process."""
+        self._thread = threading.Thread(target=self.run, name="analysis-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        """Claims and runs jobs until stop() is called."""
+        logger.info(f"Analysis worker {self.worker_id} started, concurrency {self.concurrency}")
+        while not self._stopping.is_set():
+            with self._lock:
+                has_capacity = len(self._running) < self.concurrency
+            job = None
+            if has_capacity:
+                try:
+                    job = self.db.claim_analysis_job(self.worker_id, self.lease_seconds, self.max_attempts)
+                except Exception as e:
+                    logger.error(f"Analysis worker {self.worker_id} failed to claim a job: {e}", exc_info=True)
+            if job is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+            self._start_job(job)
+        logger.info(f"Analysis worker {self.worker_id} stopped claiming jobs")
+
+    def stop(self, timeout=None):
+        """Stops claiming, interrupts the running analyses and hands their jobs back to the queue."""
+        self._stopping.set()
+        with self._lock:
+            running = list(self._running.values())
+        for running_job in running:
+            running_job.cancel_event.set()
+        for running_job in running:
+            running_job.done.wait(timeout)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _start_job(self, job):
+        running_job = _RunningJob(job)
+        with self._lock:
+            self._running[running_job.job_id] = running_job
+        logger.info(f"Worker {self.worker_id} claimed job {running_job.job_id} for video {running_job.video_id} (attempt {job['attempts']})")
+        threading.Thread(target=self._heartbeat, args=(running_job,), name=f"heartbeat-{running_job.job_id}", daemon=True).start()
+        threading.Thread(target=self._run_job, args=(running_job,), name=f"job-{running_job.job_id}", daemon=True).start()
+
+    def _heartbeat(self, running_job):
+        while not running_job.done.wait(self.heartbeat_interval):
+            try:
+                frames_per_second, eta_seconds = running_job.throughput()
+                cancel_requested = self.db.heartbeat_analysis_job(running_job.job_id, self.worker_id, self.lease_seconds, running_job.progress,
+                                                                  running_job.frames_analyzed, frames_per_second, eta_seconds)
+            except Exception as e:
+                # Keep going, the lease leaves room for a few failed heartbeats
+                logger.warning(f"Heartbeat failed for job {running_job.job_id}: {e}")
+                continue
+            if cancel_requested is None:
+                logger.warning(f"Worker {self.worker_id} lost the lease of job {running_job.job_id}, stopping it")
+                running_job.lease_lost = True
+                running_job.cancel_event.set()
+            elif cancel_requested:
+                running_job.cancel_event.set()
+
+    def _on_progress(self, running_job, progress, frames_analyzed):
+        if running_job.start_progress is None:
+            running_job.start_progress = progress
+        running_job.progress = progress
+        running_job.frames_analyzed = frames_analyzed
+
+    def _run_job(self, running_job):
+        status, error = 'Error', None
+        try:
+            status = self.video_analysis_service.run_analysis(
+                running_job.video_id,
+                running_job.cancel_event,
+                on_progress=lambda progress, frames_analyzed: self._on_progress(running_job, progress, frames_analyzed),
+                resume=running_job.resume,
+            )
+        except Exception as e:
+            logger.error(f"Error during video analysis for video ID: {running_job.video_id}: {e}", exc_info=True)
+            error = str(e)
+
+        try:
+            if running_job.lease_lost:
+                pass # Another worker owns the job now
+            elif self._stopping.is_set() and status == 'Cancelled':
+                logger.info(f"Worker {self.worker_id} shutting down, releasing job {running_job.job_id}")
+                self.db.release_analysis_job(running_job.job_id, self.worker_id)
+            else:
+                self.db.finish_analysis_job(running_job.job_id, self.worker_id, status, error)
+                logger.info(f"Job {running_job.job_id} for video {running_job.video_id} finished: {status}")
+        except Exception as e:
+            logger.error(f"Error recording the result of job {running_job.job_id}: {e}", exc_info=True)
+        finally:
+            running_job.done.set()
+            with self._lock:
+                self._running.pop(running_job.job_id, None)
@@ -0,0 +1,90 @@
+import logging
+import hashlib
+import re
+import numpy as np
+from services.embedding_cache import QueryEmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDER_ALLOYDB = 'alloydb'
+EMBEDDER_LOCAL = 'local'
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalize(vectors):
+    """L2-normalizes a vector or the rows of a matrix, leaving zero vectors untouched."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class DatabaseEmbedder:
+    """Embeds text with the AlloyDB embedding() function, the model that fills frame_embedding
+    and objects_embedding, so stored frame vectors can be used as they are."""
+
+    uses_stored_embeddings = True
+
+    def __init__(self, db, model_name='text-embedding-005'):
+        self.db = db
+        self.model_name = model_name
+        self.name = model_name
+
+    def embed(self, texts):
+        return normalize(self.db.embed_texts(texts, self.model_name))
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
+
+
+class LocalHashEmbedder:
+    """Deterministic, dependency-free stand-in for the embedding model.
+
+    Words and word bigrams are hashed into a fixed number of signed buckets (the hashing
+    trick), so texts that share words end up close. Good enough to exercise search in
+    local development and CI without a database or network, not a semantic model.
+    """
+
+    uses_stored_embeddings = False
+
+    def __init__(self, dim=768):
+        self.dim = dim
+        self.name = f'local-hash-{dim}'
+
+    def _embed_one(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = _TOKEN.findall((text or '').lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign
+        return vector
+
+    def embed(self, texts):
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return normalize(np.stack([self._embed_one(text) for text in texts]))
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
+
+
+def create_embedder(config, db):
+    """Builds the embedder from EMBEDDER, wrapped in the query embedding cache unless disabled."""
+    embedder_type = config.get('EMBEDDER', EMBEDDER_ALLOYDB)
+    if embedder_type == EMBEDDER_ALLOYDB:
+        embedder = DatabaseEmbedder(db, config.get('EMBEDDING_MODEL_NAME', 'text-embedding-005'))
+    elif embedder_type == EMBEDDER_LOCAL:
+        embedder = LocalHashEmbedder(int(config.get('LOCAL_EMBEDDING_DIM', 768)))
+    else:
+        raise ValueError(f"Unknown embedder '{embedder_type}'")
+
+    if not config.get('QUERY_EMBEDDING_CACHE_ENABLED', True):
+        return embedder
+    return QueryEmbeddingCache(
+        embedder,
+        memory_size=int(config.get('QUERY_EMBEDDING_CACHE_SIZE', 1024)),
+        sqlite_path=config.get('QUERY_EMBEDDING_CACHE_PATH') or None,
+    )
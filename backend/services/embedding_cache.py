@@ -0,0 +1,123 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    """Cache key of a query: NFKC, case-folded, whitespace collapsed, so "Red  Truck" hits "red truck"."""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text or '')).strip().casefold()
+
+
+class QueryEmbeddingCache:
+    """Wraps an embedder and caches the embeddings of search queries.
+
+    Operators run the same saved queries across many videos, so query embeddings are kept
+    in a bounded in-memory LRU keyed by the normalized query text, backed by an optional
+    SQLite file that survives restarts. Entries are namespaced by the embedder name, so
+    changing the model never serves stale vectors. embed() (frame texts) is not cached.
+    """
+
+    def __init__(self, embedder, memory_size=1024, sqlite_path=None):
+        self.embedder = embedder
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._connection = None
+        if sqlite_path:
+            directory = os.path.dirname(sqlite_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    model TEXT,
+                    query TEXT,
+                    vector BLOB,
+                    created_at REAL,
+                    PRIMARY KEY (model, query)
+                )
+            """)
+            self._connection.commit()
+            logger.info(f"Query embedding cache persisted to {sqlite_path}")
+
+    @property
+    def name(self):
+        return self.embedder.name
+
+    @property
+    def uses_stored_embeddings(self):
+        return self.embedder.uses_stored_embeddings
+
+    def embed(self, texts):
+        return self.embedder.embed(texts)
+
+    def _lookup(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return vector
+        if self._connection is not None:
+            row = self._connection.execute(
+                "SELECT vector FROM query_embeddings WHERE model = ? AND query = ?", (self.name, key)
+            ).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, vector)
+                return vector
+        self.misses += 1
+        return None
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._lookup(key)
+        if vector is not None:
+            return vector
+
+        # Computed outside the lock, a remote model call must not serialize unrelated queries
+        vector = np.asarray(self.embedder.embed_query(key), dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._connection is not None:
+                try:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                        (self.name, key, vector.tobytes(), time.time()),
+                    )
+                    self._connection.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Error persisting embedding of query '{key}': {e}", exc_info=True)
+        return vector
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+        }
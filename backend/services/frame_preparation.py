@@ -0,0 +1,106 @@
+import logging
+from collections import namedtuple
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# format -> (file extension, MIME type)
+FRAME_FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+    'png': ('.png', 'image/png'),
+}
+
+# An encoded frame, ready to be sent to the model or uploaded as is.
+# data      : the encoded bytes
+# mime_type : e.g. 'image/jpeg'
+# width     : in pixels, after downscaling
+# height    : in pixels, after downscaling
+EncodedImage = namedtuple('EncodedImage', ['data', 'mime_type', 'width', 'height'])
+
+# The renditions of a sampled frame, storage_image is llm_image when both use the same settings
+PreparedFrame = namedtuple('PreparedFrame', ['llm_image', 'storage_image'])
+
+
+def frame_extension(image_format):
+    return FRAME_FORMATS[image_format][0]
+
+
+def frame_mime_type(image_format):
+    return FRAME_FORMATS[image_format][1]
+
+
+def resize_to_fit(image, max_size):
+    """Downscales a BGR frame so its longest side is at most max_size, 0 keeps the frame as is."""
+    height, width = image.shape[:2]
+    if max_size <= 0 or max(width, height) <= max_size:
+        return image
+    scale = max_size / max(width, height)
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def encode_image(image, image_format='jpeg', quality=85):
+    """Encodes a BGR frame, quality (1-100) applies to jpeg and webp."""
+    extension = frame_extension(image_format)
+    if image_format == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif image_format == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    else:
+        params = []
+    ret, encoded = cv2.imencode(extension, image, params)
+    if not ret:
+        raise ValueError(f"Could not encode frame as {image_format}")
+    height, width = image.shape[:2]
+    return EncodedImage(encoded.tobytes(), frame_mime_type(image_format), width, height)
+
+
+class FramePreparer:
+    """Sizes and encodes each sampled frame once per rendition.
+
+    The model gets a frame downscaled to llm_max_size, whose bytes are sent inline as they
+    are. Storage gets the same bytes unless its size, format or quality differ, in which
+    case a second rendition is encoded from the original frame.
+    """
+
+    def __init__(self, llm_max_size=1536, llm_format='jpeg', llm_quality=85, storage_max_size=None, storage_format=None, storage_quality=None):
+        self.llm_rendition = (int(llm_max_size), llm_format, int(llm_quality))
+        self.storage_rendition = (
+            int(llm_max_size if storage_max_size is None else storage_max_size),
+            storage_format or llm_format,
+            int(llm_quality if storage_quality is None else storage_quality),
+        )
+        for _, image_format, _ in (self.llm_rendition, self.storage_rendition):
+            if image_format not in FRAME_FORMATS:
+                raise ValueError(f"Unknown frame format '{image_format}', expected one of {tuple(FRAME_FORMATS)}")
+        self.shared = self.llm_rendition == self.storage_rendition
+
+    @property
+    def max_size(self):
+        """Longest side either rendition keeps, frames can be downscaled to it up front. 0 when one keeps the source size."""
+        sizes = (self.llm_rendition[0], self.storage_rendition[0])
+        return 0 if min(sizes) <= 0 else max(sizes)
+
+    @property
+    def storage_format(self):
+        return self.storage_rendition[1]
+
+    def _render(self, image, rendition):
+        max_size, image_format, quality = rendition
+        return encode_image(resize_to_fit(image, max_size), image_format, quality)
+
+    def prepare(self, image):
+        llm_image = self._render(image, self.llm_rendition)
+        storage_image = llm_image if self.shared else self._render(image, self.storage_rendition)
+        return PreparedFrame(llm_image, storage_image)
+
+
+def create_frame_preparer(config):
+    return FramePreparer(
+        llm_max_size=config.get('LLM_FRAME_MAX_SIZE', 1536),
+        llm_format=config.get('LLM_FRAME_FORMAT', 'jpeg'),
+        llm_quality=config.get('LLM_FRAME_QUALITY', 85),
+        storage_max_size=config.get('STORAGE_FRAME_MAX_SIZE'),
+        storage_format=config.get('STORAGE_FRAME_FORMAT'),
+        storage_quality=config.get('STORAGE_FRAME_QUALITY'),
+    )
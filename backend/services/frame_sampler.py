@@ -0,0 +1,97 @@
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FRAME_SAMPLER_FIXED = 'fixed'
+FRAME_SAMPLER_SCENE_CHANGE = 'scene_change'
+
+
+class FrameSampler:
+    """Decides which of the frames produced by the FrameSource are sent to the LLM.
+
+    The base sampler keeps every frame, i.e. the fixed VIDEO_SAMPLING_RATE interval.
+    """
+
+    def reset(self):
+        pass
+
+    def should_emit(self, sampled_frame):
+        return True
+
+
+class SceneChangeSampler(FrameSampler):
+    """Emits a frame only when the scene has materially changed since the last emitted frame.
+
+    Two cheap signals are computed on a downscaled copy of the frame:
+      - mean absolute difference of the grayscale thumbnails, in [0, 1]
+      - L1 distance of the normalized joint color histograms, in [0, 1]
+    A frame is emitted when either signal crosses its threshold, or when
+    max_gap_ms has elapsed since the last emitted frame so slow drift is still covered.
+    """
+
+    def __init__(self, pixel_threshold=0.08, histogram_threshold=0.25, max_gap_ms=10000,
+                 thumbnail_size=(64, 36), histogram_bins=8):
+        self.pixel_threshold = pixel_threshold
+        self.histogram_threshold = histogram_threshold
+        self.max_gap_ms = max_gap_ms
+        self.thumbnail_size = thumbnail_size
+        self.histogram_bins = histogram_bins
+        self.emitted = 0
+        self.skipped = 0
+        self.reset()
+
+    def reset(self):
+        self._last_gray = None
+        self._last_histogram = None
+        self._last_timestamp_ms = None
+
+    def _signature(self, image):
+        thumbnail = cv2.resize(image, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+
+        # Quantize each channel and build a joint BGR histogram with a single bincount
+        bins = self.histogram_bins
+        quantized = (thumbnail.astype(np.uint16) * bins) >> 8
+        codes = (quantized[..., 0] * bins + quantized[..., 1]) * bins + quantized[..., 2]
+        histogram = np.bincount(codes.ravel(), minlength=bins ** 3).astype(np.float32)
+        histogram /= histogram.sum()
+        return gray, histogram
+
+    def should_emit(self, sampled_frame):
+        gray, histogram = self._signature(sampled_frame.image)
+        timestamp_ms = sampled_frame.timestamp_ms
+
+        emit = self._last_gray is None
+        if not emit:
+            pixel_distance = float(np.abs(gray - self._last_gray).mean())
+            histogram_distance = float(np.abs(histogram - self._last_histogram).sum()) / 2.0
+            gap_ms = timestamp_ms - self._last_timestamp_ms
+            emit = (pixel_distance >= self.pixel_threshold
+                    or histogram_distance >= self.histogram_threshold
+                    or gap_ms >= self.max_gap_ms)
+            logger.debug(f"Scene change signals at {timestamp_ms}ms: pixel={pixel_distance:.4f}, histogram={histogram_distance:.4f}, gap={gap_ms}ms, emit={emit}")
+
+        if emit:
+            self._last_gray = gray
+            self._last_histogram = histogram
+            self._last_timestamp_ms = timestamp_ms
+            self.emitted += 1
+        else:
+            self.skipped += 1
+        return emit
+
+
+def create_frame_sampler(config):
+    """Builds the frame sampler selected by FRAME_SAMPLER."""
+    sampler_type = config.get('FRAME_SAMPLER', FRAME_SAMPLER_FIXED)
+    if sampler_type == FRAME_SAMPLER_FIXED:
+        return FrameSampler()
+    if sampler_type == FRAME_SAMPLER_SCENE_CHANGE:
+        return SceneChangeSampler(
+            pixel_threshold=float(config.get('SCENE_CHANGE_PIXEL_THRESHOLD', 0.08)),
+            histogram_threshold=float(config.get('SCENE_CHANGE_HISTOGRAM_THRESHOLD', 0.25)),
+            max_gap_ms=int(float(config.get('SCENE_CHANGE_MAX_GAP_SECONDS', 10)) * 1000),
+        )
+    raise ValueError(f"Unknown frame sampler '{sampler_type}'")
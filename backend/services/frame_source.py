@@ -0,0 +1,140 @@
+import logging
+import math
+from collections import namedtuple
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# A decoded frame selected for analysis.
+# index        : position of the frame in the stream (0 based)
+# timestamp_ms : presentation timestamp reported by the decoder, in milliseconds
+# image        : the decoded BGR frame (numpy array)
+SampledFrame = namedtuple('SampledFrame', ['index', 'timestamp_ms', 'image'])
+
+SEEK_MODE_GRAB = 'grab'
+SEEK_MODE_KEYFRAME = 'keyframe'
+SEEK_MODE_TIMESTAMP = 'timestamp'
+SEEK_MODES = (SEEK_MODE_GRAB, SEEK_MODE_KEYFRAME, SEEK_MODE_TIMESTAMP)
+
+
+class FrameSource:
+    """Reads only the frames that are going to be analyzed from a video file.
+
+    Three modes are supported:
+      - 'grab'      : every frame is demuxed with grab(), but only the sampled
+                      ones are decoded with retrieve(). Exact, and cheapest for
+                      dense sampling.
+      - 'keyframe'  : seeks to each sampled frame index. The decoder jumps to the
+                      preceding keyframe and decodes forward, so this wins when
+                      the sampling interval is longer than the GOP.
+      - 'timestamp' : seeks by media time (CAP_PROP_POS_MSEC), for variable
+                      frame rate sources where frame indexes drift.
+    """
+
+    def __init__(self, video_filepath, sampling_rate, mode=SEEK_MODE_GRAB):
+        if mode not in SEEK_MODES:
+            raise ValueError(f"Unknown frame seek mode '{mode}', expected one of {SEEK_MODES}")
+        self.video_filepath = video_filepath
+        self.sampling_rate = sampling_rate
+        self.mode = mode
+        self.cap = cv2.VideoCapture(video_filepath)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video file: {video_filepath}")
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_interval = int(self.fps / sampling_rate) if self.fps > sampling_rate else 1
+        # Index of the last frame the decoder has consumed, used for progress reporting
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    @property
+    def progress(self):
+        if self.total_frames <= 0:
+            return 0
+        return min(100, int(self.position * 100 / self.total_frames))
+
+    def frames(self, cancel_event=None, start_index=0, start_ms=0, end_index=None, end_ms=None):
+        """Yields a SampledFrame for every frame selected by the sampling rate.
+
+        start_index (grab and keyframe modes) or start_ms (timestamp mode) resume the
+        sampling at that position, selecting the same frames a full pass would.
+        end_index / end_ms, when given, stop it before that position.
+        """
+        if self.mode == SEEK_MODE_GRAB:
+            yield from self._grab_frames(cancel_event, start_index, end_index)
+        elif self.mode == SEEK_MODE_KEYFRAME:
+            yield from self._seek_frames(cancel_event, start_index, end_index)
+        else:
+            yield from self._timestamp_frames(cancel_event, start_ms, end_ms)
+
+    def _timestamp_ms(self, index):
+        # CAP_PROP_POS_MSEC is the timestamp of the frame most recently grabbed.
+        # Fall back to the nominal time when the container does not expose it.
+        timestamp_ms = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if timestamp_ms <= 0 and index > 0 and self.fps > 0:
+            timestamp_ms = index * 1000.0 / self.fps
+        return int(round(timestamp_ms))
+
+    def _grab_frames(self, cancel_event, start_index=0, end_index=None):
+        index = 0
+        if start_index > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_index)
+            index = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            self.position = index
+        while cancel_event is None or not cancel_event.is_set():
+            if end_index is not None and index >= end_index:
+                break
+            if not self.cap.grab():
+                break
+            self.position = index + 1
+            if index % self.frame_interval == 0 and index >= start_index: # A seek can land before start_index
+                timestamp_ms = self._timestamp_ms(index)
+                ret, image = self.cap.retrieve()
+                if not ret:
+                    logger.warning(f"Could not decode frame {index} of {self.video_filepath}")
+                else:
+                    yield SampledFrame(index, timestamp_ms, image)
+            index += 1
+
+    def _seek_frames(self, cancel_event, start_index=0, end_index=None):
+        index = -(-start_index // self.frame_interval) * self.frame_interval # First sampled index at or after start_index
+        while cancel_event is None or not cancel_event.is_set():
+            if self.total_frames > 0 and index >= self.total_frames:
+                break
+            if end_index is not None and index >= end_index:
+                break
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, image = self.cap.read()
+            if not ret:
+                break
+            timestamp_ms = self._timestamp_ms(index)
+            self.position = index + 1
+            yield SampledFrame(index, timestamp_ms, image)
+            index += self.frame_interval
+
+    def _timestamp_frames(self, cancel_event, start_ms=0, end_ms=None):
+        step_ms = 1000.0 / self.sampling_rate
+        target_ms = math.ceil(start_ms / step_ms) * step_ms # First sampling time at or after start_ms
+        while cancel_event is None or not cancel_event.is_set():
+            if end_ms is not None and target_ms >= end_ms:
+                break
+            self.cap.set(cv2.CAP_PROP_POS_MSEC, target_ms)
+            index = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            ret, image = self.cap.read()
+            if not ret:
+                break
+            timestamp_ms = self._timestamp_ms(index)
+            self.position = index + 1
+            yield SampledFrame(index, timestamp_ms, image)
+            target_ms += step_ms
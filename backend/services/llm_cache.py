@@ -0,0 +1,177 @@
+import logging
+import os
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_HASH_BITS = 64
+_BAND_COUNT = 8 # The 64 bit hash is split in 8 bands of 8 bits for the on-disk lookup
+_BAND_BITS = _HASH_BITS // _BAND_COUNT
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+def dhash(image, hash_size=8):
+    """Computes the 64 bit difference hash of a BGR frame.
+
+    The frame is reduced to a (hash_size + 1) x hash_size grayscale thumbnail and every
+    bit records whether a pixel is brighter than its right neighbour, so the hash is
+    stable across re-encoding, small noise and brightness shifts.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    thumbnail = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64 bit
+    return value - (1 << _HASH_BITS) if value >= (1 << (_HASH_BITS - 1)) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << _HASH_BITS) if value < 0 else value
+
+
+def _bands(image_hash):
+    return [(image_hash >> (i * _BAND_BITS)) & _BAND_MASK for i in range(_BAND_COUNT)]
+
+
+class AnalysisResultCache:
+    """Perceptual-hash keyed cache of LLM frame analysis results.
+
+    Lookups first scan a bounded in-memory LRU, then an optional SQLite file that survives
+    restarts. A cached result is reused when the Hamming distance between the frame hashes
+    is at most max_distance. On disk, candidates are found with multi-index hashing: two
+    hashes within distance 7 share at least one of the 8 byte-wide bands exactly, and every
+    band column is indexed.
+    """
+
+    def __init__(self, namespace, max_distance=3, memory_size=4096, sqlite_path=None):
+        if max_distance >= _BAND_COUNT:
+            raise ValueError(f"max_distance must be lower than {_BAND_COUNT}")
+        self.namespace = namespace
+        self.max_distance = max_distance
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._connection = None
+        if sqlite_path:
+            directory = os.path.dirname(sqlite_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(sqlite_path, check_same_thread=False)
+            band_columns = ', '.join(f'b{i} INTEGER' for i in range(_BAND_COUNT))
+            self._connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS llm_results (
+                    namespace TEXT,
+                    image_hash INTEGER,
+                    {band_columns},
+                    result TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (namespace, image_hash)
+                )
+            """)
+            for i in range(_BAND_COUNT):
+                self._connection.execute(f"CREATE INDEX IF NOT EXISTS llm_results_b{i} ON llm_results (namespace, b{i})")
+            self._connection.commit()
+            logger.info(f"LLM result cache persisted to {sqlite_path}")
+
+    def _memory_lookup(self, image_hash):
+        result = self._memory.get(image_hash)
+        if result is not None:
+            self._memory.move_to_end(image_hash)
+            return result
+        if self.max_distance == 0:
+            return None
+        for cached_hash, cached_result in reversed(self._memory.items()):
+            if hamming_distance(image_hash, cached_hash) <= self.max_distance:
+                self._memory.move_to_end(cached_hash)
+                return cached_result
+        return None
+
+    def _disk_lookup(self, image_hash):
+        if self._connection is None:
+            return None
+        bands = _bands(image_hash)
+        where = ' OR '.join(f'b{i} = ?' for i in range(_BAND_COUNT))
+        rows = self._connection.execute(
+            f"SELECT image_hash, result FROM llm_results WHERE namespace = ? AND ({where})",
+            [self.namespace] + bands,
+        ).fetchall()
+        best = None
+        for stored_hash, result in rows:
+            distance = hamming_distance(image_hash, _to_unsigned(stored_hash))
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, result)
+        return json.loads(best[1]) if best else None
+
+    def _remember(self, image_hash, result):
+        self._memory[image_hash] = result
+        self._memory.move_to_end(image_hash)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, image_hash):
+        with self._lock:
+            result = self._memory_lookup(image_hash)
+            if result is not None:
+                self.memory_hits += 1
+                return result
+            result = self._disk_lookup(image_hash)
+            if result is not None:
+                self.disk_hits += 1
+                self._remember(image_hash, result)
+                return result
+            self.misses += 1
+            return None
+
+    def put(self, image_hash, result):
+        with self._lock:
+            self._remember(image_hash, result)
+            if self._connection is None:
+                return
+            try:
+                self._connection.execute(
+                    f"INSERT OR REPLACE INTO llm_results VALUES (?, ?, {', '.join('?' * _BAND_COUNT)}, ?, ?)",
+                    [self.namespace, _to_signed(image_hash)] + _bands(image_hash) + [json.dumps(result), time.time()],
+                )
+                self._connection.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error persisting LLM result for hash {image_hash:016x}: {e}", exc_info=True)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+
+def create_result_cache(config):
+    """Builds the LLM result cache from LLM_CACHE_* settings, or None when disabled."""
+    if not config.get('LLM_CACHE_ENABLED', True):
+        return None
+    return AnalysisResultCache(
+        namespace=config.get('GEMINI_MODEL_NAME') or 'default',
+        max_distance=int(config.get('LLM_CACHE_MAX_DISTANCE', 3)),
+        memory_size=int(config.get('LLM_CACHE_MEMORY_SIZE', 4096)),
+        sqlite_path=config.get('LLM_CACHE_PATH') or None,
+    )
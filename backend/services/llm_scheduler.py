@@ -0,0 +1,223 @@
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from google.api_core import exceptions as google_exceptions
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the quota is used up, every caller backs off when one is seen
+QUOTA_ERRORS = (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)
+# Errors worth retrying: quota, server side failures and timeouts
+RETRYABLE_ERRORS = QUOTA_ERRORS + (
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+_IMAGE_TILE_SIZE = 768 # Gemini bills images larger than 384x384 per 768x768 tile
+_TOKENS_PER_IMAGE_TILE = 258
+
+
+def is_retryable_error(error):
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def estimate_image_tokens(width, height):
+    """Input tokens Gemini bills for an image of the given size."""
+    if width <= 384 and height <= 384:
+        return _TOKENS_PER_IMAGE_TILE
+    return math.ceil(width / _IMAGE_TILE_SIZE) * math.ceil(height / _IMAGE_TILE_SIZE) * _TOKENS_PER_IMAGE_TILE
+
+
+class TokenBucket:
+    """Refills at rate_per_minute and holds at most a minute worth of tokens."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = self.capacity / 60.0 # per second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount tokens are available, a request larger than the bucket waits for a full one."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """Charges (or refunds, when negative) the difference between estimated and actual usage."""
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _Ticket:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.granted = False
+
+
+class LLMScheduler:
+    """Process-wide gate in front of the model, shared by every running analysis.
+
+    A call waits until a concurrency slot is free and the requests/min and tokens/min
+    buckets can pay for it. Waiting calls are queued per key (the video being analyzed) and
+    the keys are served round-robin, so one long video cannot starve the others. Quota and
+    transient errors are retried with exponential backoff and full jitter; a quota error
+    also pauses every other caller for the same delay, so the process backs off as a whole.
+    """
+
+    def __init__(self, max_concurrency=8, requests_per_minute=0, tokens_per_minute=0, max_retries=5, retry_base_delay=1.0, retry_max_delay=60.0):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_base_delay = float(retry_base_delay)
+        self.retry_max_delay = float(retry_max_delay)
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+        self._queues = OrderedDict() # key -> deque of waiting tickets, in round-robin order
+        self._in_flight = 0
+        self._resume_at = 0.0 # monotonic time before which no call starts, after a quota error
+        self._condition = threading.Condition()
+        self._stats = {'calls': 0, 'retries': 0, 'quota_errors': 0, 'failures': 0, 'wait_seconds': 0.0}
+
+    def call(self, key, fn, estimated_tokens=0, token_usage=None):
+        """Runs fn() when key's turn comes and the limits allow it, retrying quota and transient errors.
+
+        token_usage, if given, maps fn's result to the tokens actually used, and the tokens/min
+        bucket is corrected by the difference with estimated_tokens. Raises the last error once
+        the retries are exhausted, and non-retryable errors right away.
+        """
+        attempt = 0
+        while True:
+            self._acquire(key, estimated_tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = is_retryable_error(e)
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+                with self._condition:
+                    if isinstance(e, QUOTA_ERRORS):
+                        # Paused before the slot is released, so no waiting call is granted into the same quota error
+                        self._stats['quota_errors'] += 1
+                        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                    self._release()
+                    if not retryable or attempt >= self.max_retries:
+                        self._stats['failures'] += 1
+                        raise
+                    self._stats['retries'] += 1
+                logger.warning(f"LLM call for {key} failed ({type(e).__name__}: {e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            with self._condition:
+                self._release()
+                self._stats['calls'] += 1
+                if self._tokens is not None and token_usage is not None:
+                    used_tokens = token_usage(result)
+                    if used_tokens:
+                        self._tokens.adjust(used_tokens - estimated_tokens)
+            return result
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats, in_flight=self._in_flight, waiting=sum(len(tickets) for tickets in self._queues.values()))
+
+    def _acquire(self, key, estimated_tokens):
+        ticket = _Ticket(estimated_tokens)
+        started = time.monotonic()
+        with self._condition:
+            self._queues.setdefault(key, deque()).append(ticket)
+            while True:
+                timeout = self._dispatch()
+                if ticket.granted:
+                    break
+                self._condition.wait(timeout)
+            waited = time.monotonic() - started
+            self._stats['wait_seconds'] += waited
+        metrics.observe_stage(metrics.STAGE_LLM_WAIT, waited, key)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+        # Waiters blocked on busy slots wait without a timeout. When the freed slot cannot be granted
+        # yet (empty bucket, quota pause) they must wake to wait again for the rate limits instead
+        self._condition.notify_all()
+
+    def _dispatch(self):
+        """Grants waiting calls, round-robin across keys, while the limits allow.
+
+        Called with the lock held. Returns the seconds until the rate limits allow the next
+        call, or None when nothing waits or every slot is busy (a release wakes the waiters).
+        """
+        granted = False
+        timeout = None
+        while self._queues and self._in_flight < self.max_concurrency:
+            now = time.monotonic()
+            if now < self._resume_at:
+                timeout = self._resume_at - now
+                break
+            key, tickets = next(iter(self._queues.items()))
+            ticket = tickets[0]
+            wait = max(
+                self._requests.wait_time(1, now) if self._requests is not None else 0.0,
+                self._tokens.wait_time(ticket.tokens, now) if self._tokens is not None else 0.0,
+            )
+            if wait > 0:
+                timeout = wait
+                break
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None:
+                self._tokens.take(ticket.tokens)
+            tickets.popleft()
+            if tickets:
+                self._queues.move_to_end(key) # Next key's turn
+            else:
+                del self._queues[key]
+            self._in_flight += 1
+            ticket.granted = True
+            granted = True
+        if granted:
+            self._condition.notify_all()
+        return timeout
+
+
+def _register_metrics(scheduler):
+    for name, metric_type, help_text, stat in (
+        ('llm_requests_in_flight', 'gauge', 'Gemini calls running', 'in_flight'),
+        ('llm_requests_waiting', 'gauge', 'Gemini calls queued by the scheduler', 'waiting'),
+        ('llm_requests_total', 'counter', 'Gemini calls that succeeded', 'calls'),
+        ('llm_retries_total', 'counter', 'Gemini calls retried after a quota or transient error', 'retries'),
+        ('llm_quota_errors_total', 'counter', 'Gemini calls rejected for quota', 'quota_errors'),
+        ('llm_failures_total', 'counter', 'Gemini calls that failed for good', 'failures'),
+    ):
+        metrics.registry.describe(name, metric_type, help_text)
+        metrics.registry.set_callback(name, lambda stat=stat: scheduler.stats()[stat])
+
+
+def create_llm_scheduler(config):
+    scheduler = LLMScheduler(
+        max_concurrency=config.get('LLM_MAX_CONCURRENCY', 8),
+        requests_per_minute=config.get('LLM_REQUESTS_PER_MINUTE', 0),
+        tokens_per_minute=config.get('LLM_TOKENS_PER_MINUTE', 0),
+        max_retries=config.get('LLM_MAX_RETRIES', 5),
+        retry_base_delay=config.get('LLM_RETRY_BASE_DELAY', 1.0),
+        retry_max_delay=config.get('LLM_RETRY_MAX_DELAY', 60.0),
+    )
+    _register_metrics(scheduler)
+    return scheduler
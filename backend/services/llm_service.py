@@ -1,17 +1,53 @@
 import logging
-from PIL import Image
 import re
 import json
-from io import BytesIO
 from google.generativeai import GenerativeModel, configure
+from services.llm_cache import create_result_cache
+from services.llm_scheduler import create_llm_scheduler, estimate_image_tokens, is_retryable_error
+from services.frame_preparation import EncodedImage
+from services import metrics
 
 logger = logging.getLogger(__name__)
 
+SINGLE_PROMPT = '''Describe the objects and scene in this image in detail, and identify any detected objects with bounding boxes if possible. \n
+                        Output in JSON format with 'text_description' and 'detected_objects'.
+                        'text_description' should be less then 100 words, explaning what the frame contains.
+                        'detected_objects' should be a list of max to 10 objects with 'object_type', 'object_color', 'object_descrition').
+                        Never return masks or code fencing. Never ask questions. Do not describe the image format, and do not mention colors if you are not sure.
+            '''
+
+BATCH_PROMPT_TEMPLATE = '''You are given {count} video frames, each preceded by a label "Frame <index>:" with index from 0 to {last_index}.
+                        Describe the objects and scene in each frame independently, and identify any detected objects if possible. \n
+                        Output a JSON array with exactly one object per frame, in frame order. Each object has 'frame_index' (the integer index of the frame), 'text_description' and 'detected_objects'.
+                        'text_description' should be less then 100 words, explaning what the frame contains.
+                        'detected_objects' should be a list of max to 10 objects with 'object_type', 'object_color', 'object_descrition').
+                        Never return masks or code fencing. Never ask questions. Do not describe the image format, and do not mention colors if you are not sure.
+            '''
+
 class LLMService:
     def __init__(self, config):
         self.config = config
         configure(api_key=config.get('GCP_VERTEX_AI_API_KEY'))
         self.model = GenerativeModel(config.get('GEMINI_MODEL_NAME')) # e.g., 'gemini-2.0-flash-thinking'
+        self.result_cache = create_result_cache(config) # Perceptual-hash keyed cache of analysis results
+        self.scheduler = create_llm_scheduler(config) # Shared by every analysis in the process
+        self.output_tokens_per_frame = config.get('LLM_ESTIMATED_OUTPUT_TOKENS', 400)
+
+    def _generate(self, contents, job_key):
+        """Calls the model through the scheduler, job_key is the unit of fair sharing (the video id)."""
+        images = [part for part in contents if isinstance(part, EncodedImage)]
+        estimated_tokens = sum(len(part) // 4 for part in contents if isinstance(part, str))
+        estimated_tokens += sum(estimate_image_tokens(image.width, image.height) + self.output_tokens_per_frame for image in images)
+        # Images are sent inline as already encoded, without a decode/re-encode round-trip
+        contents = [{'mime_type': part.mime_type, 'data': part.data} if isinstance(part, EncodedImage) else part for part in contents]
+
+        def generate():
+            with metrics.timed(metrics.STAGE_LLM_CALL, job_key):
+                response = self.model.generate_content(contents)
+                response.resolve() # Resolve futures, handle potential errors.
+            return response
+
+        return self.scheduler.call(job_key, generate, estimated_tokens=estimated_tokens, token_usage=_total_token_count)
 
     def parse_gemini_json_response(self, gemini_response_text):
         """Extracts and parses JSON from a Gemini response string."""
@@ -37,19 +73,104 @@ class LLMService:
             print(f"JSONDecodeError: {e}")
             print(f"Problematic JSON string: {cleaned_text}")  # Print the problematic string for debugging
             return None  # Or raise the exception if you want to stop execution
-            
-    def analyze_image(self, image_bytes):
+
+    def parse_gemini_json_array_response(self, gemini_response_text, frame_count):
+        """Maps a batch response to frames. Returns a list of frame_count entries, None where
+        the frame's result is missing or malformed."""
+        results = [None] * frame_count
+        cleaned_text = gemini_response_text.replace("```json", "").replace("```", "").strip()
+        match = re.search(r"\[.*\]", cleaned_text, re.DOTALL)  # Find the JSON array
+        if not match:
+            return results
         try:
-            image = Image.open(BytesIO(image_bytes))
-            prompt = '''Describe the objects and scene in this image in detail, and identify any detected objects with bounding boxes if possible. \n
-                        Output in JSON format with 'text_description' and 'detected_objects'.
-                        'text_description' should be less then 100 words, explaning what the frame contains.
-                        'detected_objects' should be a list of max to 10 objects with 'object_type', 'object_color', 'object_descrition').
-                        Never return masks or code fencing. Never ask questions. Do not describe the image format, and do not mention colors if you are not sure.
-            '''
+            entries = json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            logger.warning(f"Could not parse JSON array from batch LLM output: {e}")
+            return results
+        if not isinstance(entries, list):
+            return results
+
+        for position, entry in enumerate(entries):
+            if not isinstance(entry, dict) or not isinstance(entry.get('text_description'), str):
+                continue
+            frame_index = entry.get('frame_index')
+            if isinstance(frame_index, str) and frame_index.isdigit():
+                frame_index = int(frame_index)
+            if not isinstance(frame_index, int):
+                # Without an explicit index, trust the position only if the array is complete
+                if len(entries) != frame_count:
+                    continue
+                frame_index = position
+            if not 0 <= frame_index < frame_count or results[frame_index] is not None:
+                continue
+            detected_objects = entry.get('detected_objects')
+            results[frame_index] = {
+                'text_description': entry['text_description'],
+                'detected_objects': detected_objects if isinstance(detected_objects, list) else [],
+            }
+        return results
+
+    def analyze_images(self, images, image_hashes=None, job_key=None):
+        """Analyzes several frames (EncodedImage, see FramePreparer) with a single generate_content call.
 
-            response = self.model.generate_content([prompt, image])
-            response.resolve() # Resolve futures, handle potential errors.
+        Returns one result per frame, in order. Cached frames are answered from the result
+        cache, and any frame whose entry is missing or malformed in the batch response is
+        re-analyzed on its own with analyze_image. Raises when the model stays unavailable
+        after the scheduler's retries.
+        """
+        image_hashes = image_hashes or [None] * len(images)
+        results = [None] * len(images)
+        pending = []
+        for position, image_hash in enumerate(image_hashes):
+            if image_hash is not None and self.result_cache is not None:
+                results[position] = self.result_cache.get(image_hash)
+            if results[position] is None:
+                pending.append(position)
+
+        if len(pending) > 1:
+            try:
+                contents = [BATCH_PROMPT_TEMPLATE.format(count=len(pending), last_index=len(pending) - 1)]
+                for batch_index, position in enumerate(pending):
+                    contents.append(f"Frame {batch_index}:")
+                    contents.append(images[position])
+                response = self._generate(contents, job_key)
+                if response.parts:
+                    batch_results = self.parse_gemini_json_array_response(response.parts[0].text, len(pending))
+                    for batch_index, position in enumerate(pending):
+                        results[position] = batch_results[batch_index]
+                        if results[position] and image_hashes[position] is not None and self.result_cache is not None:
+                            self.result_cache.put(image_hashes[position], results[position])
+                else:
+                    logger.warning("Batch LLM response had no parts.")
+            except Exception as e:
+                if is_retryable_error(e):
+                    raise # Splitting the batch would only multiply the calls to an unavailable model
+                logger.error(f"Error analyzing batch of {len(pending)} images: {e}", exc_info=True)
+
+        missing = [position for position in pending if results[position] is None]
+        if missing and len(pending) > 1:
+            logger.info(f"Falling back to single-frame analysis for {len(missing)} of {len(pending)} frames")
+        for position in missing:
+            results[position] = self._analyze_single(images[position], image_hashes[position], job_key)
+        return results
+
+    def analyze_image(self, image, image_hash=None, job_key=None):
+        """Analyzes one frame (EncodedImage, see FramePreparer). When image_hash (see llm_cache.dhash) is given, near-identical
+        frames that were analyzed before are answered from the result cache.
+
+        Returns None when the frame cannot be analyzed, and raises when the model stays
+        unavailable after the scheduler's retries, so no error text is stored as a description.
+        """
+        if image_hash is not None and self.result_cache is not None:
+            cached_result = self.result_cache.get(image_hash)
+            if cached_result is not None:
+                logger.debug(f"LLM result cache hit for frame hash {image_hash:016x}")
+                return cached_result
+        return self._analyze_single(image, image_hash, job_key)
+
+    def _analyze_single(self, image, image_hash=None, job_key=None):
+        try:
+            response = self._generate([SINGLE_PROMPT, image], job_key)
 
             if response.parts:
                 llm_output_text = response.parts[0].text # Assuming text output is the first part
@@ -60,15 +181,24 @@ class LLMService:
                 try:
                     analysis_result = self.parse_gemini_json_response(llm_output_text)
                     logger.debug(f"LLM Analysis Result: {analysis_result}")
+                    if analysis_result and image_hash is not None and self.result_cache is not None:
+                        self.result_cache.put(image_hash, analysis_result)
                     return analysis_result
                 except json.JSONDecodeError:
                     logger.warning(f"Could not parse JSON from LLM output: {llm_output_text}")
                     return {'text_description': llm_output_text, 'detected_objects': []} # Fallback
 
             else:
-                logger.warning("LLM response had no parts.")
-                return {'text_description': 'No description from LLM', 'detected_objects': []}
+                logger.warning("LLM response had no parts, frame skipped.")
+                return None
 
         except Exception as e:
-            logger.error(f"Error analyzing image: {e}", exc_info=True)
-            return {'text_description': 'Error during image analysis', 'detected_objects': []}
+            if is_retryable_error(e):
+                raise # Fails the analysis, which resumes from its checkpoint when queued again
+            logger.error(f"Error analyzing image, frame skipped: {e}", exc_info=True)
+            return None
+
+
+def _total_token_count(response):
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    return getattr(usage_metadata, 'total_token_count', None)
@@ -0,0 +1,110 @@
+import logging
+import os
+import shutil
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBlob:
+    """Filesystem stand-in for google.cloud.storage.Blob, covering the calls StorageService makes."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.path, name)
+
+    def _prepare(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if self.exists() else None
+
+    def upload_from_string(self, data, content_type=None):
+        self._prepare()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        tmp_path = f"{self.path}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def upload_from_file(self, file_obj, content_type=None):
+        self._prepare()
+        tmp_path = f"{self.path}.part"
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(file_obj, f)
+        os.replace(tmp_path, self.path)
+
+    def upload_from_filename(self, filename, content_type=None, checksum=None):
+        self._prepare()
+        shutil.copyfile(filename, self.path)
+
+    def download_to_filename(self, filename):
+        if not self.exists():
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+        shutil.copyfile(self.path, filename)
+
+    def download_as_bytes(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def delete(self):
+        if not self.exists():
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+        os.remove(self.path)
+
+    def generate_signed_url(self, version=None, expiration=None, method='GET'):
+        return f"file://{os.path.abspath(self.path)}"
+
+
+class LocalBucket:
+    """Filesystem stand-in for google.cloud.storage.Bucket, one directory per bucket."""
+
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, name)
+        os.makedirs(self.path, exist_ok=True)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def delete_blobs(self, blobs, on_error=None):
+        """Deletes blobs (or blob names) one by one, on_error(blob) is called for the missing ones instead of raising."""
+        for blob in blobs:
+            blob = self.blob(blob) if isinstance(blob, str) else blob
+            try:
+                blob.delete()
+            except FileNotFoundError:
+                if on_error is None:
+                    raise
+                on_error(blob)
+
+    def list_blobs(self, prefix=''):
+        for filename in sorted(os.listdir(self.path)):
+            if filename.startswith(prefix) and not filename.endswith('.part'):
+                yield LocalBlob(self, filename)
+
+
+class LocalStorageClient:
+    """Filesystem stand-in for google.cloud.storage.Client, selected with STORAGE_BACKEND=local."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        logger.info(f"Using local filesystem storage at {os.path.abspath(root)}")
+
+    def bucket(self, name):
+        return LocalBucket(self.root, name)
+
+    def batch(self):
+        """Stand-in for a GCS batch, the requests inside it run right away."""
+        return nullcontext()
+
+    def list_blobs(self, bucket_or_name, prefix=''):
+        bucket = bucket_or_name if isinstance(bucket_or_name, LocalBucket) else self.bucket(bucket_or_name)
+        return bucket.list_blobs(prefix=prefix)
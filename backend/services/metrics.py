@@ -0,0 +1,241 @@
+"""Process-wide performance metrics, exposed in the Prometheus text format.
+
+Stage timings go to fixed-bucket histograms: recording one costs a bisect and a locked
+increment, so they can sit on the analysis hot path. Gauges are callbacks evaluated when
+the metrics are scraped, so queue depths and job counts cost nothing in between.
+"""
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, from a cached lookup to a slow Gemini call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = 'analysis_stage_seconds'
+VIDEO_STAGE_SECONDS = 'analysis_video_stage_seconds'
+
+# Stage names, shared by the code that records them and the dashboards that read them
+STAGE_DECODE = 'decode'
+STAGE_ENCODE = 'encode'
+STAGE_LLM_WAIT = 'llm_wait'
+STAGE_LLM_CALL = 'llm_call'
+STAGE_FRAME_UPLOAD = 'frame_upload'
+STAGE_DB_INSERT = 'db_insert'
+STAGE_QUERY_EMBEDDING = 'query_embedding'
+STAGE_SIMILARITY_SEARCH = 'similarity_search'
+STAGE_URL_SIGNING = 'url_signing'
+STAGE_BLOB_DELETE = 'blob_delete'
+
+
+class Histogram:
+    """Cumulative histogram of one label set."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1) # Last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value) # Bucket le >= value
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """Returns (cumulative counts per bucket including +Inf, sum, count)."""
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative, running = [], 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Histograms and callback gauges keyed by metric name and label set."""
+
+    def __init__(self):
+        self._descriptions = {} # name -> (type, help)
+        self._histograms = {} # (name, labels) -> Histogram
+        self._callbacks = {} # (name, labels) -> callable returning the current value
+        self._lock = threading.Lock()
+
+    def describe(self, name, metric_type, help_text):
+        self._descriptions[name] = (metric_type, help_text)
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def set_callback(self, name, callback, **labels):
+        """Registers a gauge (or counter) whose value is read from callback at scrape time."""
+        with self._lock:
+            self._callbacks[(name, tuple(sorted(labels.items())))] = callback
+
+    def remove(self, name, **labels):
+        """Drops the series of name whose labels include these, e.g. every series of a finished video."""
+        wanted = set(labels.items())
+        with self._lock:
+            for series in (self._histograms, self._callbacks):
+                for key in [key for key in series if key[0] == name and wanted <= set(key[1])]:
+                    del series[key]
+
+    def histogram_summaries(self, name, **labels):
+        """{labels: {'count': n, 'sum': seconds}} of the histograms of name matching labels."""
+        wanted = set(labels.items())
+        with self._lock:
+            matching = [(key[1], histogram) for key, histogram in self._histograms.items() if key[0] == name and wanted <= set(key[1])]
+        summaries = {}
+        for series_labels, histogram in matching:
+            _, total, count = histogram.snapshot()
+            summaries[series_labels] = {'count': count, 'sum': total}
+        return summaries
+
+    def render(self):
+        """All series in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            callbacks = sorted(self._callbacks.items(), key=lambda item: item[0])
+        lines = []
+        described = set()
+
+        def header(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text = self._descriptions.get(name, (default_type, ''))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            cumulative, total, count = histogram.snapshot()
+            for bound, bucket_count in zip(list(histogram.buckets) + [math.inf], cumulative):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(float(bound))),))} {bucket_count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for (name, labels), callback in callbacks:
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning(f"Metric {name} could not be read: {e}")
+                continue
+            header(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+registry.describe(STAGE_SECONDS, 'histogram', 'Duration of the analysis and query stages in this process, in seconds')
+registry.describe(VIDEO_STAGE_SECONDS, 'histogram', 'Duration of the stages of the analyses running in this process, per video, in seconds')
+registry.describe('analysis_queue_depth', 'gauge', 'Items waiting in the queues of the analyses running in this process')
+
+_tracked_videos = set()
+
+
+def observe_stage(stage, seconds, video_id=None):
+    """Records a stage duration for the process, and for the video while its analysis is tracked."""
+    registry.observe(STAGE_SECONDS, seconds, stage=stage)
+    if video_id is not None and video_id in _tracked_videos:
+        registry.observe(VIDEO_STAGE_SECONDS, seconds, stage=stage, video_id=video_id)
+
+
+@contextmanager
+def timed(stage, video_id=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, video_id)
+
+
+def timed_iter(iterable, stage, video_id=None):
+    """Yields the items of iterable, recording how long each one took to produce."""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        observe_stage(stage, time.perf_counter() - started, video_id)
+        yield item
+
+
+def track_video(video_id):
+    """Starts the per-video histograms of an analysis."""
+    _tracked_videos.add(video_id)
+
+
+def untrack_video(video_id):
+    """Drops the per-video series of an analysis and returns its {stage: {'count', 'sum', 'mean'}} summary."""
+    _tracked_videos.discard(video_id)
+    summary = {}
+    for labels, stats in registry.histogram_summaries(VIDEO_STAGE_SECONDS, video_id=video_id).items():
+        stage = dict(labels)['stage']
+        summary[stage] = dict(stats, mean=stats['sum'] / stats['count'] if stats['count'] else 0.0)
+    registry.remove(VIDEO_STAGE_SECONDS, video_id=video_id)
+    return summary
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/api/metrics'):
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood the log
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Serves /metrics on a daemon thread, for processes without the Flask API (worker.py)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics served on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,129 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+NOT_FOUND_STATE = {'status': 'NotFound', 'progress': 0, 'frames_analyzed': 0, 'frames_per_second': None, 'eta_seconds': None}
+
+
+def format_event(state):
+    """Server-Sent Events frame of a progress state."""
+    return f"event: progress\ndata: {json.dumps(state)}\n\n"
+
+
+class ProgressSubscription:
+    """Progress updates of a set of videos for one streaming client.
+
+    Only the latest state of each video is kept, so a client that reads slowly receives
+    the current state of every video instead of a backlog of stale ones.
+    """
+
+    def __init__(self, video_ids):
+        self.video_ids = frozenset(video_ids)
+        self._pending = {} # video_id -> latest state not sent yet
+        self._last = {} # video_id -> last state pushed, repeats are dropped
+        self._condition = threading.Condition()
+
+    def push(self, state):
+        with self._condition:
+            if self._last.get(state['video_id']) == state:
+                return
+            self._last[state['video_id']] = state
+            self._pending[state['video_id']] = state
+            self._condition.notify()
+
+    def push_initial(self, state):
+        """Pushes a state fetched when the client subscribed, unless the polling thread pushed one first."""
+        with self._condition:
+            if state['video_id'] in self._last:
+                return # The polling thread got there first, and pushes any later change itself
+            self._last[state['video_id']] = state
+            self._pending[state['video_id']] = state
+            self._condition.notify()
+
+    def get(self, timeout):
+        """Returns the pending states, waiting up to timeout seconds; empty when nothing changed."""
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+            states = list(self._pending.values())
+            self._pending.clear()
+            return states
+
+
+class ProgressBroadcaster:
+    """Pushes analysis progress changes to streaming clients.
+
+    A single thread per API process polls the job table, in one query for every video that
+    has a subscriber however many clients are connected, and pushes only the states that
+    changed since the previous poll.
+    """
+
+    def __init__(self, db, interval=1.0):
+        self.db = db
+        self.interval = float(interval)
+        self._subscriptions = set()
+        self._states = {} # video_id -> last state pushed, only touched by the polling thread
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, video_ids):
+        """Registers a client, its subscription starts with the current state of every video.
+
+        The subscription is registered before the current states are fetched, so a change
+        polled in between reaches it too: the polling thread only pushes a video's state
+        when it differs from the one it pushed last.
+        """
+        subscription = ProgressSubscription(video_ids)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="progress-broadcaster", daemon=True)
+                self._thread.start()
+        try:
+            for state in self._fetch(subscription.video_ids):
+                subscription.push_initial(state)
+        except BaseException:
+            self.unsubscribe(subscription)
+            raise
+        return subscription
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _fetch(self, video_ids):
+        states = {row['video_id']: row for row in self.db.get_analysis_job_states(video_ids)}
+        return [states.get(video_id, dict(NOT_FOUND_STATE, video_id=video_id)) for video_id in video_ids]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._poll()
+
+    def _poll(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        video_ids = set().union(*(subscription.video_ids for subscription in subscriptions))
+        for video_id in set(self._states) - video_ids: # Forget videos nobody watches anymore
+            del self._states[video_id]
+        if not video_ids:
+            return
+        try:
+            states = self._fetch(video_ids)
+        except Exception as e:
+            logger.error(f"Error polling analysis progress: {e}", exc_info=True)
+            return
+        for state in states:
+            if self._states.get(state['video_id']) == state:
+                continue
+            self._states[state['video_id']] = state
+            for subscription in subscriptions:
+                if state['video_id'] in subscription.video_ids:
+                    subscription.push(state)
@@ -1,56 +1,221 @@
 import logging
 import json
+import math
+import re
 from google.cloud import storage
 from datetime import timedelta
 from services.storage_service import StorageService
 from db.database import Database
+from services.embedder import create_embedder
+from services import metrics
 
 
 logger = logging.getLogger(__name__)
 
+SEARCH_MODES = ('description', 'objects', 'hybrid')
+FUSION_METHODS = ('rrf', 'weighted')
+RESULT_GROUPS = ('frames', 'segments')
+_CLOCK_TIME = re.compile(r'^(?:(\d+):)?(\d+):(\d+(?:\.\d+)?)$') # [H:]MM:SS[.fff]
+
+
+def parse_media_time(value, name='time'):
+    """Milliseconds of a time in the video given as seconds or as [H:]MM:SS[.fff], raises ValueError."""
+    if isinstance(value, str) and ':' in value:
+        match = _CLOCK_TIME.match(value.strip())
+        if not match or (match.group(1) is not None and int(match.group(2)) >= 60) or float(match.group(3)) >= 60:
+            raise ValueError(f"{name} must be seconds or a time like 14:00 or 1:14:00")
+        seconds = int(match.group(1) or 0) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+    else:
+        try:
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise ValueError
+            seconds = float(value)
+        except (ValueError, OverflowError):
+            raise ValueError(f"{name} must be seconds or a time like 14:00 or 1:14:00")
+    if not math.isfinite(seconds) or seconds < 0:
+        raise ValueError(f"{name} must be a time in the video")
+    return int(round(seconds * 1000))
+
+
+def parse_time_window(start=None, end=None):
+    """(start_ms, end_ms) of a search window from parse_media_time values, None for an open side. Raises ValueError."""
+    start_ms = parse_media_time(start, 'start') if start not in (None, '') else None
+    end_ms = parse_media_time(end, 'end') if end not in (None, '') else None
+    if start_ms is not None and end_ms is not None and start_ms >= end_ms:
+        raise ValueError('end must be after start')
+    return start_ms, end_ms
+
+
+def format_media_time(timestamp_ms):
+    """H:MM:SS.ss, or M:SS.ss under an hour, of a presentation time in milliseconds."""
+    minutes, centiseconds = divmod(int(round(timestamp_ms / 10)), 6000) # Rounded first, 59.999s is 1:00.00 not 0:60.00
+    hours, minutes = divmod(minutes, 60)
+    seconds = f"{centiseconds // 100:02d}.{centiseconds % 100:02d}"
+    return f"{hours}:{minutes:02d}:{seconds}" if hours else f"{minutes}:{seconds}"
+
+
+def collapse_segments(frames, max_gap_ms):
+    """Merges matched frames of the same video presented at most max_gap_ms apart into time segments.
+
+    frames are search results, best first. Returns (best frame, frames in time order) per
+    segment, ordered by the rank of their best frame. Frames without a timestamp stay alone.
+    """
+    segments, by_video = [], {}
+    for rank, frame in enumerate(frames):
+        if frame.get('timestamp_ms') is None:
+            segments.append([(rank, frame)])
+        else:
+            by_video.setdefault(frame['video_id'], []).append((rank, frame))
+    for matches in by_video.values():
+        matches.sort(key=lambda match: match[1]['timestamp_ms'])
+        segment = [matches[0]]
+        for match in matches[1:]:
+            if match[1]['timestamp_ms'] - segment[-1][1]['timestamp_ms'] > max_gap_ms:
+                segments.append(segment)
+                segment = []
+            segment.append(match)
+        segments.append(segment)
+    segments.sort(key=lambda segment: min(rank for rank, _ in segment))
+    return [(min(segment, key=lambda match: match[0])[1], [frame for _, frame in segment]) for segment in segments]
+
+
 class QueryService:
-    def __init__(self, config, db: Database, storage_service: StorageService):
+    def __init__(self, config, db: Database, storage_service: StorageService, vector_index=None, embedder=None):
         self.config = config
         self.db = db
         self.storage_service = storage_service
+        self.vector_index = vector_index # Searches run on the local VectorIndexManager instead of AlloyDB when set
+        self.embedder = embedder or create_embedder(config, db) # Embeds queries once, through the query embedding cache
         self.storage_client = storage.Client()
 
     # When not specified what type of similarity search,
-    # The system will use find_similar_frames_by_objects by default
-    def query_video(self, video_id, query_text, top_k=3):
+    # The system will use QUERY_SEARCH_MODE ('description' unless configured otherwise)
+    # start_ms and end_ms limit the search to the frames presented in [start_ms, end_ms),
+    # group='segments' returns the top_k time segments of adjacent matching frames instead of frames
+    def query_video(self, video_id, query_text, top_k=3, mode=None, fusion=None, start_ms=None, end_ms=None, group=None):
         try:
-            similar_frames = self._find_similar_frames_by_description(query_text, video_id, top_k)
+            mode = mode or self.config.get('QUERY_SEARCH_MODE', 'description')
+            window = {'start_ms': start_ms, 'end_ms': end_ms}
+            candidates = self._candidates(top_k, group)
+            with metrics.timed(metrics.STAGE_QUERY_EMBEDDING):
+                query_embedding = self.embedder.embed_query(query_text)
+            with metrics.timed(metrics.STAGE_SIMILARITY_SEARCH):
+                if mode == 'hybrid':
+                    similar_frames = self._find_similar_frames_hybrid(query_embedding, video_id, candidates, fusion or self.config.get('QUERY_FUSION', 'rrf'), **window)
+                elif mode == 'objects':
+                    similar_frames = self._find_similar_frames_by_objects(query_embedding, video_id, candidates, **window)
+                else:
+                    similar_frames = self._find_similar_frames_by_description(query_embedding, video_id, candidates, **window)
             if not similar_frames:
                 return {'message': 'No relevant video frames found for your query.'}
 
-            results = []
-            
-            for frame_data in similar_frames:
-                logger.debug(f"Similar Find Result : {json.dumps(frame_data)}")
-                frame_gcs_uri = frame_data['frame_gcs_uri']
-                signed_frame_url = self.storage_service.get_signed_url(frame_gcs_uri)
-                # frame_filename = frame_gcs_uri.split('/')[-1]
-                # frame_url = f"/frames/{frame_filename}" # Serve from backend /frames endpoint
-                video_info = self.storage_service.get_video_info(video_id) # Get video metadata to construct link
-                video_gcs_uri = video_info.get('video_gcs_uri') if video_info else None
-                signed_video_link = self.storage_service.get_signed_url(video_gcs_uri) if video_gcs_uri else "#"
-                results.append({
-                    'frame_url': signed_frame_url,
-                    'timeframe': frame_data['timeframe'],
-                    'video_link': signed_video_link,
-                    'detected_objects': json.loads(frame_data['detected_objects_json']), # Include detected objects in results
-                    'text_description': frame_data['text_description'] # Include detected objects in results
-                })
-            return {'frames': results}
+            # The video link is the same for every frame, resolve it once per query
+            signed_video_link = self._video_link(video_id)
+            if group == 'segments':
+                return {'segments': [self._segment_result(best, frames, signed_video_link)
+                                     for best, frames in collapse_segments(similar_frames, self._segment_gap_ms())[:top_k]]}
+            return {'frames': [self._frame_result(frame_data, signed_video_link) for frame_data in similar_frames]}
 
         except Exception as e:
             logger.error(f"Error processing video query: {e}", exc_info=True)
             return {'message': 'Error processing your query.'}
 
-    def _find_similar_frames_by_description(self, query_str, video_id, top_k=3):
+    def query_library(self, query_text, top_k=10, mode=None, fusion=None, video_ids=None, uploaded_after=None, uploaded_before=None,
+                      start_ms=None, end_ms=None, group=None):
+        """Searches the frames of every analyzed video at once, through the AlloyDB ANN indexes.
+
+        Runs in AlloyDB whatever VECTOR_SEARCH_BACKEND is, the local indexes are per video.
+        start_ms, end_ms and group work as in query_video, in every video searched.
+        """
         try:
+            mode = mode or self.config.get('QUERY_SEARCH_MODE', 'description')
+            with metrics.timed(metrics.STAGE_QUERY_EMBEDDING):
+                query_embedding = self.embedder.embed_query(query_text)
+            with metrics.timed(metrics.STAGE_SIMILARITY_SEARCH):
+                similar_frames = self.db.library_similarity_search(
+                    query_embedding,
+                    mode=mode,
+                    top_k=self._candidates(top_k, group),
+                    video_ids=video_ids,
+                    uploaded_after=uploaded_after,
+                    uploaded_before=uploaded_before,
+                    start_ms=start_ms,
+                    end_ms=end_ms,
+                    fusion=fusion or self.config.get('QUERY_FUSION', 'rrf'),
+                    description_weight=float(self.config.get('QUERY_HYBRID_DESCRIPTION_WEIGHT', 0.5)),
+                    rrf_k=int(self.config.get('QUERY_RRF_K', 60)),
+                )
+            if not similar_frames:
+                return {'message': 'No relevant video frames found for your query.'}
+
+            video_links = {} # One signed link per matched video
+            if group == 'segments':
+                matches = collapse_segments(similar_frames, self._segment_gap_ms())[:top_k]
+            else:
+                matches = [(frame_data, None) for frame_data in similar_frames]
+            results = []
+            for frame_data, segment_frames in matches:
+                video_id = frame_data['video_id']
+                if video_id not in video_links:
+                    video_links[video_id] = self._video_link(video_id)
+                if segment_frames is None:
+                    result = self._frame_result(frame_data, video_links[video_id])
+                else:
+                    result = self._segment_result(frame_data, segment_frames, video_links[video_id])
+                result['video_id'] = video_id
+                result['filename'] = frame_data.get('filename')
+                results.append(result)
+            return {'segments' if group == 'segments' else 'frames': results}
+
+        except Exception as e:
+            logger.error(f"Error processing library query: {e}", exc_info=True)
+            return {'message': 'Error processing your query.'}
+
+    def _candidates(self, top_k, group):
+        """Frames to search for top_k results, segments are collapsed from a larger pool of matches."""
+        if group == 'segments':
+            return max(top_k, int(self.config.get('QUERY_SEGMENT_CANDIDATES', 50)))
+        return top_k
+
+    def _segment_gap_ms(self):
+        return int(self.config.get('QUERY_SEGMENT_MAX_GAP_MS', 2000))
+
+    def _video_link(self, video_id):
+        video_info = self.storage_service.get_video_info(video_id) # Get video metadata to construct link
+        video_gcs_uri = video_info.get('video_gcs_uri') if video_info else None
+        return self.storage_service.get_signed_url(video_gcs_uri) if video_gcs_uri else "#"
+
+    def _frame_result(self, frame_data, signed_video_link):
+        logger.debug(f"Similar Find Result : {json.dumps(frame_data, default=str)}")
+        frame_gcs_uri = frame_data['frame_gcs_uri']
+        signed_frame_url = self.storage_service.get_signed_url(frame_gcs_uri)
+        # frame_filename = frame_gcs_uri.split('/')[-1]
+        # frame_url = f"/frames/{frame_filename}" # Serve from backend /frames endpoint
+        return {
+            'frame_url': signed_frame_url,
+            'timeframe': frame_data['timeframe'],
+            'timestamp_ms': frame_data.get('timestamp_ms'), # Presentation time in the video, None for frames stored before it was recorded
+            'video_link': signed_video_link,
+            'detected_objects': json.loads(frame_data['detected_objects_json']), # Include detected objects in results
+            'text_description': frame_data['text_description'], # Include detected objects in results
+            'score': frame_data.get('score'), # Fused or cosine score, when the search backend reports one
+        }
+
+    def _segment_result(self, best_frame, frames, signed_video_link):
+        """A time segment of matching frames, shown by its best frame."""
+        result = self._frame_result(best_frame, signed_video_link)
+        start_ms, end_ms = frames[0].get('timestamp_ms'), frames[-1].get('timestamp_ms')
+        result.update({'start_ms': start_ms, 'end_ms': end_ms, 'frame_count': len(frames)})
+        if start_ms is not None:
+            result['timeframe'] = format_media_time(start_ms) if start_ms == end_ms else f"{format_media_time(start_ms)} - {format_media_time(end_ms)}"
+        return result
+
+    def _find_similar_frames_by_description(self, query_embedding, video_id, top_k=3, start_ms=None, end_ms=None):
+        try:
+            if self.vector_index is not None:
+                return self.vector_index.search(video_id, query_embedding, field='description', top_k=top_k, start_ms=start_ms, end_ms=end_ms)
             similar_frames = self.db.frame_description_similarity_search(
-                query_str, video_id, top_k=top_k
+                query_embedding, video_id, top_k=top_k, start_ms=start_ms, end_ms=end_ms
             )
             return similar_frames
         except Exception as e:
@@ -59,10 +224,28 @@ class QueryService:
             )
             return []
 
-    def _find_similar_frames_by_objects(self, query_str, video_id, top_k=3):
+    def _find_similar_frames_by_objects(self, query_embedding, video_id, top_k=3, start_ms=None, end_ms=None):
         try:
-            similar_frames = self.db.objects_similarity_search(query_str, video_id, top_k=top_k)
+            if self.vector_index is not None:
+                return self.vector_index.search(video_id, query_embedding, field='objects', top_k=top_k, start_ms=start_ms, end_ms=end_ms)
+            similar_frames = self.db.objects_similarity_search(query_embedding, video_id, top_k=top_k, start_ms=start_ms, end_ms=end_ms)
             return similar_frames
         except Exception as e:
             logger.error(f"Error finding similar frames by objects for video {video_id} with query embedding: {e}", exc_info=True)
-            return []
\ No newline at end of file
+            return []
+
+    def _find_similar_frames_hybrid(self, query_embedding, video_id, top_k=3, fusion='rrf', start_ms=None, end_ms=None):
+        try:
+            params = {
+                'fusion': fusion,
+                'description_weight': float(self.config.get('QUERY_HYBRID_DESCRIPTION_WEIGHT', 0.5)),
+                'rrf_k': int(self.config.get('QUERY_RRF_K', 60)),
+                'start_ms': start_ms,
+                'end_ms': end_ms,
+            }
+            if self.vector_index is not None:
+                return self.vector_index.hybrid_search(video_id, query_embedding, top_k=top_k, **params)
+            return self.db.hybrid_similarity_search(query_embedding, video_id, top_k=top_k, **params)
+        except Exception as e:
+            logger.error(f"Error finding similar frames by hybrid search for video {video_id}: {e}", exc_info=True)
+            return []
@@ -0,0 +1,213 @@
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+import cv2
+import numpy as np
+from services.frame_source import FrameSource, SampledFrame, SEEK_MODE_TIMESTAMP
+from services.frame_preparation import resize_to_fit
+
+logger = logging.getLogger(__name__)
+
+HANDOFF_SHARED_MEMORY = 'shared_memory'
+HANDOFF_BYTES = 'bytes'
+HANDOFFS = (HANDOFF_SHARED_MEMORY, HANDOFF_BYTES)
+
+
+def _init_decode_process():
+    # The processes already decode in parallel, more threads per process only oversubscribe the cores
+    cv2.setNumThreads(1)
+    os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', 'threads;1')
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def decode_segment(video_filepath, sampling_rate, mode, start, end, max_size, handoff):
+    """Decodes the sampled frames of one segment in a pool process, with its own capture.
+
+    start and end are frame indexes, or milliseconds in timestamp mode. Frames are
+    downscaled to max_size before the handoff. Returns ('bytes', [SampledFrame]) with the
+    images pickled back to the parent, or ('shared_memory', block name, [(index,
+    timestamp_ms, shape, offset)]) with the images packed in a shared memory block that
+    the parent unlinks.
+    """
+    with FrameSource(video_filepath, sampling_rate, mode) as source:
+        if mode == SEEK_MODE_TIMESTAMP:
+            decoded = source.frames(start_ms=start, end_ms=end)
+        else:
+            decoded = source.frames(start_index=start, end_index=end)
+        frames = [SampledFrame(frame.index, frame.timestamp_ms, np.ascontiguousarray(resize_to_fit(frame.image, max_size))) for frame in decoded]
+
+    if handoff == HANDOFF_BYTES or not frames:
+        return HANDOFF_BYTES, frames
+    block = shared_memory.SharedMemory(create=True, size=sum(frame.image.nbytes for frame in frames))
+    try:
+        layout, offset = [], 0
+        for frame in frames:
+            block.buf[offset:offset + frame.image.nbytes] = frame.image.reshape(-1)
+            layout.append((frame.index, frame.timestamp_ms, frame.image.shape, offset))
+            offset += frame.image.nbytes
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+    # The parent owns the block from here, this process's resource tracker must not unlink it
+    if os.name == 'posix':
+        resource_tracker.unregister(_posix_name(block.name), 'shared_memory')
+    return HANDOFF_SHARED_MEMORY, block.name, layout
+
+
+def _posix_name(name):
+    """Name SharedMemory registers a POSIX block under with the resource tracker, SharedMemory.name drops its leading slash."""
+    return name if name.startswith('/') else '/' + name
+
+
+def _segment_frames(result):
+    """SampledFrames of a decode_segment result, copied out of (and releasing) its shared memory block."""
+    if result[0] == HANDOFF_BYTES:
+        return result[1]
+    _, name, layout = result
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        frames = []
+        for index, timestamp_ms, shape, offset in layout:
+            size = int(np.prod(shape))
+            image = np.frombuffer(block.buf, dtype=np.uint8, count=size, offset=offset).reshape(shape).copy()
+            frames.append(SampledFrame(index, timestamp_ms, image))
+        return frames
+    finally:
+        block.close()
+        block.unlink()
+
+
+class DecodePool:
+    """Worker processes shared by the segmented decodes of every analysis in the process.
+
+    The processes are started by a forkserver where available: it is forked once, here,
+    before the caller starts threads, and every decode process (including the ones that
+    replace a pool broken by a crashed process, on the next submit) is forked from that
+    single-threaded server rather than from the threaded analysis process. forkserver and
+    spawn children import the parent's __main__, so pools are only created by worker.py
+    and the benchmark, whose entry points are guarded, never by app.py.
+    """
+
+    def __init__(self, processes, start_method=None):
+        self.processes = processes
+        if not start_method and 'forkserver' in multiprocessing.get_all_start_methods():
+            start_method = 'forkserver'
+        self._context = multiprocessing.get_context(start_method or None)
+        if self._context.get_start_method() == 'forkserver':
+            # Decode processes fork from a server that already imported OpenCV and numpy
+            self._context.set_forkserver_preload([__name__])
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=self._context, initializer=_init_decode_process)
+        executor.submit(_warm_up).result()
+        logger.info(f"Started {self.processes} decode processes ({self._context.get_start_method()})")
+        return executor
+
+    def submit(self, fn, *args):
+        with self._lock:
+            try:
+                return self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                logger.warning("Decode process pool broken, starting a new one")
+                self._executor.shutdown(wait=False)
+                self._executor = self._create_executor()
+                return self._executor.submit(fn, *args)
+
+    def shutdown(self):
+        with self._lock:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class SegmentedFrameSource(FrameSource):
+    """FrameSource that decodes time segments of the video in parallel, in a DecodePool.
+
+    The sampled positions are cut into segments of segment_frames sampled frames. Each one
+    is decoded by a pool process that opens its own capture and seeks to the segment start,
+    at most lookahead segments run ahead of the consumer, and frames are yielded segment by
+    segment, so in the same timestamp order as a single FrameSource would yield them.
+    About (lookahead + 1) * segment_frames decoded frames are held at a time.
+    """
+
+    def __init__(self, video_filepath, sampling_rate, mode, pool, segment_frames=16, lookahead=None, max_size=0, handoff=HANDOFF_SHARED_MEMORY):
+        if handoff not in HANDOFFS:
+            raise ValueError(f"Unknown decode handoff '{handoff}', expected one of {HANDOFFS}")
+        super().__init__(video_filepath, sampling_rate, mode)
+        self.pool = pool
+        self.segment_frames = max(1, int(segment_frames))
+        self.lookahead = max(1, int(lookahead or pool.processes))
+        self.max_size = max_size
+        self.handoff = handoff
+
+    def _segments(self, start_index, start_ms):
+        """(start, end) of every segment, frame indexes or milliseconds in timestamp mode."""
+        if self.mode == SEEK_MODE_TIMESTAMP:
+            # Bounds sit half a step before a sampling time, so rounding cannot move a sample across them
+            step_ms = 1000.0 / self.sampling_rate
+            first = math.ceil(start_ms / step_ms)
+            count = math.ceil(self.total_frames * 1000.0 / self.fps / step_ms)
+            for sample in range(first, count, self.segment_frames):
+                following = sample + self.segment_frames
+                yield ((sample - 0.5) * step_ms if sample > first else start_ms,
+                       (following - 0.5) * step_ms if following < count else None)
+        else:
+            first = -(-start_index // self.frame_interval) * self.frame_interval
+            span = self.segment_frames * self.frame_interval
+            for start in range(first, self.total_frames, span):
+                yield start, (start + span if start + span < self.total_frames else None)
+
+    def frames(self, cancel_event=None, start_index=0, start_ms=0, end_index=None, end_ms=None):
+        if self.total_frames <= 0 or self.fps <= 0:
+            # Without a frame count and rate the video cannot be split, read it in one pass
+            logger.warning(f"Frame count or rate of {self.video_filepath} unknown, decoding it without segments")
+            yield from super().frames(cancel_event, start_index, start_ms, end_index, end_ms)
+            return
+
+        segments = self._segments(start_index, start_ms)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < self.lookahead:
+                    segment = next(segments, None)
+                    if segment is None:
+                        break
+                    pending.append(self.pool.submit(decode_segment, self.video_filepath, self.sampling_rate, self.mode,
+                                                    segment[0], segment[1], self.max_size, self.handoff))
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if not pending:
+                    self.position = max(self.position, self.total_frames)
+                    return
+                for sampled_frame in _segment_frames(pending.popleft().result()):
+                    if cancel_event is not None and cancel_event.is_set():
+                        return
+                    self.position = sampled_frame.index + 1
+                    yield sampled_frame
+        finally:
+            # Segments decoded ahead still hold shared memory blocks
+            for future in pending:
+                if not future.cancel():
+                    try:
+                        _segment_frames(future.result())
+                    except Exception:
+                        pass
+
+
+def create_decode_pool(config):
+    """DecodePool of VIDEO_DECODE_PROCESSES processes, None to decode on the analysis thread."""
+    processes = int(config.get('VIDEO_DECODE_PROCESSES', 0))
+    if processes <= 1:
+        return None
+    return DecodePool(processes, config.get('VIDEO_DECODE_START_METHOD') or None)
@@ -1,38 +1,109 @@
+import base64
+import json
 import logging
-import os
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 import uuid
 from datetime import timedelta
 from google.cloud import storage
+from google.api_core.exceptions import NotFound
 from db.database import Database
+from services.local_bucket import LocalStorageClient
+from services.ttl_cache import TTLCache
+from services.video_cache import VideoCache, HASH_CHUNK_SIZE
+from services.frame_preparation import frame_extension, frame_mime_type
+from services import metrics
 
 logger = logging.getLogger(__name__)
 
 import urllib.parse
 
+SIGNED_URL_EXPIRATION = timedelta(hours=1)
+# A cached signed URL is always handed out with at least this much validity left
+SIGNED_URL_MIN_REMAINING = timedelta(minutes=10)
+
 def _quote_file_name(filename):
     encoded_filename = urllib.parse.quote_plus(filename) # Encode the password    
 
     return encoded_filename
 
+def _encode_video_cursor(sort, order, value, video_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, order, value, video_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_video_cursor(cursor, sort, order):
+    """(sort value, video_id) the next page starts after."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, video_id = json.loads(payload)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError('cursor was issued for a different sort order')
+    return value, video_id
+
 class StorageService:
     def __init__(self, config, db: Database):
         self.config = config
         self.db=db
-        self.storage_client = storage.Client(project=config.get('GCP_PROJECT_ID'))
+        if config.get('STORAGE_BACKEND', 'gcs') == 'local':
+            self.storage_client = LocalStorageClient(config.get('LOCAL_STORAGE_ROOT', 'uploads/storage'))
+        else:
+            self.storage_client = storage.Client(project=config.get('GCP_PROJECT_ID'))
         self.video_bucket_name = config.get('GCS_BUCKET_NAME_VIDEOS')
         self.frame_bucket_name = config.get('GCS_BUCKET_NAME_FRAMES')
         self.video_bucket = self.storage_client.bucket(self.video_bucket_name)
         self.frame_bucket = self.storage_client.bucket(self.frame_bucket_name)
+        self.frame_format = config.get('STORAGE_FRAME_FORMAT') or config.get('LLM_FRAME_FORMAT', 'jpeg') # Encoding of uploaded frames, see FramePreparer
+
+        # Local content-addressed copies of videos, so analysis does not re-download its input
+        self.video_cache = VideoCache(config.get('VIDEO_CACHE_DIR', 'uploads/video_cache'), int(config.get('VIDEO_CACHE_MAX_BYTES', 20 * 1024 ** 3)))
+        self.gcs_upload_chunk_size = int(config.get('GCS_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+
+        # Frame uploads run on their own executor so the analysis workers don't wait on GCS
+        upload_concurrency = int(config.get('FRAME_UPLOAD_CONCURRENCY', 8))
+        self.upload_executor = ThreadPoolExecutor(max_workers=upload_concurrency, thread_name_prefix='frame-upload')
+        # Bounds the frames (and their bytes) queued for upload, submitters block once it is reached
+        self._upload_slots = threading.BoundedSemaphore(upload_concurrency * 2)
+        self.upload_max_retries = int(config.get('FRAME_UPLOAD_MAX_RETRIES', 3))
+        self.upload_backoff_seconds = float(config.get('FRAME_UPLOAD_BACKOFF_SECONDS', 0.5))
+        # Blob deletions of deleted videos, batched and run on their own executor
+        delete_concurrency = int(config.get('DELETE_CONCURRENCY', 8))
+        self.delete_batch_size = max(1, min(100, int(config.get('DELETE_BATCH_SIZE', 100)))) # GCS batches hold at most 100 requests
+        self.delete_executor = ThreadPoolExecutor(max_workers=delete_concurrency, thread_name_prefix='blob-delete')
+        self._delete_slots = threading.BoundedSemaphore(delete_concurrency * 2)
+        self._deletion_clients = threading.local()
+        self._uploads_pending = 0 # Queued or running frame uploads
+        self._uploads_pending_lock = threading.Lock()
+        metrics.registry.describe('frame_uploads_pending', 'gauge', 'Frame uploads queued or running')
+        metrics.registry.set_callback('frame_uploads_pending', lambda: self._uploads_pending)
+
+        # Signed URLs are reused until shortly before their signature expires
+        signed_url_ttl = min(
+            float(config.get('SIGNED_URL_CACHE_TTL', 2700)),
+            (SIGNED_URL_EXPIRATION - SIGNED_URL_MIN_REMAINING).total_seconds(),
+        )
+        self.signed_url_cache = TTLCache(signed_url_ttl, max_size=int(config.get('SIGNED_URL_CACHE_SIZE', 10000)))
+        self.video_info_cache = TTLCache(float(config.get('VIDEO_METADATA_CACHE_TTL', 300)), max_size=int(config.get('VIDEO_METADATA_CACHE_SIZE', 1024)))
 
     def _compose_gcs_video_name(self,video_id, filename):
         gcs_file_name = f'{video_id}_{_quote_file_name(filename)}'
         return gcs_file_name
 
     def _compose_gcs_frame_name(self,video_id, frame_id):
-        gcs_file_name = f'{video_id}_{frame_id}.jpg'
+        gcs_file_name = f'{video_id}_{frame_id}{frame_extension(self.frame_format)}'
         return gcs_file_name
 
+    def compose_frame_gcs_uri(self, video_id, frame_id):
+        """Returns the gs:// URI a frame is (or will be) uploaded to."""
+        return f"gs://{self.frame_bucket_name}/{self._compose_gcs_frame_name(video_id, frame_id)}"
+
     def get_signed_url(self, gcs_url):
         """Generates a signed URL for the given GCS URL using a service account.
 
@@ -41,154 +112,290 @@ class StorageService:
 
         Returns:
             A signed URL that is valid for one hour, or None if there was an error.
+            URLs are cached and reused while they have more than SIGNED_URL_MIN_REMAINING left.
         """
         try:
-            bucket_name = gcs_url.split('/')[2]
-            blob_name = '/'.join(gcs_url.split('/')[3:])
-            bucket = self.storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-            return blob.generate_signed_url(version="v4", expiration=timedelta(hours=1), method="GET")
+            return self.signed_url_cache.get_or_load(gcs_url, lambda: self._generate_signed_url(gcs_url))
         except Exception as e:
             logger.error(f"Error generating signed URL: {e}", exc_info=True)
             return None
 
+    def _generate_signed_url(self, gcs_url):
+        bucket_name = gcs_url.split('/')[2]
+        blob_name = '/'.join(gcs_url.split('/')[3:])
+        bucket = self.storage_client.bucket(bucket_name)
+        blob = bucket.blob(blob_name)
+        with metrics.timed(metrics.STAGE_URL_SIGNING):
+            return blob.generate_signed_url(version="v4", expiration=SIGNED_URL_EXPIRATION, method="GET")
+
     def upload_video(self, video_file, video_id):
+        """Streams a multipart upload (werkzeug FileStorage) into the video cache, then ingests it."""
         try:
-            # Use only the file name from the uploaded file
-            gcs_file_name = self._compose_gcs_video_name(video_id, video_file.filename)
+            temp_filepath = self.video_cache.new_temp_path()
+            digest = hashlib.sha256()
+            with open(temp_filepath, 'wb') as f:
+                for chunk in iter(lambda: video_file.stream.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            return self.ingest_video_file(temp_filepath, video_file.filename, video_id, digest.hexdigest())
+        except Exception as e:
+            logger.error(f"Error uploading video to GCS: {e}", exc_info=True)
+            raise
 
-            video_url = f"gs://{self.video_bucket_name}/{gcs_file_name}"
-            
-            blob = self.video_bucket.blob(gcs_file_name)
-            blob.upload_from_file(video_file)
+    def ingest_video_file(self, filepath, filename, video_id, checksum=None):
+        """Moves a fully received local file into the video cache, uploads it to GCS and stores its metadata.
 
-            logger.info(f"Video {video_file.filename} uploaded to GCS bucket {self.video_bucket_name}")
-            try:
-                upload_date = datetime.now()
-                video_metadata = {"video_id": video_id, "video_gcs_uri": video_url, "filename": video_file.filename, "upload_date": upload_date}
-                self.db.store_video_metadata(video_metadata)
-                logger.info(f"Video metadata for video_id {video_id} stored in the database.")
-            except Exception as e:
-                logger.error(f"Error storing video metadata in the database: {e}", exc_info=True)
+        The file is sent with a chunked, resumable GCS upload and a crc32c check, and the
+        cached copy is what a later analysis of this video reads.
+        """
+        cached_filepath, checksum = self.video_cache.put(filepath, checksum)
+
+        # Use only the file name from the uploaded file
+        gcs_file_name = self._compose_gcs_video_name(video_id, filename)
+        video_url = f"gs://{self.video_bucket_name}/{gcs_file_name}"
+
+        blob = self.video_bucket.blob(gcs_file_name)
+        blob.chunk_size = self.gcs_upload_chunk_size # Makes the client use a resumable upload
+        blob.upload_from_filename(cached_filepath, checksum='crc32c')
 
-            return video_metadata
+        logger.info(f"Video {filename} uploaded to GCS bucket {self.video_bucket_name}, sha256 {checksum}")
+        upload_date = datetime.now()
+        video_metadata = {"video_id": video_id, "video_gcs_uri": video_url, "filename": filename, "upload_date": upload_date, "checksum": checksum}
+        try:
+            self.db.store_video_metadata(video_metadata)
+            logger.info(f"Video metadata for video_id {video_id} stored in the database.")
         except Exception as e:
-            logger.error(f"Error uploading video to GCS: {e}", exc_info=True)
-            raise
+            logger.error(f"Error storing video metadata in the database: {e}", exc_info=True)
+        return video_metadata
 
-    def download_video_to_temp(self, video_metadata):
+    def get_local_video_copy(self, video_metadata):
+        """Returns a local path to the video's content, from the video cache when possible.
+
+        The file belongs to the video cache and must not be deleted by the caller.
+        """
         try:
-            # video_metadata = self.db.get_video_metadata(video_id)
             if not video_metadata:
-                logger.warning(f"Video metadata not found for video ID: {video_id}")
+                logger.warning("Video metadata not found, cannot fetch the video")
                 return None
 
+            cached_filepath = self.video_cache.get(video_metadata.get("checksum"))
+            if cached_filepath:
+                logger.info(f"Video {video_metadata.get('filename')} served from the local video cache")
+                return cached_filepath
+
             video_gcs_uri = video_metadata.get("video_gcs_uri")
             _,_,bucket_name,_filename = video_gcs_uri.split("/")
             bucket = self.storage_client.bucket(bucket_name)
             blob = bucket.blob(_filename)
 
-            if blob is None :
-                logger.error(f"Cannot find GCS Object as {video_gcs_uri}", exc_info=True)
-                return None
-            
-            temp_filepath = os.path.join(self.config.get('VIDEO_UPLOAD_FOLDER_VIDEOS'), _filename) # Local temp path
+            temp_filepath = self.video_cache.new_temp_path()
             blob.download_to_filename(temp_filepath)
+            cached_filepath, checksum = self.video_cache.put(temp_filepath)
+            if checksum != video_metadata.get("checksum"):
+                self.db.update_video_checksum(video_metadata.get("video_id"), checksum)
+                self.video_info_cache.invalidate(video_metadata.get("video_id"))
             filename = video_metadata.get("filename")
-            logger.info(f"Video {filename} downloaded from GCS to {temp_filepath}")
-            return temp_filepath
+            logger.info(f"Video {filename} downloaded from GCS to {cached_filepath}")
+            return cached_filepath
         except Exception as e:
             logger.error(f"Error downloading video from GCS: {e}", exc_info=True)
             return None
             
+    def _upload_with_retry(self, blob_name, data, content_type):
+        """Uploads to the frame bucket, retrying with exponential backoff and jitter."""
+        attempt = 0
+        while True:
+            try:
+                self.frame_bucket.blob(blob_name).upload_from_string(data, content_type=content_type)
+                return
+            except Exception as e:
+                attempt += 1
+                if attempt > self.upload_max_retries:
+                    raise
+                delay = self.upload_backoff_seconds * (2 ** (attempt - 1)) * (0.5 + random.random())
+                logger.warning(f"Upload of {blob_name} failed (attempt {attempt}/{self.upload_max_retries}), retrying in {delay:.2f}s: {e}")
+                time.sleep(delay)
+
     def upload_frame_bytes(self, frame_id, video_id, frame_bytes):
         if frame_bytes is None:
             logger.warning(f"Frame bytes is None, cannot upload frame {frame_id} for video {video_id}")
             return None
         try:
             gcs_file_name = self._compose_gcs_frame_name(video_id, frame_id)
-            frame_url = f"gs://{self.frame_bucket_name}/{gcs_file_name}"
-
-
-            blob = self.frame_bucket.blob(gcs_file_name)
-            blob.upload_from_string(frame_bytes, content_type='image/jpeg')
-
+            self._upload_with_retry(gcs_file_name, frame_bytes, frame_mime_type(self.frame_format))
             logger.info(f"Frame {gcs_file_name} uploaded to GCS bucket {self.frame_bucket_name}")
-
-            
-            return frame_url
+            return self.compose_frame_gcs_uri(video_id, frame_id)
         except Exception as e:
             logger.error(f"Error uploading frame to GCS: {e}", exc_info=True)
             return None
 
-    def list_videos(self):
-        try:
-            video_metadatas = self.db.list_video_metadata()
-            return video_metadatas
-        except Exception as e:
-            logger.error(f"Error listing videos from GCS: {e}", exc_info=True)
-            return []
+    def upload_frame_bytes_async(self, frame_id, video_id, frame_bytes, callback=None):
+        """Queues a frame upload and returns a Future that resolves to the frame's gs:// URI.
 
+        The URI is known up front (see compose_frame_gcs_uri), so callers can store the frame
+        row right away and confirm the upload later with wait_for_uploads. The future raises
+        if the upload still fails after FRAME_UPLOAD_MAX_RETRIES retries. callback, if given,
+        is called with the future once it is done. Blocks while too many uploads are queued.
+        """
+        gcs_file_name = self._compose_gcs_frame_name(video_id, frame_id)
+        frame_url = self.compose_frame_gcs_uri(video_id, frame_id)
 
-    def _delete_blob(self,bucket_name,object_name):
-        """Deletes a blob from the bucket."""
-        bucket = self.storage_client.bucket(bucket_name)
-        blob = bucket.blob(object_name)
+        def upload():
+            try:
+                with metrics.timed(metrics.STAGE_FRAME_UPLOAD, video_id):
+                    self._upload_with_retry(gcs_file_name, frame_bytes, frame_mime_type(self.frame_format))
+                logger.debug(f"Frame {gcs_file_name} uploaded to GCS bucket {self.frame_bucket_name}")
+                return frame_url
+            finally:
+                self._upload_done()
+
+        self._upload_slots.acquire()
+        with self._uploads_pending_lock:
+            self._uploads_pending += 1
         try:
-            blob.delete()
-            print(f"Blob {object_name} deleted from bucket {bucket_name}.")
-        except Exception as e:
-            print(f"Error deleting blob {object_name} from bucket {bucket_name}: {e}")
+            future = self.upload_executor.submit(upload)
+        except Exception:
+            self._upload_done()
+            raise
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def _upload_done(self):
+        with self._uploads_pending_lock:
+            self._uploads_pending -= 1
+        self._upload_slots.release()
+
+    def wait_for_uploads(self, futures, timeout=None):
+        """Waits for upload futures and returns the number of uploads that failed."""
+        done, not_done = wait(futures, timeout=timeout)
+        failed = len(not_done)
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                logger.error(f"Frame upload failed: {error}")
+        return failed
+
+    def list_videos(self, limit=50, cursor=None, sort='upload_date', order='desc', status=None, filename_contains=None):
+        """Gets one page of videos, {'videos': [...], 'next_cursor': token or None}.
+
+        cursor is the next_cursor of the previous page, an opaque token bound to the sort and
+        order it was issued for. Raises ValueError for a malformed or mismatched cursor.
+        """
+        after = _decode_video_cursor(cursor, sort, order) if cursor else None
+        videos, has_more = self.db.list_videos_page(limit, sort=sort, descending=order == 'desc', after=after,
+                                                    status=status, filename_contains=filename_contains)
+        next_cursor = None
+        if has_more and videos:
+            last = videos[-1]
+            next_cursor = _encode_video_cursor(sort, order, last[sort], last['video_id'])
+        return {'videos': videos, 'next_cursor': next_cursor}
 
 
-    def delete_frames(self,video_id):
-        """Deletes all frames related to the certain video_id."""
-        try:
-            logger.debug(f'Check Frame Existance')
-            frames = self.db.get_frames_by_video_id(video_id)
-            if frames:
-                try:
-                    logger.debug(f'Delete Frames from GCS Bucket')
-                    for frame in frames:
-                        self._delete_blob(self.frame_bucket_name,self._compose_gcs_frame_name(video_id,frame.get("frame_id")))
-                    logger.debug(f"Frames related to video {video_id} have been deleted from GCS!")
-                except Exception as e:
-                    logger.error(f"Error deleting frames from GCS: {e}", exc_info=True)
-
-                logger.debug(f'Delete Frames Metadata from DB')
-                self.db.delete_video_metadata(video_id)
-                logger.info(f"Frame Delete Complete for Video {video_id}")
-        except Exception as e:
-            logger.error(f"Error deleting video from GCS: {e}", exc_info=True)
-
+    def _frame_prefix(self, video_id):
+        """Prefix shared by the names of all of a video's frame blobs, whatever their format."""
+        return f'{video_id}_'
 
     def delete_video(self, video_id):
-        """Delete video file by querying metadata, and delete the file in gcs.
+        """Deletes the video's rows in one transaction and returns the deletion record of its blobs.
 
-        Args:
-            video_id (_type_): _description_
+        The blobs are deleted afterwards by delete_video_blobs, see VideoDeletionService.
+        Returns None when the video does not exist.
         """
-
+        video_metadata = self.db.get_video_metadata(video_id)
+        if video_metadata is None:
+            logger.warning(f"Video metadata not found for video ID: {video_id}")
+            return None
+        deletion = self.db.delete_video_metadata(
+            video_id, self._compose_gcs_video_name(video_id, video_metadata.get('filename')), self._frame_prefix(video_id))
+        self.video_info_cache.invalidate(video_id)
+        self.signed_url_cache.invalidate(video_metadata.get('video_gcs_uri'))
+        logger.info(f"Video {video_metadata.get('filename')} metadata deleted, its blobs are deleted in the background")
+        return deletion
+
+    def _deletion_client(self):
+        """Storage client of the calling deletion thread.
+
+        A GCS batch is tracked on the client that opened it, so batches sent from several
+        threads at once each need their own client.
+        """
+        client = getattr(self._deletion_clients, 'client', None)
+        if client is None:
+            if isinstance(self.storage_client, LocalStorageClient):
+                client = self.storage_client
+            else:
+                client = storage.Client(project=self.config.get('GCP_PROJECT_ID'))
+            self._deletion_clients.client = client
+        return client
+
+    def _delete_blob_batch(self, bucket_name, blob_names):
+        """Deletes up to DELETE_BATCH_SIZE blobs with one batched request, blobs already gone are skipped.
+
+        A GCS batch raises the error of its first failed delete once it is sent, after every
+        delete ran, so a 404 would hide the errors of the deletes after it. When the batch
+        reports a missing blob, the blobs are deleted again one by one: only the missing ones
+        are ignored, any other error is raised.
+        """
+        client = self._deletion_client()
+        bucket = client.bucket(bucket_name)
         try:
-            logger.debug("Check video metadata Existance")
-            video_metadata = self.db.get_video_metadata(video_id)
-            if video_metadata is None:
-                logger.warning(f"Video metadata not found for video ID: {video_id}")
-                return
-
-            logger.debug(f'Delete Related Frames')
-            self.delete_frames(video_id)
-            
-            logger.debug(f'Delete Video File from GCS')
-            self._delete_blob(self.video_bucket_name,self._compose_gcs_video_name(video_id,video_metadata.get('filename')))
-            
-            logger.debug(f'Delete Video Metadata')
-            self.db.delete_video_metadata(video_id)
+            with client.batch():
+                for blob_name in blob_names:
+                    bucket.blob(blob_name).delete()
+        except (NotFound, FileNotFoundError): # FileNotFoundError is raised right away by the local backend
+            bucket.delete_blobs(blob_names, on_error=lambda blob: None)
+
+    def delete_video_blobs(self, deletion, on_progress=None):
+        """Deletes the frame blobs under the deletion's prefix, then the video blob.
+
+        Frame names are listed page by page and deleted in batches of DELETE_BATCH_SIZE, at
+        most DELETE_CONCURRENCY batches at once. on_progress(blobs_deleted) is called as
+        batches complete. Returns the number of blobs deleted, raises IOError when some
+        batches failed so the deletion can be retried.
+        """
+        deleted = 0
+        failed = 0
+        lock = threading.Lock()
 
-            logger.info(f"Video {video_metadata.get('filename')} delete complete !")
-        except Exception as e:
-            logger.error(f"Error deleting video from GCS: {e}", exc_info=True)
+        def delete_batch(bucket_name, blob_names):
+            nonlocal deleted, failed
+            try:
+                with metrics.timed(metrics.STAGE_BLOB_DELETE):
+                    self._delete_blob_batch(bucket_name, blob_names)
+                with lock:
+                    deleted += len(blob_names)
+                    current = deleted
+                if on_progress is not None:
+                    on_progress(current)
+            except Exception as e:
+                logger.error(f"Error deleting {len(blob_names)} blobs from bucket {bucket_name}: {e}", exc_info=True)
+                with lock:
+                    failed += len(blob_names)
+            finally:
+                self._delete_slots.release()
+
+        futures = []
+        batch = []
+        for blob in self.storage_client.list_blobs(self.frame_bucket_name, prefix=deletion['frame_prefix']):
+            batch.append(blob.name)
+            if len(batch) >= self.delete_batch_size:
+                self._delete_slots.acquire() # Bounds the listed names waiting for a deletion thread
+                futures.append(self.delete_executor.submit(delete_batch, self.frame_bucket_name, batch))
+                batch = []
+        if batch:
+            self._delete_slots.acquire()
+            futures.append(self.delete_executor.submit(delete_batch, self.frame_bucket_name, batch))
+        wait(futures)
+
+        if deletion.get('video_object'):
+            self._delete_slots.acquire()
+            delete_batch(self.video_bucket_name, [deletion['video_object']])
+        if failed:
+            raise IOError(f"{failed} blobs of video {deletion['video_id']} could not be deleted")
+        return deleted
 
     def get_video_info(self, video_id):
-        video_metadata = self.db.get_video_metadata(video_id)
+        """Returns the video's metadata, cached for VIDEO_METADATA_CACHE_TTL seconds."""
+        video_metadata = self.video_info_cache.get_or_load(video_id, lambda: self.db.get_video_metadata(video_id))
         return video_metadata
@@ -0,0 +1,142 @@
+import logging
+import os
+import json
+import fcntl
+import hashlib
+import re
+import shutil
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from services.video_cache import sha256_file
+
+logger = logging.getLogger(__name__)
+
+STREAM_READ_SIZE = 1024 * 1024 # Bytes read from the request stream at a time
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class UploadError(Exception):
+    """Raised for invalid upload requests, carries the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadSessionManager:
+    """Resumable, chunked uploads staged on local disk.
+
+    A session is a directory holding the bytes received so far (data.part) and a small
+    meta.json. The current offset is the size of data.part, so a client that lost its
+    connection asks for the offset and continues from there, also after a restart.
+    Chunks are streamed from the request to disk, memory use does not depend on file size.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _session_dir(self, upload_id):
+        if not re.fullmatch(r"[0-9a-f-]{36}", upload_id or ''):
+            raise UploadError(f"Invalid upload id {upload_id}", status=404)
+        path = os.path.join(self.root, upload_id)
+        if not os.path.isdir(path):
+            raise UploadError(f"Upload {upload_id} not found", status=404)
+        return path
+
+    def _read_meta(self, upload_id):
+        with open(os.path.join(self._session_dir(upload_id), 'meta.json')) as f:
+            return json.load(f)
+
+    @contextmanager
+    def _locked(self, upload_id):
+        # flock serializes chunk writes across threads and worker processes
+        with open(os.path.join(self._session_dir(upload_id), 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def create(self, filename, size=None, checksum=None):
+        if not filename:
+            raise UploadError("filename is required")
+        upload_id = str(uuid.uuid4())
+        path = os.path.join(self.root, upload_id)
+        os.makedirs(path)
+        meta = {
+            'upload_id': upload_id,
+            'filename': os.path.basename(filename),
+            'size': int(size) if size is not None else None,
+            'checksum': checksum,
+            'created_at': datetime.now().isoformat(),
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        open(os.path.join(path, 'data.part'), 'wb').close()
+        logger.info(f"Upload session {upload_id} created for {filename}")
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        meta = self._read_meta(upload_id)
+        meta['offset'] = os.path.getsize(os.path.join(self._session_dir(upload_id), 'data.part'))
+        return meta
+
+    def write_chunk(self, upload_id, stream, content_range, chunk_checksum=None):
+        """Appends one chunk read from stream. content_range is the 'bytes start-end/total' header."""
+        match = _CONTENT_RANGE.fullmatch((content_range or '').strip())
+        if not match:
+            raise UploadError("Content-Range header 'bytes start-end/total' is required")
+        start, end = int(match.group(1)), int(match.group(2))
+        if end < start:
+            raise UploadError("Invalid Content-Range")
+
+        with self._locked(upload_id):
+            meta = self.status(upload_id)
+            if start != meta['offset']:
+                raise UploadError(f"Expected chunk at offset {meta['offset']}", status=409, offset=meta['offset'])
+            if meta['size'] is not None and end >= meta['size']:
+                raise UploadError("Chunk goes past the declared file size")
+
+            part_path = os.path.join(self._session_dir(upload_id), 'data.part')
+            expected = end - start + 1
+            received = 0
+            digest = hashlib.sha256()
+            with open(part_path, 'ab') as f:
+                try:
+                    while received < expected:
+                        data = stream.read(min(STREAM_READ_SIZE, expected - received))
+                        if not data:
+                            break
+                        digest.update(data)
+                        f.write(data)
+                        received += len(data)
+                    if received != expected:
+                        raise UploadError(f"Chunk is {received} bytes, Content-Range announced {expected}")
+                    if chunk_checksum and digest.hexdigest() != chunk_checksum.lower():
+                        raise UploadError("Chunk checksum mismatch", status=422)
+                except Exception:
+                    # Drop the partial chunk so the client can retry from the same offset
+                    f.truncate(start)
+                    raise
+        return self.status(upload_id)
+
+    def complete(self, upload_id, checksum=None):
+        """Verifies the upload and returns (filepath, meta). The caller owns the file afterwards."""
+        with self._locked(upload_id):
+            meta = self.status(upload_id)
+            if meta['size'] is not None and meta['offset'] != meta['size']:
+                raise UploadError(f"Upload incomplete, {meta['offset']} of {meta['size']} bytes received", status=409, offset=meta['offset'])
+            part_path = os.path.join(self._session_dir(upload_id), 'data.part')
+            actual_checksum = sha256_file(part_path)
+            expected_checksum = checksum or meta.get('checksum')
+            if expected_checksum and actual_checksum != expected_checksum.lower():
+                raise UploadError("File checksum mismatch", status=422)
+            meta['checksum'] = actual_checksum
+            return part_path, meta
+
+    def discard(self, upload_id):
+        shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
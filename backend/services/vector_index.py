@@ -0,0 +1,613 @@
+import logging
+import os
+import json
+import heapq
+import math
+import random
+import shutil
+import threading
+import time
+import numpy as np
+from services.embedder import normalize
+
+logger = logging.getLogger(__name__)
+
+VECTOR_SEARCH_ALLOYDB = 'alloydb'
+VECTOR_SEARCH_LOCAL = 'local'
+
+FIELD_DESCRIPTION = 'description'
+FIELD_OBJECTS = 'objects'
+# Frame column holding the text each searchable field is embedded from
+FIELD_SOURCE_COLUMNS = {FIELD_DESCRIPTION: 'text_description', FIELD_OBJECTS: 'detected_objects_json'}
+
+FUSION_WEIGHTED = 'weighted'
+FUSION_RRF = 'rrf'
+
+FRAME_COLUMNS = ['frame_id', 'video_id', 'frame_gcs_uri', 'timeframe', 'timestamp_ms', 'detected_objects_json', 'text_description']
+
+
+def frame_row(frame_metadata):
+    """Converts the analysis' frame metadata to the row format returned by similarity searches."""
+    if 'detected_objects_json' in frame_metadata:
+        return {column: frame_metadata.get(column) for column in FRAME_COLUMNS}
+    row = {column: frame_metadata.get(column) for column in FRAME_COLUMNS if column != 'detected_objects_json'}
+    row['detected_objects_json'] = json.dumps(frame_metadata.get('detected_objects', []))
+    return row
+
+
+def fuse_scores(description_scores, objects_scores, fusion=FUSION_RRF, description_weight=0.5, rrf_k=60):
+    """Fuses two aligned arrays of cosine similarities, NaN where a frame has no vector.
+
+    Same formulas as Database.hybrid_similarity_search: a weighted sum of the similarities,
+    or weighted reciprocal rank fusion over the ranks within the given frames.
+    """
+    if fusion == FUSION_WEIGHTED:
+        return description_weight * np.nan_to_num(description_scores) + (1 - description_weight) * np.nan_to_num(objects_scores)
+    if fusion != FUSION_RRF:
+        raise ValueError(f"Unknown fusion '{fusion}'")
+
+    def ranks(scores):
+        order = np.argsort(-np.nan_to_num(scores, nan=-np.inf), kind='stable')
+        result = np.empty(len(scores), dtype=np.float64)
+        result[order] = np.arange(1, len(scores) + 1)
+        return result
+
+    return description_weight / (rrf_k + ranks(description_scores)) + (1 - description_weight) / (rrf_k + ranks(objects_scores))
+
+
+class BruteForceIndex:
+    """Exact cosine search over a NumPy matrix of normalized vectors. Best below a few thousand vectors."""
+
+    kind = 'brute_force'
+
+    def __init__(self, dim, vectors=None):
+        self.dim = dim
+        self._vectors = vectors if vectors is not None else np.zeros((0, dim), dtype=np.float32)
+        self.count = len(self._vectors)
+
+    @property
+    def vectors(self):
+        return self._vectors[:self.count]
+
+    def _append(self, vectors):
+        """Appends rows with amortized doubling, returns the position of the first new row."""
+        start = self.count
+        needed = self.count + len(vectors)
+        if needed > len(self._vectors) or not self._vectors.flags.writeable:
+            # Grows, and also copies a read-only memory-mapped matrix into memory on first write
+            grown = np.empty((max(needed, 2 * len(self._vectors), 64), self.dim), dtype=np.float32)
+            grown[:self.count] = self._vectors[:self.count]
+            self._vectors = grown
+        self._vectors[start:needed] = vectors
+        self.count = needed
+        return start
+
+    def add(self, vectors):
+        return self._append(normalize(vectors))
+
+    def search(self, query, k):
+        """Returns up to k (position, cosine similarity) pairs, best first."""
+        if self.count == 0:
+            return []
+        scores = self.vectors @ normalize(query)
+        k = min(k, self.count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(position), float(scores[position])) for position in top]
+
+    def save(self, path):
+        np.save(os.path.join(path, 'vectors.npy'), np.ascontiguousarray(self.vectors))
+
+    @classmethod
+    def load(cls, path, dim, **params):
+        return cls(dim, np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r'))
+
+
+class HNSWIndex(BruteForceIndex):
+    """Hierarchical navigable small world graph for approximate cosine search on large videos.
+
+    Follows Malkov & Yashunin: every vector gets a random top layer, is linked to its m
+    nearest neighbours (2 * m on layer 0) found by a beam search of width ef_construction,
+    and queries descend greedily through the upper layers before a beam search of width
+    ef_search on layer 0. Vectors share the memory-mapped storage of BruteForceIndex.
+    """
+
+    kind = 'hnsw'
+
+    def __init__(self, dim, vectors=None, m=16, ef_construction=100, ef_search=64, seed=42):
+        super().__init__(dim)
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_multiplier = 1 / math.log(m)
+        self._rng = random.Random(seed)
+        self.levels = []
+        self.layers = [[]] # layers[0][node] is a list, upper layers are dicts node -> list
+        self.entry_point = None
+        self.max_level = -1
+        if vectors is not None and len(vectors):
+            self.add(vectors)
+
+    def _distances(self, query, nodes):
+        return 1.0 - self._vectors[nodes] @ query
+
+    def _neighbors(self, node, level):
+        return self.layers[0][node] if level == 0 else self.layers[level][node]
+
+    def _search_layer(self, query, entry_points, ef, level):
+        """Beam search on one layer, returns (distance, node) pairs sorted by distance."""
+        visited = set(entry_points)
+        distances = self._distances(query, entry_points)
+        candidates = [(float(d), n) for d, n in zip(distances, entry_points)]
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if distance > -results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in self._neighbors(node, level) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for neighbor_distance, neighbor in zip(self._distances(query, neighbors), neighbors):
+                neighbor_distance = float(neighbor_distance)
+                if len(results) < ef or neighbor_distance < -results[0][0]:
+                    heapq.heappush(candidates, (neighbor_distance, neighbor))
+                    heapq.heappush(results, (-neighbor_distance, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, n) for d, n in results)
+
+    def _link(self, node, neighbor, level):
+        links = self._neighbors(neighbor, level)
+        links.append(node)
+        max_links = self.m0 if level == 0 else self.m
+        if len(links) > max_links:
+            distances = self._distances(self._vectors[neighbor], links)
+            keep = np.argsort(distances)[:max_links]
+            links[:] = [links[i] for i in keep]
+
+    def _insert(self, node):
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_multiplier)
+        self.levels.append(level)
+        self.layers[0].append([])
+        while len(self.layers) <= level:
+            self.layers.append({})
+        for upper in range(1, level + 1):
+            self.layers[upper][node] = []
+
+        if self.entry_point is None:
+            self.entry_point, self.max_level = node, level
+            return
+
+        query = self._vectors[node]
+        entry_points = [self.entry_point]
+        for upper in range(self.max_level, level, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, upper)[0][1]]
+        for current in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(query, entry_points, self.ef_construction, current)
+            neighbors = [n for _, n in found[:self.m0 if current == 0 else self.m]]
+            self._neighbors(node, current).extend(neighbors)
+            for neighbor in neighbors:
+                self._link(node, neighbor, current)
+            entry_points = [n for _, n in found]
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def add(self, vectors):
+        start = super().add(vectors)
+        for node in range(start, self.count):
+            self._insert(node)
+        return start
+
+    def search(self, query, k):
+        if self.entry_point is None:
+            return []
+        query = normalize(query)
+        entry_points = [self.entry_point]
+        for level in range(self.max_level, 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, level)[0][1]]
+        found = self._search_layer(query, entry_points, max(self.ef_search, k), 0)
+        return [(node, 1.0 - distance) for distance, node in found[:k]]
+
+    def save(self, path):
+        super().save(path)
+        neighbors0 = np.full((self.count, self.m0), -1, dtype=np.int32)
+        for node, links in enumerate(self.layers[0]):
+            neighbors0[node, :len(links)] = links
+        np.save(os.path.join(path, 'neighbors0.npy'), neighbors0)
+        np.save(os.path.join(path, 'levels.npy'), np.asarray(self.levels, dtype=np.int32))
+        with open(os.path.join(path, 'graph.json'), 'w') as f:
+            json.dump({
+                'entry_point': self.entry_point,
+                'max_level': self.max_level,
+                'upper_layers': [{str(node): links for node, links in layer.items()} for layer in self.layers[1:]],
+            }, f)
+
+    @classmethod
+    def load(cls, path, dim, m=16, ef_construction=100, ef_search=64):
+        index = cls(dim, m=m, ef_construction=ef_construction, ef_search=ef_search)
+        index._vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        index.count = len(index._vectors)
+        neighbors0 = np.load(os.path.join(path, 'neighbors0.npy'), mmap_mode='r')
+        index.layers = [[[int(n) for n in row if n >= 0] for row in neighbors0]]
+        index.levels = np.load(os.path.join(path, 'levels.npy')).tolist()
+        with open(os.path.join(path, 'graph.json')) as f:
+            graph = json.load(f)
+        index.entry_point = graph['entry_point']
+        index.max_level = graph['max_level']
+        index.layers += [{int(node): links for node, links in layer.items()} for layer in graph['upper_layers']]
+        return index
+
+
+_INDEX_TYPES = {BruteForceIndex.kind: BruteForceIndex, HNSWIndex.kind: HNSWIndex}
+
+
+class _FrameIndex:
+    """The vector index of one field of one video, plus the frame rows aligned with its positions."""
+
+    def __init__(self, index, frames):
+        self.index = index
+        self.frames = frames
+        self._positions = None
+        self._timestamps = None
+
+    def positions(self):
+        if self._positions is None or len(self._positions) != len(self.frames):
+            self._positions = {frame['frame_id']: position for position, frame in enumerate(self.frames)}
+        return self._positions
+
+    def timestamps(self):
+        """Presentation time of the frame at each position, NaN when unknown."""
+        if self._timestamps is None or len(self._timestamps) != len(self.frames):
+            self._timestamps = np.array([np.nan if frame.get('timestamp_ms') is None else frame['timestamp_ms'] for frame in self.frames], dtype=np.float64)
+        return self._timestamps
+
+    def search(self, query, k, start_ms=None, end_ms=None):
+        """Returns up to k (position, cosine similarity) pairs, best first, of the frames presented in [start_ms, end_ms).
+
+        Without a window this is the index search. With one only the window's vectors are
+        scored, exactly, rather than filtering the nearest neighbours of the whole video.
+        """
+        if self.index is None:
+            return []
+        if start_ms is None and end_ms is None:
+            return self.index.search(query, k)
+        timestamps = self.timestamps()
+        in_window = ~np.isnan(timestamps)
+        if start_ms is not None:
+            in_window &= timestamps >= start_ms
+        if end_ms is not None:
+            in_window &= timestamps < end_ms
+        positions = np.flatnonzero(in_window)
+        if not len(positions):
+            return []
+        scores = self.index.vectors[positions] @ normalize(query)
+        best = np.argsort(-scores, kind='stable')[:k]
+        return [(int(positions[i]), float(scores[i])) for i in best]
+
+    def scores(self, frame_ids, query):
+        """Cosine similarity of the query with the given frames, NaN for frames not in the index."""
+        scores = np.full(len(frame_ids), np.nan, dtype=np.float32)
+        if self.index is None:
+            return scores
+        positions = self.positions()
+        found = [(i, positions[frame_id]) for i, frame_id in enumerate(frame_ids) if frame_id in positions]
+        if found:
+            rows, positions = zip(*found)
+            scores[list(rows)] = self.index.vectors[list(positions)] @ query
+        return scores
+
+
+class VectorIndexManager:
+    """Per-video local vector indexes used by QueryService in place of the AlloyDB similarity SQL.
+
+    Indexes are built lazily on the first search of a video, from the stored frame embeddings
+    (or by embedding the frame texts when the embedder is not the database model), kept in
+    memory, updated incrementally as the analysis writes frames, and persisted under root as
+    .npy files that are memory-mapped when loaded again. Videos start on a BruteForceIndex and
+    move to an HNSWIndex once they reach hnsw_threshold frames.
+
+    Indexes updated by an analysis are saved every save_interval seconds and by flush() when
+    it ends. Until then a dirty marker in their directory makes any process loading them
+    rebuild from the database instead. Another process saving an index (an analysis run by
+    worker.py) is picked up by the next search, which reloads it.
+
+    Indexes are loaded and built under a lock of their own, searches of other videos only
+    wait on the manager lock while the result is published.
+    """
+
+    def __init__(self, db, embedder, root, hnsw_threshold=5000, hnsw_params=None, save_interval=60.0):
+        self.db = db
+        self.embedder = embedder
+        self.root = root
+        self.hnsw_threshold = hnsw_threshold
+        self.hnsw_params = hnsw_params or {}
+        self.save_interval = float(save_interval)
+        self._indexes = {}
+        self._dirty = {} # (video_id, field) -> monotonic time of the first change not saved yet
+        self._disk_versions = {} # (video_id, field) -> version of the meta.json this process loaded or saved
+        self._load_locks = {} # (video_id, field) -> lock held while the index is loaded or built, dropped with the index
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, video_id, field):
+        return os.path.join(self.root, video_id, field)
+
+    def _disk_version(self, video_id, field):
+        try:
+            meta = os.stat(os.path.join(self._path(video_id, field), 'meta.json'))
+            return meta.st_ino, meta.st_mtime_ns # Saves replace the directory, so the inode changes even within the mtime resolution
+        except FileNotFoundError:
+            return None
+
+    def _is_dirty_on_disk(self, video_id, field):
+        return os.path.exists(os.path.join(self._path(video_id, field), 'dirty'))
+
+    def _new_index(self, dim, count):
+        if count >= self.hnsw_threshold:
+            return HNSWIndex(dim, **self.hnsw_params)
+        return BruteForceIndex(dim)
+
+    def _load(self, video_id, field):
+        path = self._path(video_id, field)
+        if self._is_dirty_on_disk(video_id, field):
+            logger.info(f"{field} index of video {video_id} is missing frames not saved yet, rebuilding it")
+            return None
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta['embedder'] != self.embedder.name:
+                logger.info(f"Discarding {field} index of video {video_id}, built with embedder {meta['embedder']}")
+                return None
+            params = self.hnsw_params if meta['kind'] == HNSWIndex.kind else {}
+            index = _INDEX_TYPES[meta['kind']].load(path, meta['dim'], **params)
+            with open(os.path.join(path, 'frames.json')) as f:
+                frames = json.load(f)
+            if frames and 'timestamp_ms' not in frames[0]:
+                logger.info(f"Discarding {field} index of video {video_id}, saved without frame timestamps")
+                return None
+            return _FrameIndex(index, frames)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error loading {field} index of video {video_id}, rebuilding it: {e}", exc_info=True)
+            return None
+
+    def _save(self, video_id, field, frame_index):
+        self._write(video_id, field, frame_index)
+        self._dirty.pop((video_id, field), None)
+        self._disk_versions[(video_id, field)] = self._disk_version(video_id, field)
+
+    def _write(self, video_id, field, frame_index):
+        path = self._path(video_id, field)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        frame_index.index.save(tmp_path)
+        with open(os.path.join(tmp_path, 'frames.json'), 'w') as f:
+            json.dump(frame_index.frames, f)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'kind': frame_index.index.kind, 'dim': frame_index.index.dim, 'embedder': self.embedder.name, 'count': frame_index.index.count}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def _mark_dirty(self, video_id, field):
+        """Records unsaved changes, on disk too so other processes and restarts do not load the stale copy."""
+        if (video_id, field) in self._dirty:
+            return
+        path = self._path(video_id, field)
+        os.makedirs(path, exist_ok=True)
+        open(os.path.join(path, 'dirty'), 'w').close()
+        self._dirty[(video_id, field)] = time.monotonic()
+
+    def _discard(self, video_id, field):
+        self._indexes.pop((video_id, field), None)
+        self._load_locks.pop((video_id, field), None)
+        self._dirty.pop((video_id, field), None)
+        self._disk_versions.pop((video_id, field), None)
+        shutil.rmtree(self._path(video_id, field), ignore_errors=True)
+
+    def _embed_frames(self, video_id, field, frames):
+        """Returns (frames, vectors) for the given frame rows, dropping frames without a vector."""
+        if not frames:
+            return [], None
+        if self.embedder.uses_stored_embeddings:
+            stored = self.db.get_frame_embeddings(video_id, field, frame_ids=[frame['frame_id'] for frame in frames])
+            frames = [frame for frame, _ in stored]
+            vectors = np.asarray([vector for _, vector in stored], dtype=np.float32)
+        else:
+            column = FIELD_SOURCE_COLUMNS[field]
+            vectors = self.embedder.embed([frame.get(column) or '' for frame in frames])
+        return frames, vectors
+
+    def _build(self, video_id, field):
+        """Builds the index from the database and writes it to disk, returns (frame index, whether it was written)."""
+        if self.embedder.uses_stored_embeddings:
+            stored = self.db.get_frame_embeddings(video_id, field)
+            frames = [frame for frame, _ in stored]
+            vectors = np.asarray([vector for _, vector in stored], dtype=np.float32)
+        else:
+            frames, vectors = self._embed_frames(video_id, field, self.db.get_frames_by_video_id(video_id))
+        frame_index = _FrameIndex(None, [])
+        written = False
+        if frames:
+            frame_index.index = self._new_index(vectors.shape[1], len(frames))
+            frame_index.index.add(vectors)
+            frame_index.frames = frames
+            if not self._is_dirty_on_disk(video_id, field): # Else the analysis adding frames saves it
+                self._write(video_id, field, frame_index)
+                written = True
+        logger.info(f"Built {field} index for video {video_id} with {len(frames)} frames")
+        return frame_index, written
+
+    def _cached(self, key):
+        """The index of key held in memory, None when there is none or another process saved a newer one. Called under the lock."""
+        frame_index = self._indexes.get(key)
+        if frame_index is not None and key not in self._dirty and self._disk_version(*key) != self._disk_versions.get(key):
+            logger.info(f"{key[1]} index of video {key[0]} changed on disk, reloading it")
+            del self._indexes[key]
+            self._disk_versions.pop(key, None)
+            return None
+        return frame_index
+
+    def _get(self, video_id, field, build=True):
+        """Returns the index of a video's field, loading or building it first. Called without the lock."""
+        key = (video_id, field)
+        with self._lock:
+            frame_index = self._cached(key)
+            if frame_index is not None:
+                return frame_index
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock: # Concurrent searches of the same index wait for one load or build
+            with self._lock:
+                frame_index = self._cached(key)
+                if frame_index is not None:
+                    return frame_index
+            version = self._disk_version(video_id, field) # Read first, a save landing during the load triggers another reload
+            frame_index = self._load(video_id, field)
+            if frame_index is None:
+                if not build:
+                    return None
+                frame_index, written = self._build(video_id, field)
+                if written:
+                    version = self._disk_version(video_id, field)
+            with self._lock:
+                if self._load_locks.get(key) is not load_lock:
+                    # Dropped meanwhile, serve this search without keeping the index, in memory or on disk
+                    if written and key not in self._load_locks:
+                        shutil.rmtree(self._path(video_id, field), ignore_errors=True)
+                    return frame_index
+                self._indexes[key] = frame_index
+                self._disk_versions.setdefault(key, version)
+            return frame_index
+
+    def search(self, video_id, query_embedding, field=FIELD_DESCRIPTION, top_k=3, start_ms=None, end_ms=None):
+        """Returns the top_k frames most similar to query_embedding, in the row format of the SQL similarity search.
+
+        start_ms and end_ms restrict the search to the frames presented in [start_ms, end_ms).
+        """
+        query = normalize(query_embedding)
+        frame_index = self._get(video_id, field)
+        with self._lock:
+            hits = frame_index.search(query, top_k, start_ms, end_ms)
+            return [dict(frame_index.frames[position], score=score) for position, score in hits]
+
+    def hybrid_search(self, video_id, query_embedding, top_k=3, fusion=FUSION_RRF, description_weight=0.5, rrf_k=60, start_ms=None, end_ms=None):
+        """Fuses the description and objects similarities of a video's frames, see fuse_scores.
+
+        Candidates are the union of both indexes' nearest neighbours, which is every frame
+        for brute-force sized videos, then both similarities are computed exactly for each.
+        With start_ms or end_ms only the frames presented in [start_ms, end_ms) are candidates.
+        """
+        query = normalize(query_embedding)
+        description = self._get(video_id, FIELD_DESCRIPTION)
+        objects = self._get(video_id, FIELD_OBJECTS)
+        with self._lock:
+            candidates = {}
+            for frame_index in (description, objects):
+                for position, _ in frame_index.search(query, max(top_k * 10, 100), start_ms, end_ms):
+                    frame = frame_index.frames[position]
+                    candidates.setdefault(frame['frame_id'], frame)
+            if not candidates:
+                return []
+            frame_ids = list(candidates)
+            fused = fuse_scores(
+                description.scores(frame_ids, query),
+                objects.scores(frame_ids, query),
+                fusion=fusion,
+                description_weight=description_weight,
+                rrf_k=rrf_k,
+            )
+            best = np.argsort(-fused, kind='stable')[:top_k]
+            return [dict(candidates[frame_ids[i]], score=float(fused[i])) for i in best]
+
+    def add_frames(self, frames_metadata):
+        """Adds newly stored frames to the indexes that already exist for their video.
+
+        Videos without an index are skipped, their index is built from the database on the
+        first search instead. The frames are embedded (or their stored embeddings fetched)
+        without holding the lock, searches only wait for the vectors to be appended.
+        """
+        by_video = {}
+        for frame_metadata in frames_metadata:
+            by_video.setdefault(frame_metadata['video_id'], []).append(frame_row(frame_metadata))
+        for video_id, frames in by_video.items():
+            for field in FIELD_SOURCE_COLUMNS:
+                frame_index = self._get(video_id, field, build=False)
+                if frame_index is None:
+                    continue
+                with self._lock:
+                    if self._indexes.get((video_id, field)) is not frame_index:
+                        continue # Dropped meanwhile, the next search rebuilds it from the database
+                    if any(frame['frame_id'] in frame_index.positions() for frame in frames):
+                        # Re-analyzed frames replace their rows, rebuild from the database on the next search
+                        self._discard(video_id, field)
+                        continue
+                try:
+                    new_frames, vectors = self._embed_frames(video_id, field, frames)
+                    if not new_frames:
+                        continue
+                    with self._lock:
+                        if self._indexes.get((video_id, field)) is not frame_index:
+                            continue # Rebuilt or reloaded meanwhile, from a database that already has these frames
+                        if frame_index.index is None:
+                            frame_index.index = self._new_index(vectors.shape[1], len(new_frames))
+                        elif frame_index.index.kind == BruteForceIndex.kind and frame_index.index.count + len(new_frames) >= self.hnsw_threshold:
+                            logger.info(f"Moving {field} index of video {video_id} to HNSW")
+                            existing = np.array(frame_index.index.vectors)
+                            frame_index.index = HNSWIndex(existing.shape[1], **self.hnsw_params)
+                            frame_index.index.add(existing)
+                        frame_index.index.add(vectors)
+                        frame_index.frames.extend(new_frames)
+                        self._mark_dirty(video_id, field)
+                        if time.monotonic() - self._dirty[(video_id, field)] >= self.save_interval:
+                            self._save(video_id, field, frame_index)
+                except Exception as e:
+                    # The index is out of date, drop it so the next search rebuilds it
+                    logger.error(f"Error adding frames to {field} index of video {video_id}: {e}", exc_info=True)
+                    with self._lock:
+                        self._discard(video_id, field)
+
+    def flush(self, video_id=None):
+        """Saves the indexes changed since their last save, of one video or of all, called when an analysis ends."""
+        with self._lock:
+            for key in [key for key in self._dirty if video_id is None or key[0] == video_id]:
+                try:
+                    self._save(key[0], key[1], self._indexes[key])
+                except Exception as e:
+                    logger.error(f"Error saving {key[1]} index of video {key[0]}: {e}", exc_info=True)
+                    self._discard(*key)
+
+    def drop(self, video_id):
+        with self._lock:
+            for field in FIELD_SOURCE_COLUMNS:
+                self._indexes.pop((video_id, field), None)
+                self._load_locks.pop((video_id, field), None)
+                self._dirty.pop((video_id, field), None)
+                self._disk_versions.pop((video_id, field), None)
+            shutil.rmtree(os.path.join(self.root, video_id), ignore_errors=True)
+
+
+def create_vector_index(config, db, embedder):
+    """Builds the local vector index manager, or None when searches go to AlloyDB."""
+    if config.get('VECTOR_SEARCH_BACKEND', VECTOR_SEARCH_ALLOYDB) != VECTOR_SEARCH_LOCAL:
+        return None
+    return VectorIndexManager(
+        db,
+        embedder,
+        config.get('VECTOR_INDEX_DIR', 'cache/vector_index'),
+        hnsw_threshold=int(config.get('VECTOR_INDEX_HNSW_THRESHOLD', 5000)),
+        hnsw_params={
+            'm': int(config.get('VECTOR_INDEX_HNSW_M', 16)),
+            'ef_construction': int(config.get('VECTOR_INDEX_HNSW_EF_CONSTRUCTION', 100)),
+            'ef_search': int(config.get('VECTOR_INDEX_HNSW_EF_SEARCH', 64)),
+        },
+        save_interval=float(config.get('VECTOR_INDEX_SAVE_INTERVAL', 60)),
+    )
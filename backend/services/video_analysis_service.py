@@ -1,155 +1,219 @@
 import logging
-import os
-import cv2
 import numpy as np
-import uuid
-import threading
 import time
 from services.llm_service import LLMService
 from services.storage_service import StorageService
+from services.frame_source import FrameSource, SEEK_MODE_GRAB
+from services.segmented_frame_source import SegmentedFrameSource
+from services.frame_sampler import create_frame_sampler
+from services.analysis_pipeline import AnalysisPipeline
+from services.llm_cache import dhash
+from services.frame_preparation import create_frame_preparer
+from services import metrics
+from services.analysis_checkpoint import AnalysisCheckpoint, frame_id_for
 from db.database import Database
+from db.frame_writer import FrameWriter
 
 logger = logging.getLogger(__name__)
 
 class VideoAnalysisService:
+    """Runs video analyses. Jobs are queued in the analysis_jobs table by start_analysis and
+    executed by AnalysisWorker (worker.py, or the worker embedded in the API process), which
+    calls run_analysis. Status and progress are read back from the table, so any API process
+    can answer for any job."""
 
-    def load_finished_videos(self):
-        ids = self.db.get_analyzed_video_list()
-        for x in ids:
-            _video_id = x["video_id"]
-            if (_video_id not in self.analysis_processes):
-                self.analysis_processes[_video_id] = {
-                    'status': 'Completed',
-                    'progress': 100,
-                }
-                
-
-    def __init__(self, config, storage_service: StorageService, db: Database):
+    def __init__(self, config, storage_service: StorageService, db: Database, vector_index=None, decode_pool=None):
         self.config = config
         self.storage_service = storage_service
         self.db = db
+        self.vector_index = vector_index # Local vector index kept up to date as frames are stored, if any
         self.llm_service = LLMService(config)
-        self.analysis_processes = {} # track analysis process status, progress, cancellation
-        self.load_finished_videos()
+        self.frame_preparer = create_frame_preparer(config) # Downscales and encodes frames for the model and for storage
+        self.decode_pool = decode_pool # DecodePool of processes decoding video segments in parallel, None to decode on the analysis thread
         self.analysis_progress_interval = config.get('ANALYSIS_PROGRESS_UPDATE_INTERVAL') # seconds
 
-    def start_analysis(self, video_id):
-        if video_id in self.analysis_processes and self.analysis_processes[video_id]['status'] == 'Running':
-            raise ValueError(f"Analysis already running for video ID: {video_id}")
-
-        self.analysis_processes[video_id] = {
-            'status': 'Pending',
-            'progress': 0,
-            'cancel_event': threading.Event() # For cancellation
-        }
-        # self.db.delete_video_metadata(video_id)
-        thread = threading.Thread(target=self._analyze_video_thread, args=(video_id,))
-        thread.start()
-        self.analysis_processes[video_id]['status'] = 'Running'
-        logger.info(f"Analysis thread started for video ID: {video_id}")
+    def start_analysis(self, video_id, resume=True):
+        """Queues the analysis of a video, raises ValueError when one is already queued or running.
+
+        With resume, the analysis continues after the video's checkpoint, if any.
+        """
+        job_id = self.db.create_analysis_job(video_id, resume=resume)
+        logger.info(f"Analysis job {job_id} queued for video ID: {video_id}")
+        return job_id
 
     def get_analysis_progress(self, video_id):
-        if video_id not in self.analysis_processes:
+        job = self.db.get_latest_analysis_job(video_id)
+        if job is None:
             return {'status': 'NotFound', 'progress': 0}
-        process_info = self.analysis_processes[video_id]
-        return {'status': process_info['status'], 'progress': process_info['progress']}
+        return {key: job[key] for key in ('status', 'progress', 'frames_analyzed', 'frames_per_second', 'eta_seconds')}
 
-    
     def cancel_analysis(self, video_id):
-        if video_id in self.analysis_processes and self.analysis_processes[video_id]['status'] == 'Running':
-            self.analysis_processes[video_id]['cancel_event'].set() # Signal cancellation
-            self.analysis_processes[video_id]['status'] = 'Cancelling'
+        if self.db.request_analysis_job_cancel(video_id):
             logger.info(f"Cancellation requested for video ID: {video_id}")
         else:
             logger.warning(f"No running analysis to cancel for video ID: {video_id}")
 
-    def _analyze_video_thread(self, video_id):
+    def _process_frames(self, video_id, sampled_frames, upload_futures):
+        """Encodes, analyzes and uploads a batch of sampled frames. Runs on a pipeline worker thread.
+
+        Each frame is encoded once per rendition by the frame preparer, the model gets its bytes
+        inline and the upload reuses them unless storage has its own size or format.
+        The frames go to the LLM in one request when LLM_BATCH_SIZE > 1. Uploads are queued
+        on the storage upload executor and their futures stored in upload_futures by frame id,
+        the returned metadata already carries each frame's final gs:// URI.
+        """
+        prepared_frames = []
+        for sampled_frame in sampled_frames:
+            with metrics.timed(metrics.STAGE_ENCODE, video_id):
+                prepared_frames.append(self.frame_preparer.prepare(sampled_frame.image))
+        llm_images = [prepared_frame.llm_image for prepared_frame in prepared_frames]
+
+        # Analyze frames using LLM, near-duplicates of earlier frames are served from the result cache
+        image_hashes = [dhash(sampled_frame.image) for sampled_frame in sampled_frames]
+        if len(sampled_frames) == 1:
+            analysis_results = [self.llm_service.analyze_image(llm_images[0], image_hash=image_hashes[0], job_key=video_id)]
+        else:
+            analysis_results = self.llm_service.analyze_images(llm_images, image_hashes=image_hashes, job_key=video_id)
+
+        frames_metadata = []
+        for sampled_frame, prepared_frame, frame_analysis_result in zip(sampled_frames, prepared_frames, analysis_results):
+            if not frame_analysis_result:
+                frames_metadata.append(None)
+                continue
+            frame_id = frame_id_for(video_id, sampled_frame.timestamp_ms) # Deterministic, re-runs upsert the same rows
+            upload_futures[frame_id] = self.storage_service.upload_frame_bytes_async(frame_id, video_id, prepared_frame.storage_image.data)
+            frame_metadata = {
+                'frame_id': frame_id,
+                'video_id': video_id,
+                'frame_gcs_uri': self.storage_service.compose_frame_gcs_uri(video_id, frame_id),
+                'timeframe': f"Frame {sampled_frame.timestamp_ms / 1000:.2f}s",
+                'timestamp_ms': sampled_frame.timestamp_ms, # Presentation time of the frame, indexed for time-range search
+                'detected_objects': frame_analysis_result.get('detected_objects', []), # List of objects with labels and bounding boxes
+                'text_description': frame_analysis_result.get('text_description', '')
+            }
+            logger.debug(f"Frame index {sampled_frame.index} analyzed, upload queued, Timeframe is {frame_metadata['timeframe']}")
+            frames_metadata.append(frame_metadata)
+        return frames_metadata
+
+    def run_analysis(self, video_id, cancel_event, on_progress=None, resume=True):
+        """Analyzes a video on the calling thread, returns 'Completed' or 'Cancelled' and raises on errors.
+
+        on_progress is called with the progress percentage and the number of frames analyzed
+        so far by this run. With resume,
+        decoding seeks past the video's checkpoint when it was taken with the same sampling settings.
+        """
+        logger.info(f"Starting video analysis for video ID: {video_id}")
+        target_video_metadata = self.storage_service.get_video_info(video_id)
+        video_filepath = self.storage_service.get_local_video_copy(target_video_metadata) # Owned by the video cache, not removed here
+
+        if not video_filepath:
+            raise FileNotFoundError(f"Failed to download video {video_id} for analysis.")
+
+        sampling_rate = int(self.config.get('VIDEO_SAMPLING_RATE','1'))
+        seek_mode = self.config.get('VIDEO_FRAME_SEEK_MODE', SEEK_MODE_GRAB)
+        if self.decode_pool is not None:
+            source = SegmentedFrameSource(
+                video_filepath, sampling_rate, seek_mode, self.decode_pool,
+                segment_frames=self.config.get('VIDEO_DECODE_SEGMENT_FRAMES', 16),
+                max_size=self.frame_preparer.max_size,
+                handoff=self.config.get('VIDEO_DECODE_HANDOFF', 'shared_memory'),
+            )
+        else:
+            source = FrameSource(video_filepath, sampling_rate, seek_mode)
+
+        fps = source.fps
+        frame_interval = source.frame_interval
+        total_frames = source.total_frames
+        logger.info(f"Video FPS: {fps}, Sampling Rate: {sampling_rate}, Frame Interval: {frame_interval}, Total Frames: {total_frames}, Seek Mode: {seek_mode}, Decode Processes: {self.decode_pool.processes if self.decode_pool else 1}")
+
+        # Frames selected by another sampling configuration do not line up with the checkpoint
+        config_key = f"{seek_mode}:{sampling_rate}:{self.config.get('FRAME_SAMPLER', 'fixed')}"
+        start_index, start_ms = 0, 0
+        saved_checkpoint = self.db.get_analysis_checkpoint(video_id) if resume else None
+        if saved_checkpoint and saved_checkpoint['config_key'] == config_key:
+            start_index, start_ms = saved_checkpoint['frame_index'] + 1, saved_checkpoint['timestamp_ms'] + 1
+            logger.info(f"Resuming analysis of video {video_id} after frame {saved_checkpoint['frame_index']} ({saved_checkpoint['timestamp_ms']} ms)")
+        elif saved_checkpoint:
+            logger.info(f"Sampling settings of video {video_id} changed since its checkpoint, analyzing from the start")
+        checkpoint = AnalysisCheckpoint(self.db, video_id, config_key, save_interval=self.config.get('ANALYSIS_CHECKPOINT_INTERVAL', 10))
+
+        sampler = create_frame_sampler(self.config)
+        progress_log_every = max(1, sampling_rate * self.analysis_progress_interval)
+
+        def produce():
+            decoded_frames = source.frames(cancel_event, start_index=start_index, start_ms=start_ms)
+            for sampled_frame in metrics.timed_iter(decoded_frames, metrics.STAGE_DECODE, video_id):
+                if sampler.should_emit(sampled_frame):
+                    yield sampled_frame
+
+        def on_flush(frames_metadata):
+            checkpoint.written(frames_metadata)
+            if self.vector_index is not None:
+                self.vector_index.add_frames(frames_metadata)
+
+        frame_writer = FrameWriter(
+            self.db,
+            batch_size=self.config.get('FRAME_WRITER_BATCH_SIZE', 50),
+            flush_interval=self.config.get('FRAME_WRITER_FLUSH_INTERVAL', 5),
+            name=f"analysis-{video_id}",
+            on_flush=on_flush,
+        )
+
+        def consume(sampled_frame, frame_metadata):
+            if frame_metadata:
+                frame_writer.add(frame_metadata)
+                logger.debug(f"Frame {frame_metadata['frame_id']} analysis result queued for storage for video {video_id}")
+                checkpoint.consumed(sampled_frame, frame_metadata['frame_id'], upload_futures.get(frame_metadata['frame_id']))
+            else:
+                checkpoint.consumed(sampled_frame)
+            progress = int(sampled_frame.index * 100 / total_frames) if total_frames > 0 else 0
+            if on_progress:
+                on_progress(progress, pipeline.consumed + 1)
+            if (pipeline.consumed + 1) % progress_log_every == 0: # Update status periodically
+                logger.info(f"Analysis progress for video {video_id}: {progress}% analyzed frames: {pipeline.consumed + 1}, decoded position: {source.position}/{total_frames}")
+
+        upload_futures = {} # frame id -> upload future
+        pipeline = AnalysisPipeline(
+            produce(),
+            lambda sampled_frames: self._process_frames(video_id, sampled_frames, upload_futures),
+            consume,
+            workers=self.config.get('ANALYSIS_LLM_WORKERS', 4),
+            queue_size=self.config.get('ANALYSIS_QUEUE_SIZE', 16),
+            cancel_event=cancel_event,
+            name=f"analysis-{video_id}",
+            batch_size=self.config.get('LLM_BATCH_SIZE', 1),
+        )
+        metrics.track_video(video_id)
+        for queue_name, depth in (('work', pipeline.work_queue_depth), ('results', pipeline.result_queue_depth), ('frame_writer', frame_writer.pending)):
+            metrics.registry.set_callback('analysis_queue_depth', depth, video_id=video_id, queue=queue_name)
         try:
-            logger.info(f"Starting video analysis for video ID: {video_id}")
-            target_video_metadata = self.storage_service.get_video_info(video_id)
-            video_filepath = self.storage_service.download_video_to_temp(target_video_metadata)
-            
-            if not video_filepath:
-                raise FileNotFoundError(f"Failed to download video {video_id} for analysis.")
-
-            sampling_rate = int(self.config.get('VIDEO_SAMPLING_RATE','1'))
-            frame_count = 0
-            processed_frames = 0
-            cap = cv2.VideoCapture(video_filepath)
-            if not cap.isOpened():
-                raise IOError(f"Cannot open video file: {video_filepath}")
-
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            logger.debug(f"fps={fps}")
-            frame_interval = int(fps / sampling_rate) if fps > sampling_rate else 1
-            logger.debug(f"frame_interval={frame_interval}")
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            logger.debug(f"total_frames={total_frames}")
-            logger.info(f"Video FPS: {fps}, Sampling Rate: {sampling_rate}, Frame Interval: {frame_interval}, Total Frames: {total_frames}")
-
-            while True:
-                if self.analysis_processes[video_id]['cancel_event'].is_set():
-                    logger.info(f"Analysis cancelled by user for video ID: {video_id}")
-                    self.analysis_processes[video_id]['status'] = 'Cancelled'
-                    break
-
-                ret, frame = cap.read()
-                if not ret:
-                    logger.info(f"End of video reached for video ID: {video_id}")
-                    break
-
-                if frame_count % frame_interval == 0:
-                    frame_id = str(uuid.uuid4())
-                    frame_filename = f"frame_{video_id}_{frame_id}.jpg"
-
-                    # Convert the frame to JPEG bytes
-                    ret, frame_bytes = cv2.imencode('.jpg', frame)
-                    if not ret:
-                         raise Exception("Could not convert frame to bytes")
-                    frame_bytes = frame_bytes.tobytes()
-
-                    # Analyze frame using LLM
-                    frame_analysis_result = self.llm_service.analyze_image(frame_bytes)
-
-                    # Analyze frame using LLM and create embedding
-                    if frame_analysis_result:
-                        frame_gcs_uri = self.storage_service.upload_frame_bytes(frame_id, video_id, frame_bytes)
-
-                        # self.storage_service.upload_frame_bytes(frame_bytes, frame_filename)
-                        logger.debug(f"Frame {frame_id} uploaded to GCS for video {video_id}")
-                        frame_metadata = {
-                            'frame_id': frame_id,
-                            'video_id': video_id,
-                            'frame_gcs_uri': frame_gcs_uri,
-                            'timeframe': f"Frame {processed_frames / frame_interval}s", # Example timeframe
-                            'detected_objects': frame_analysis_result.get('detected_objects', []), # List of objects with labels and bounding boxes
-                            'text_description': frame_analysis_result.get('text_description', '')
-                        }
-                        logger.debug(f"Current processed_frames is {processed_frames}")
-                        logger.debug(f"Current total_frames is {total_frames}")
-                        logger.debug(f"Current frame_interval is {frame_interval}")
-                        logger.debug(f"Current Timeframe is {frame_metadata['timeframe']}")
-                        self.db.store_frame_metadata(frame_metadata)
-                        logger.debug(f"Frame {frame_id} analysis result stored for video {video_id}")
-
-                frame_count += 1
-                processed_frames += 1
-                progress = int((processed_frames * frame_interval / total_frames) * 100) if total_frames > 0 else 0
-                self.analysis_processes[video_id]['progress'] = progress
-
-                if processed_frames % (int(fps) * self.analysis_progress_interval) == 0: # Update status periodically
-                    logger.info(f"Analysis progress for video {video_id}: {progress}% processed frames: {processed_frames}/{total_frames}")
-
-            cap.release()
-            os.remove(video_filepath) # Clean up temp video file
-            self.analysis_processes[video_id]['status'] = 'Completed'
-            # self.finished_analysis_videos[video_id] = True
-            # self.db.mark_video_as_finished(video_id)
-            logger.info(f"Video analysis completed for video ID: {video_id}")
-
-        except Exception as e:
-            logger.error(f"Error during video analysis for video ID: {video_id}: {e}", exc_info=True)
-            self.analysis_processes[video_id]['status'] = 'Error'
+            processed_frames = pipeline.run()
         finally:
-            if video_id in self.analysis_processes and self.analysis_processes[video_id]['status'] not in ['Completed', 'Cancelled', 'Error']:
-                self.analysis_processes[video_id]['status'] = 'Error' # Ensure status is set even if exception occurs
\ No newline at end of file
+            metrics.registry.remove('analysis_queue_depth', video_id=video_id)
+            try:
+                source.release()
+                frame_writer.close() # Flush buffered rows on completion, cancellation and error
+                if self.vector_index is not None:
+                    self.vector_index.flush(video_id) # Saves the frames added to the video's local indexes once per analysis
+                failed_uploads = self.storage_service.wait_for_uploads(list(upload_futures.values()))
+                checkpoint.save(force=True) # Also on errors and cancellation, so the next run resumes from here
+            finally:
+                # After the last writes and uploads, which are timed as stages of the video too
+                logger.info(f"Stage timings of video {video_id}: {metrics.untrack_video(video_id)}")
+
+        # The checkpoint stops before the first frame that was not stored, keep it so a retry analyzes the frame again
+        if frame_writer.failed:
+            raise IOError(f"{frame_writer.failed} frame rows could not be stored for video {video_id}")
+        if failed_uploads:
+            raise IOError(f"{failed_uploads} of {len(upload_futures)} frame uploads failed for video {video_id}")
+
+        if self.llm_service.result_cache is not None:
+            logger.info(f"LLM result cache stats after video {video_id}: {self.llm_service.result_cache.stats()}")
+        logger.info(f"LLM scheduler stats after video {video_id}: {self.llm_service.scheduler.stats()}")
+
+        if cancel_event.is_set():
+            logger.info(f"Analysis cancelled for video ID: {video_id}, analyzed frames: {processed_frames}")
+            return 'Cancelled'
+        logger.info(f"Video analysis completed for video ID: {video_id}, analyzed frames: {processed_frames}")
+        self.db.delete_analysis_checkpoint(video_id) # The next analysis of this video starts from the beginning
+        return 'Completed'
@@ -0,0 +1,97 @@
+import logging
+import os
+import hashlib
+import shutil
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024 # Bytes read at a time when hashing, keeps memory flat for multi-GB files
+
+
+def sha256_file(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VideoCache:
+    """Local, content-addressed copies of uploaded videos.
+
+    Files are stored as <root>/<sha256>, so the ingest copy of an upload and any later
+    download of the same content share one file, and analysis can start without going
+    back to GCS. The least recently used files are evicted once the cache grows beyond
+    max_bytes. Files are only ever replaced atomically, and a reader that already opened a
+    file keeps reading it even if it is evicted.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, checksum):
+        return os.path.join(self.root, checksum)
+
+    def get(self, checksum):
+        """Returns the cached file for checksum, or None."""
+        if not checksum:
+            return None
+        path = self.path_for(checksum)
+        try:
+            os.utime(path) # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def new_temp_path(self):
+        """A path inside the cache directory to stream new content to, so adding it is a rename."""
+        return os.path.join(self.root, f".incoming-{uuid.uuid4()}")
+
+    def put(self, filepath, checksum=None):
+        """Moves filepath into the cache and returns (cached_path, checksum)."""
+        checksum = checksum or sha256_file(filepath)
+        path = self.path_for(checksum)
+        if os.path.exists(path):
+            os.remove(filepath)
+            os.utime(path)
+        else:
+            try:
+                os.replace(filepath, path)
+            except OSError:
+                # Different filesystem, copy then swap in atomically
+                tmp_path = self.new_temp_path()
+                shutil.copyfile(filepath, tmp_path)
+                os.replace(tmp_path, path)
+                os.remove(filepath)
+        self.evict()
+        return path, checksum
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            entries.sort()
+            # Always keep the most recently used file, even if it alone exceeds the budget
+            while total > self.max_bytes and len(entries) > 1:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                    total -= size
+                    logger.info(f"Evicted {path} from the video cache")
+                except FileNotFoundError:
+                    pass
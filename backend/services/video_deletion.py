@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class VideoDeletionService:
+    """Deletes videos in the background so DELETE requests return right away.
+
+    The video's rows go first, in one transaction that also records the deletion in
+    video_deletions, so the video disappears from the API at once. Its blobs are then
+    deleted by StorageService.delete_video_blobs on a background thread, which writes its
+    progress to the deletion row. Deletions left unfinished by a process that stopped are
+    picked up again by resume_stale(), deleting blobs that are already gone is harmless.
+    """
+
+    def __init__(self, config, db, storage_service):
+        self.db = db
+        self.storage_service = storage_service
+        self.progress_interval = float(config.get('VIDEO_DELETION_PROGRESS_INTERVAL', 2)) # seconds between progress writes
+        self.stale_seconds = float(config.get('VIDEO_DELETION_STALE_SECONDS', 300))
+        # Each deletion fans its batches out on the storage delete executor, a few at a time is enough
+        self.executor = ThreadPoolExecutor(max_workers=int(config.get('VIDEO_DELETION_WORKERS', 2)), thread_name_prefix='video-deletion')
+        self._active = set() # video_ids being deleted by this process
+        self._lock = threading.Lock()
+
+    def delete_video(self, video_id):
+        """Deletes the video's rows and queues the deletion of its blobs.
+
+        Returns the deletion state, or None when there is no such video. Deleting again a
+        video being deleted returns the current state, and one whose blob deletion failed
+        retries it.
+        """
+        deletion = self.storage_service.delete_video(video_id)
+        if deletion is None:
+            deletion = self.db.get_video_deletion(video_id)
+            if deletion is None or deletion['status'] == 'Completed':
+                return None
+            if deletion['status'] != 'Error':
+                return self._state(deletion)
+            logger.info(f"Retrying the failed blob deletion of video {video_id}")
+            deletion = dict(deletion, status='Pending', error=None)
+        self._submit(deletion)
+        return self._state(deletion)
+
+    def get_progress(self, video_id):
+        deletion = self.db.get_video_deletion(video_id)
+        return self._state(deletion) if deletion else None
+
+    def resume_stale(self):
+        """Restarts the deletions another process left unfinished, returns how many."""
+        deletions = self.db.claim_stale_video_deletions(self.stale_seconds)
+        for deletion in deletions:
+            logger.info(f"Resuming the blob deletion of video {deletion['video_id']}")
+            self._submit(deletion)
+        return len(deletions)
+
+    def start(self):
+        """Resumes stale deletions on a daemon thread, so startup does not wait on the database."""
+        def resume():
+            try:
+                self.resume_stale()
+            except Exception as e:
+                logger.error(f"Error resuming video deletions: {e}", exc_info=True)
+        threading.Thread(target=resume, name="video-deletion-resume", daemon=True).start()
+        return self
+
+    def _state(self, deletion):
+        total = deletion['frames_total'] + 1 # and the video blob
+        progress = 100 if deletion['status'] == 'Completed' else min(99, deletion['blobs_deleted'] * 100 // total)
+        return {'video_id': deletion['video_id'], 'status': deletion['status'], 'progress': progress,
+                'blobs_deleted': deletion['blobs_deleted'], 'error': deletion['error']}
+
+    def _submit(self, deletion):
+        with self._lock:
+            if deletion['video_id'] in self._active:
+                return
+            self._active.add(deletion['video_id'])
+        self.executor.submit(self._run, deletion)
+
+    def _run(self, deletion):
+        video_id = deletion['video_id']
+        last_write = 0.0
+        blobs_deleted_so_far = 0
+        write_lock = threading.Lock()
+
+        def on_progress(blobs_deleted):
+            nonlocal last_write, blobs_deleted_so_far
+            with write_lock:
+                blobs_deleted_so_far = max(blobs_deleted_so_far, blobs_deleted)
+                now = time.monotonic()
+                if now - last_write < self.progress_interval:
+                    return
+                last_write = now
+                self.db.update_video_deletion(video_id, 'Running', blobs_deleted)
+
+        started = time.monotonic()
+        try:
+            self.db.update_video_deletion(video_id, 'Running', 0)
+            deleted = self.storage_service.delete_video_blobs(deletion, on_progress)
+            self.db.update_video_deletion(video_id, 'Completed', deleted)
+            logger.info(f"Deleted {deleted} blobs of video {video_id} in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Error deleting the blobs of video {video_id}: {e}", exc_info=True)
+            try:
+                self.db.update_video_deletion(video_id, 'Error', blobs_deleted_so_far, str(e))
+            except Exception:
+                logger.error(f"Error recording the failed deletion of video {video_id}", exc_info=True)
+        finally:
+            with self._lock:
+                self._active.discard(video_id)
@@ -0,0 +1,97 @@
+from concurrent.futures import Future
+from services.analysis_checkpoint import AnalysisCheckpoint, frame_id_for
+from services.frame_source import SampledFrame
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.saved = []
+
+    def save_analysis_checkpoint(self, video_id, frame_index, timestamp_ms, config_key):
+        self.saved.append((video_id, frame_index, timestamp_ms, config_key))
+
+
+def _frame(index):
+    return SampledFrame(index, index * 100, None)
+
+
+def _upload(done=True, error=None):
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    elif done:
+        future.set_result(None)
+    return future
+
+
+def _checkpoint():
+    db = FakeDatabase()
+    return AnalysisCheckpoint(db, 'video', 'config', save_interval=0), db
+
+
+def test_advances_only_past_frames_written_and_uploaded():
+    checkpoint, db = _checkpoint()
+    uploads = [_upload(done=False) for _ in range(3)]
+    for index, upload in enumerate(uploads):
+        checkpoint.consumed(_frame(index), f'frame-{index}', upload)
+    assert checkpoint.frame_index is None
+
+    checkpoint.written([{'frame_id': 'frame-0'}, {'frame_id': 'frame-1'}])
+    checkpoint.save()
+    assert checkpoint.frame_index is None # written, not uploaded
+
+    uploads[1].set_result(None)
+    checkpoint.save()
+    assert checkpoint.frame_index is None # frame 1 is durable, frame 0 before it is not
+
+    uploads[0].set_result(None)
+    uploads[2].set_result(None)
+    checkpoint.save()
+    assert (checkpoint.frame_index, checkpoint.timestamp_ms) == (1, 100) # frame 2 is uploaded, not written
+
+    checkpoint.written([{'frame_id': 'frame-2'}])
+    checkpoint.save()
+    assert checkpoint.frame_index == 2
+    assert [saved[1] for saved in db.saved] == [1, 2]
+
+
+def test_frames_without_result_only_need_to_be_consumed():
+    checkpoint, db = _checkpoint()
+    checkpoint.consumed(_frame(0))
+    checkpoint.consumed(_frame(1), 'frame-1', _upload())
+    checkpoint.consumed(_frame(2))
+    assert checkpoint.frame_index == 0
+
+    checkpoint.written([{'frame_id': 'frame-1'}])
+    checkpoint.save()
+    assert checkpoint.frame_index == 2
+    assert db.saved[-1] == ('video', 2, 200, 'config')
+
+
+def test_failed_upload_pins_the_checkpoint():
+    checkpoint, db = _checkpoint()
+    checkpoint.consumed(_frame(0), 'frame-0', _upload())
+    checkpoint.consumed(_frame(1), 'frame-1', _upload(error=IOError('upload failed')))
+    checkpoint.consumed(_frame(2), 'frame-2', _upload())
+    checkpoint.written([{'frame_id': 'frame-0'}, {'frame_id': 'frame-1'}, {'frame_id': 'frame-2'}])
+    checkpoint.save(force=True)
+    assert checkpoint.frame_index == 0
+    assert [saved[1] for saved in db.saved] == [0]
+
+
+def test_saves_are_throttled_unless_forced():
+    db = FakeDatabase()
+    checkpoint = AnalysisCheckpoint(db, 'video', 'config', save_interval=3600)
+    checkpoint.consumed(_frame(0))
+    checkpoint.consumed(_frame(1))
+    assert db.saved == []
+    checkpoint.save(force=True)
+    assert [saved[1] for saved in db.saved] == [1]
+    checkpoint.save(force=True)
+    assert len(db.saved) == 1 # unchanged checkpoint is not written again
+
+
+def test_frame_ids_are_stable_per_video_and_timestamp():
+    assert frame_id_for('video', 1500) == frame_id_for('video', 1500.0)
+    assert frame_id_for('video', 1500) != frame_id_for('video', 1501)
+    assert frame_id_for('video', 1500) != frame_id_for('other', 1500)
@@ -0,0 +1,95 @@
+"""Lease expiry and reclaim of analysis jobs, against a real database.
+
+Runs only when TEST_ALLOYDB_HOST is set, on an empty scratch database created from
+db/schema_initialization.sql (AlloyDB or AlloyDB Omni), since claims take the oldest
+pending job of the whole table. TEST_ALLOYDB_PORT, TEST_ALLOYDB_USER,
+TEST_ALLOYDB_PASSWORD and TEST_ALLOYDB_DATABASE_NAME complete the connection.
+"""
+import os
+import time
+import uuid
+from datetime import datetime
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.environ.get('TEST_ALLOYDB_HOST'), reason='TEST_ALLOYDB_HOST is not set')
+
+
+@pytest.fixture(scope='module')
+def db():
+    from db.database import Database
+    database = Database({
+        'ALLOYDB_HOST': os.environ.get('TEST_ALLOYDB_HOST'),
+        'ALLOYDB_PORT': os.environ.get('TEST_ALLOYDB_PORT', '5432'),
+        'ALLOYDB_USER': os.environ.get('TEST_ALLOYDB_USER', 'postgres'),
+        'ALLOYDB_PASSWORD': os.environ.get('TEST_ALLOYDB_PASSWORD', ''),
+        'ALLOYDB_DATABASE_NAME': os.environ.get('TEST_ALLOYDB_DATABASE_NAME', 'postgres'),
+        'DB_POOL_MAX_SIZE': 2,
+    })
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def video_id(db):
+    video_id = f"test-{uuid.uuid4()}"
+    db.store_video_metadata({'video_id': video_id, 'video_gcs_uri': f"gs://videos/{video_id}", 'filename': 'test.mp4', 'upload_date': datetime.now()})
+    yield video_id
+    with db._connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM videos WHERE video_id = %s", (video_id,)) # Cascades to its jobs
+
+
+def _expire(seconds=0.05):
+    time.sleep(seconds) # Leases of 0 seconds expire once the clock moves past the claiming transaction
+
+
+def test_live_lease_is_not_reclaimed(db, video_id):
+    job_id = db.create_analysis_job(video_id)
+    assert db.claim_analysis_job('worker-1', lease_seconds=60)['job_id'] == job_id
+    assert db.claim_analysis_job('worker-2', lease_seconds=60) is None
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(db, video_id):
+    job_id = db.create_analysis_job(video_id)
+    assert db.claim_analysis_job('worker-1', lease_seconds=0)['attempts'] == 1
+    _expire()
+
+    job = db.claim_analysis_job('worker-2', lease_seconds=60)
+    assert (job['job_id'], job['attempts']) == (job_id, 2)
+    # The first worker lost the job: its heartbeats and its result are ignored
+    assert db.heartbeat_analysis_job(job_id, 'worker-1', 60, progress=50) is None
+    db.finish_analysis_job(job_id, 'worker-1', 'Error', 'stale worker')
+    assert db.get_latest_analysis_job(video_id)['status'] == 'Running'
+
+    assert db.heartbeat_analysis_job(job_id, 'worker-2', 60, progress=50) is False
+    db.finish_analysis_job(job_id, 'worker-2', 'Completed')
+    assert db.get_latest_analysis_job(video_id)['status'] == 'Completed'
+
+
+def test_expired_job_out_of_attempts_is_closed(db, video_id):
+    db.create_analysis_job(video_id)
+    db.claim_analysis_job('worker-1', lease_seconds=0, max_attempts=1)
+    _expire()
+
+    assert db.claim_analysis_job('worker-2', lease_seconds=60, max_attempts=1) is None
+    job = db.get_latest_analysis_job(video_id)
+    assert (job['status'], job['error'], job['worker_id']) == ('Error', 'Lease expired after 1 attempts', None)
+
+
+def test_expired_cancelling_job_is_cancelled(db, video_id):
+    db.create_analysis_job(video_id)
+    db.claim_analysis_job('worker-1', lease_seconds=0)
+    assert db.request_analysis_job_cancel(video_id)
+    _expire()
+
+    assert db.claim_analysis_job('worker-2', lease_seconds=60) is None
+    assert db.get_latest_analysis_job(video_id)['status'] == 'Cancelled'
+
+
+def test_released_job_is_claimed_again_without_using_an_attempt(db, video_id):
+    job_id = db.create_analysis_job(video_id)
+    db.claim_analysis_job('worker-1', lease_seconds=60)
+    db.release_analysis_job(job_id, 'worker-1')
+    assert db.get_latest_analysis_job(video_id)['status'] == 'Pending'
+
+    job = db.claim_analysis_job('worker-2', lease_seconds=60)
+    assert (job['job_id'], job['attempts']) == (job_id, 1)
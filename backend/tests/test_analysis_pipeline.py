@@ -0,0 +1,117 @@
+import itertools
+import random
+import threading
+import time
+import pytest
+from services.analysis_pipeline import AnalysisPipeline
+
+
+def _run(produce, process, workers=4, queue_size=4, batch_size=1, cancel_event=None, on_consume=None):
+    consumed = []
+
+    def consume(item, result):
+        consumed.append((item, result))
+        if on_consume is not None:
+            on_consume(item)
+
+    pipeline = AnalysisPipeline(produce, process, consume, workers=workers, queue_size=queue_size,
+                                cancel_event=cancel_event, name='test', batch_size=batch_size)
+    return pipeline, consumed
+
+
+def _slow_squares(batch):
+    time.sleep(random.Random(batch[0]).uniform(0, 0.01)) # Batches finish out of order
+    return [item * item for item in batch]
+
+
+def test_results_are_consumed_in_production_order():
+    pipeline, consumed = _run(range(50), _slow_squares, workers=8)
+    assert pipeline.run() == 50
+    assert consumed == [(item, item * item) for item in range(50)]
+
+
+def test_items_are_processed_in_batches():
+    batches = []
+    lock = threading.Lock()
+
+    def process(batch):
+        with lock:
+            batches.append(list(batch))
+        return _slow_squares(batch)
+
+    pipeline, consumed = _run(range(10), process, batch_size=3)
+    assert pipeline.run() == 10
+    assert sorted(batches) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    assert consumed == [(item, item * item) for item in range(10)]
+
+
+def test_in_flight_items_are_bounded():
+    backlog = [] # Items produced and not consumed yet, seen by every consume
+    pipeline, consumed = _run(range(200), _slow_squares, workers=2, queue_size=3, batch_size=2,
+                              on_consume=lambda item: backlog.append(pipeline.produced - pipeline.consumed))
+    pipeline.run()
+    assert max(backlog) <= (3 + 2) * 2
+
+
+def test_cancellation_stops_the_producer_and_keeps_the_order():
+    cancel_event = threading.Event()
+    produced = []
+
+    def produce():
+        for item in itertools.count():
+            produced.append(item)
+            yield item
+
+    def on_consume(item):
+        if item == 5:
+            cancel_event.set()
+
+    pipeline, consumed = _run(produce(), _slow_squares, cancel_event=cancel_event, on_consume=on_consume)
+    count = pipeline.run()
+    assert count == len(consumed) >= 6
+    assert [item for item, _ in consumed] == list(range(count))
+    assert len(produced) < 100
+
+
+def test_producer_errors_are_raised():
+    def produce():
+        yield from range(3)
+        raise IOError('decode failed')
+
+    pipeline, consumed = _run(produce(), _slow_squares)
+    with pytest.raises(IOError, match='decode failed'):
+        pipeline.run()
+    assert [item for item, _ in consumed] == list(range(len(consumed)))
+    assert len(consumed) <= 3
+
+
+def test_worker_errors_are_raised_and_stop_consumption():
+    def process(batch):
+        if batch[0] == 5:
+            raise ValueError('model failed')
+        return _slow_squares(batch)
+
+    pipeline, consumed = _run(range(50), process)
+    with pytest.raises(ValueError, match='model failed'):
+        pipeline.run()
+    assert [item for item, _ in consumed] == list(range(len(consumed)))
+    assert len(consumed) <= 5
+
+
+def test_missing_results_are_a_worker_error():
+    pipeline, consumed = _run(range(4), lambda batch: [], batch_size=2)
+    with pytest.raises(ValueError, match='Expected 2 results'):
+        pipeline.run()
+    assert consumed == []
+
+
+def test_consumer_errors_are_raised_and_stop_consumption():
+    def on_consume(item):
+        if item == 3:
+            raise RuntimeError('write failed')
+
+    pipeline, consumed = _run(range(50), _slow_squares, on_consume=on_consume)
+    with pytest.raises(RuntimeError, match='write failed'):
+        pipeline.run()
+    assert [item for item, _ in consumed] == [0, 1, 2, 3]
+    assert pipeline.consumed == 3
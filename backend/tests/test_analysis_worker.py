@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import deque
+from services.analysis_worker import AnalysisWorker
+
+CONFIG = {'ANALYSIS_JOB_LEASE_SECONDS': 1, 'ANALYSIS_JOB_HEARTBEAT_INTERVAL': 0.01, 'ANALYSIS_WORKER_POLL_INTERVAL': 0.01}
+
+
+class FakeJobDatabase:
+    """The analysis_jobs methods of Database, heartbeats answer heartbeat_result."""
+
+    def __init__(self, jobs, heartbeat_result=False):
+        self.jobs = deque(jobs)
+        self.heartbeat_result = heartbeat_result
+        self.heartbeats = 0
+        self.finished = []
+        self.released = []
+
+    def claim_analysis_job(self, worker_id, lease_seconds, max_attempts=3):
+        return self.jobs.popleft() if self.jobs else None
+
+    def heartbeat_analysis_job(self, job_id, worker_id, lease_seconds, progress, frames_analyzed=0, frames_per_second=None, eta_seconds=None):
+        self.heartbeats += 1
+        return self.heartbeat_result
+
+    def finish_analysis_job(self, job_id, worker_id, status, error=None):
+        self.finished.append((job_id, status))
+
+    def release_analysis_job(self, job_id, worker_id):
+        self.released.append(job_id)
+
+
+class FakeAnalysisService:
+    """Runs until cancelled, or returns right away when complete_immediately."""
+
+    def __init__(self, complete_immediately=False):
+        self.complete_immediately = complete_immediately
+        self.started = threading.Event()
+
+    def run_analysis(self, video_id, cancel_event, on_progress=None, resume=True):
+        self.started.set()
+        if self.complete_immediately:
+            return 'Completed'
+        return 'Cancelled' if cancel_event.wait(5) else 'Completed'
+
+
+def _job(job_id='job-1'):
+    return {'job_id': job_id, 'video_id': 'video', 'attempts': 1, 'resume': True}
+
+
+def _run_until(worker, condition, timeout=5):
+    worker.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while not condition():
+            assert time.monotonic() < deadline, 'timed out'
+            time.sleep(0.005)
+    finally:
+        worker.stop(timeout)
+
+
+def test_completed_job_is_finished():
+    db = FakeJobDatabase([_job()])
+    worker = AnalysisWorker(CONFIG, db, FakeAnalysisService(complete_immediately=True))
+    _run_until(worker, lambda: db.finished)
+    assert db.finished == [('job-1', 'Completed')]
+
+
+def test_lost_lease_stops_the_analysis_without_recording_a_result():
+    db = FakeJobDatabase([_job()], heartbeat_result=None) # Another worker re-claimed the job
+    service = FakeAnalysisService()
+    worker = AnalysisWorker(CONFIG, db, service)
+    _run_until(worker, lambda: db.heartbeats and not worker._running)
+    assert service.started.is_set()
+    assert db.finished == [] and db.released == []
+
+
+def test_cancel_request_reaches_the_analysis_through_the_heartbeat():
+    db = FakeJobDatabase([_job()], heartbeat_result=True)
+    worker = AnalysisWorker(CONFIG, db, FakeAnalysisService())
+    _run_until(worker, lambda: db.finished)
+    assert db.finished == [('job-1', 'Cancelled')]
+
+
+def test_stopping_worker_releases_its_running_job():
+    db = FakeJobDatabase([_job()])
+    service = FakeAnalysisService()
+    worker = AnalysisWorker(CONFIG, db, service)
+    worker.start()
+    assert service.started.wait(5)
+    worker.stop(5)
+    assert db.released == ['job-1']
+    assert db.finished == []
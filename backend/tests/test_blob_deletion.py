@@ -0,0 +1,93 @@
+import threading
+import pytest
+from google.api_core.exceptions import NotFound
+from services.local_bucket import LocalStorageClient
+from services.storage_service import StorageService
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def delete(self):
+        self.bucket.client.deferred.append(self.name)
+
+
+class FakeBucket:
+    """GCS bucket whose deletes fail with the errors in errors (blob name -> exception)."""
+
+    def __init__(self, client, errors):
+        self.client = client
+        self.errors = errors
+        self.deleted = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def delete_blobs(self, blobs, on_error=None):
+        for name in blobs:
+            error = self.errors.get(name)
+            if isinstance(error, NotFound) and on_error is not None:
+                on_error(name)
+            elif error is not None:
+                raise error
+            else:
+                self.deleted.append(name)
+
+
+class FakeBatch:
+    """Sends the deferred deletes when it exits, raising the error of the first failed one like a GCS batch."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        deferred, self.client.deferred = self.client.deferred, []
+        errors = [self.client.bucket_.errors[name] for name in deferred if name in self.client.bucket_.errors]
+        self.client.bucket_.deleted.extend(name for name in deferred if name not in self.client.bucket_.errors)
+        if exc_type is None and errors:
+            raise errors[0]
+
+
+class FakeClient:
+    def __init__(self, errors):
+        self.bucket_ = FakeBucket(self, errors)
+        self.deferred = []
+
+    def bucket(self, name):
+        return self.bucket_
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def _service(client):
+    service = object.__new__(StorageService)
+    service._deletion_clients = threading.local()
+    service._deletion_clients.client = client
+    return service
+
+
+def test_missing_blobs_are_skipped():
+    client = FakeClient({'b': NotFound('b')})
+    _service(client)._delete_blob_batch('frames', ['a', 'b', 'c'])
+    assert set(client.bucket_.deleted) >= {'a', 'c'}
+
+
+def test_errors_after_a_missing_blob_are_raised():
+    client = FakeClient({'a': NotFound('a'), 'c': PermissionError('403 Forbidden')})
+    with pytest.raises(PermissionError):
+        _service(client)._delete_blob_batch('frames', ['a', 'b', 'c'])
+
+
+def test_local_backend_skips_missing_blobs(tmp_path):
+    client = LocalStorageClient(str(tmp_path))
+    bucket = client.bucket('frames')
+    for name in ('a', 'c'):
+        bucket.blob(name).upload_from_string(b'frame')
+    _service(client)._delete_blob_batch('frames', ['a', 'b', 'c'])
+    assert list(bucket.list_blobs()) == []
@@ -0,0 +1,45 @@
+import pytest
+from benchmarks.synthetic_video import write_video
+from services.frame_source import FrameSource, SEEK_MODES
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    # 30 fps sampled at 2 per second: one sample every 15 frames, 500 ms apart
+    return write_video(str(tmp_path_factory.mktemp('video') / 'clip.mp4'), duration=4.0, fps=30.0, width=160, height=120)
+
+
+def _samples(video, mode, **start):
+    with FrameSource(video, 2, mode) as source:
+        return [(frame.index, frame.timestamp_ms) for frame in source.frames(**start)]
+
+
+def test_seek_modes_select_the_same_samples(video):
+    expected = [(index, index * 1000 // 30) for index in range(0, 120, 15)]
+    for mode in SEEK_MODES:
+        assert _samples(video, mode) == expected, mode
+
+
+def test_resume_starts_at_the_next_sample(video):
+    # What a checkpoint after frame 30 (1000 ms) resumes with, see VideoAnalysisService.run_analysis
+    for mode in SEEK_MODES:
+        assert _samples(video, mode, start_index=31, start_ms=1001)[0] == (45, 1500), mode
+
+
+def test_end_bounds_stop_before_the_position(video):
+    assert _samples(video, 'grab', end_index=45) == [(0, 0), (15, 500), (30, 1000)]
+    assert _samples(video, 'timestamp', end_ms=1500) == [(0, 0), (15, 500), (30, 1000)]
+
+
+def test_decoded_images_match_across_modes(video):
+    images = {}
+    for mode in SEEK_MODES:
+        with FrameSource(video, 2, mode) as source:
+            images[mode] = [frame.image for frame in source.frames()]
+    for mode in SEEK_MODES:
+        assert all((image == reference).all() for image, reference in zip(images[mode], images['grab'])), mode
+
+
+def test_unknown_mode_is_rejected(video):
+    with pytest.raises(ValueError):
+        FrameSource(video, 2, 'fastest')
@@ -0,0 +1,66 @@
+from db.frame_writer import FrameWriter
+
+
+class FakeDatabase:
+    """Stores frame rows, rejecting every batch that holds a row of bad_frames like a failing INSERT."""
+
+    def __init__(self, bad_frames=()):
+        self.bad_frames = set(bad_frames)
+        self.calls = [] # Size of every store_frame_metadata_batch call
+        self.rows = []
+
+    def store_frame_metadata_batch(self, frames_metadata):
+        self.calls.append(len(frames_metadata))
+        if any(row['frame_id'] in self.bad_frames for row in frames_metadata):
+            raise ValueError('invalid row')
+        self.rows.extend(row['frame_id'] for row in frames_metadata)
+
+
+def _rows(count):
+    return [{'frame_id': f'frame-{i}', 'video_id': 'video'} for i in range(count)]
+
+
+def _writer(db, batch_size):
+    flushed = []
+    writer = FrameWriter(db, batch_size=batch_size, flush_interval=3600, on_flush=lambda rows: flushed.append([row['frame_id'] for row in rows]))
+    return writer, flushed
+
+
+def test_full_batches_are_written_in_order_and_the_rest_on_close():
+    db = FakeDatabase()
+    writer, flushed = _writer(db, batch_size=4)
+    for row in _rows(10):
+        writer.add(row)
+    assert db.calls == [4, 4]
+    assert writer.pending() == 2
+    writer.close()
+    assert db.calls == [4, 4, 2]
+    assert db.rows == [f'frame-{i}' for i in range(10)]
+    assert flushed == [db.rows[:4], db.rows[4:8], db.rows[8:]]
+    assert (writer.written, writer.failed) == (10, 0)
+
+
+def test_bad_row_is_isolated_by_splitting_the_batch_in_halves():
+    db = FakeDatabase(bad_frames={'frame-5'})
+    writer, flushed = _writer(db, batch_size=8)
+    for row in _rows(8):
+        writer.add(row)
+    writer.close()
+    # Depth first: 0-7 fails, 0-3 is stored, 4-7 fails, 4-5 fails, 4 is stored, 5 is dropped, 6-7 is stored
+    assert db.calls == [8, 4, 4, 2, 1, 1, 2]
+    assert flushed == [['frame-0', 'frame-1', 'frame-2', 'frame-3'], ['frame-4'], ['frame-6', 'frame-7']]
+    assert sorted(db.rows) == sorted(f'frame-{i}' for i in range(8) if i != 5)
+    assert (writer.written, writer.failed) == (7, 1)
+
+
+def test_flush_callback_errors_do_not_fail_the_write():
+    db = FakeDatabase()
+
+    def on_flush(rows):
+        raise RuntimeError('callback failed')
+
+    writer = FrameWriter(db, batch_size=2, flush_interval=3600, on_flush=on_flush)
+    for row in _rows(3):
+        writer.add(row)
+    writer.close()
+    assert (writer.written, writer.failed) == (3, 0)
@@ -0,0 +1,98 @@
+import threading
+import time
+from google.api_core import exceptions as google_exceptions
+from services import llm_scheduler
+from services.llm_scheduler import LLMScheduler
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def test_throttled_waiters_make_progress():
+    # 10 requests/s with an empty bucket: every release happens before the next token is there
+    scheduler = LLMScheduler(max_concurrency=1, requests_per_minute=600)
+    scheduler._requests.tokens = 0
+    done = []
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=scheduler.call, args=('video', lambda i=i: done.append(i)), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(5)
+    assert sorted(done) == list(range(5))
+    assert scheduler.stats()['calls'] == 5
+
+
+def test_keys_are_served_round_robin():
+    scheduler = LLMScheduler(max_concurrency=1)
+    holding = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def hold():
+        holding.set()
+        release.wait(5)
+
+    holder = threading.Thread(target=scheduler.call, args=('holder', hold), daemon=True)
+    holder.start()
+    holding.wait(5)
+    waiters = []
+    for key, name in [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1')]:
+        waiting = scheduler.stats()['waiting']
+        thread = threading.Thread(target=scheduler.call, args=(key, lambda name=name: order.append(name)), daemon=True)
+        thread.start()
+        waiters.append(thread)
+        _wait_for(lambda: scheduler.stats()['waiting'] > waiting)
+    release.set()
+    for thread in [holder] + waiters:
+        thread.join(5)
+    assert order == ['a1', 'b1', 'a2', 'a3']
+
+
+def test_quota_error_pauses_waiting_calls(monkeypatch):
+    monkeypatch.setattr(llm_scheduler.random, 'uniform', lambda low, high: 0.2)
+    scheduler = LLMScheduler(max_concurrency=1, max_retries=1)
+    failing = threading.Event()
+    failed_at = []
+    started_at = []
+
+    def quota_error_once():
+        if not failed_at:
+            failing.set()
+            time.sleep(0.05) # Lets the other call queue behind this one
+            failed_at.append(time.monotonic())
+            raise google_exceptions.TooManyRequests('quota')
+        return 'ok'
+
+    first = threading.Thread(target=scheduler.call, args=('a', quota_error_once), daemon=True)
+    first.start()
+    failing.wait(5)
+    second = threading.Thread(target=scheduler.call, args=('b', lambda: started_at.append(time.monotonic())), daemon=True)
+    second.start()
+    first.join(5)
+    second.join(5)
+    assert started_at and started_at[0] >= failed_at[0] + 0.2
+    assert scheduler.stats()['quota_errors'] == 1
+    assert scheduler.stats()['retries'] == 1
+
+
+def test_non_retryable_errors_are_raised_and_free_the_slot():
+    scheduler = LLMScheduler(max_concurrency=1)
+
+    def fail():
+        raise ValueError('bad request')
+
+    try:
+        scheduler.call('a', fail)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+    assert scheduler.call('a', lambda: 'ok') == 'ok'
+    assert scheduler.stats()['failures'] == 1
+    assert scheduler.stats()['in_flight'] == 0
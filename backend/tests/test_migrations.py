@@ -0,0 +1,66 @@
+"""Schema migrations and their concurrent index builds, against a real database.
+
+Runs only when TEST_ALLOYDB_HOST is set, like test_analysis_jobs.py, on a scratch database.
+"""
+import os
+import uuid
+import psycopg2
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.environ.get('TEST_ALLOYDB_HOST'), reason='TEST_ALLOYDB_HOST is not set')
+
+
+@pytest.fixture(scope='module')
+def db():
+    from db.database import Database
+    database = Database({
+        'ALLOYDB_HOST': os.environ.get('TEST_ALLOYDB_HOST'),
+        'ALLOYDB_PORT': os.environ.get('TEST_ALLOYDB_PORT', '5432'),
+        'ALLOYDB_USER': os.environ.get('TEST_ALLOYDB_USER', 'postgres'),
+        'ALLOYDB_PASSWORD': os.environ.get('TEST_ALLOYDB_PASSWORD', ''),
+        'ALLOYDB_DATABASE_NAME': os.environ.get('TEST_ALLOYDB_DATABASE_NAME', 'postgres'),
+        'DB_POOL_MAX_SIZE': 2,
+    })
+    yield database
+    database.close()
+
+
+def _index_valid(cur, name):
+    cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def test_migrations_are_recorded_and_build_valid_indexes(db):
+    from db.migrations import MIGRATIONS
+    db.apply_migrations() # Nothing left to apply, and the lock is released for the next run
+    db.apply_migrations()
+    with db._connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        assert {row[0] for row in cur.fetchall()} >= {version for version, _, _ in MIGRATIONS}
+        for name in ('frames_frame_embedding_hnsw_idx', 'frames_objects_embedding_hnsw_idx', 'frames_video_timestamp_idx'):
+            assert _index_valid(cur, name) is True
+        assert _index_valid(cur, 'frames_video_id_idx') is None
+        assert not conn.autocommit
+
+
+def test_index_left_invalid_by_a_failed_build_is_rebuilt(db):
+    table, index = f"test_migration_{uuid.uuid4().hex[:12]}", f"test_migration_{uuid.uuid4().hex[:12]}_idx"
+    statement = f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} (value)"
+    with db._connection() as conn, conn.cursor() as cur:
+        cur.execute(f"CREATE TABLE {table} (value INTEGER)")
+        cur.execute(f"INSERT INTO {table} VALUES (1), (1)")
+    with db._connection() as conn, conn.cursor() as cur:
+        conn.autocommit = True
+        try:
+            with pytest.raises(psycopg2.errors.UniqueViolation):
+                cur.execute(statement)
+            assert _index_valid(cur, index) is False
+            cur.execute(f"DELETE FROM {table} WHERE ctid = (SELECT min(ctid) FROM {table})")
+
+            db._drop_invalid_index(cur, statement)
+            cur.execute(statement)
+            assert _index_valid(cur, index) is True
+        finally:
+            cur.execute(f"DROP TABLE {table}")
+            conn.autocommit = False
@@ -0,0 +1,81 @@
+import pytest
+from services.progress_stream import ProgressBroadcaster
+
+
+class FakeDatabase:
+    def __init__(self, progress):
+        self.progress = dict(progress) # video_id -> progress of its job
+        self.on_fetch = None
+
+    def get_analysis_job_states(self, video_ids):
+        states = [self._state(video_id) for video_id in video_ids if video_id in self.progress]
+        if self.on_fetch is not None:
+            on_fetch, self.on_fetch = self.on_fetch, None
+            on_fetch()
+        return states
+
+    def _state(self, video_id):
+        return {'video_id': video_id, 'status': 'Running', 'progress': self.progress[video_id],
+                'frames_analyzed': 0, 'frames_per_second': None, 'eta_seconds': None}
+
+
+def _broadcaster(db):
+    return ProgressBroadcaster(db, interval=3600) # The test polls by hand
+
+
+def _progress(subscription):
+    return {state['video_id']: state['progress'] for state in subscription.get(timeout=0)}
+
+
+def test_subscription_starts_with_the_current_states():
+    broadcaster = _broadcaster(FakeDatabase({'a': 10}))
+    subscription = broadcaster.subscribe(['a', 'b'])
+    states = {state['video_id']: state for state in subscription.get(timeout=0)}
+    assert states['a']['progress'] == 10
+    assert states['b']['status'] == 'NotFound'
+    assert broadcaster.subscriber_count() == 1
+
+
+def test_change_polled_while_subscribing_is_not_lost():
+    db = FakeDatabase({'a': 10})
+    broadcaster = _broadcaster(db)
+    watcher = broadcaster.subscribe(['a'])
+    broadcaster._poll()
+
+    def progress_and_poll():
+        # The job moves on after the subscription read its state, and a poll runs before the state is pushed
+        db.progress['a'] = 20
+        broadcaster._poll()
+
+    db.on_fetch = progress_and_poll
+    subscription = broadcaster.subscribe(['a'])
+    assert _progress(subscription) == {'a': 20}
+    assert _progress(watcher) == {'a': 20}
+
+    broadcaster._poll() # Nothing changed since
+    assert _progress(subscription) == {}
+
+
+def test_unchanged_states_are_not_pushed_again():
+    db = FakeDatabase({'a': 10})
+    broadcaster = _broadcaster(db)
+    subscription = broadcaster.subscribe(['a'])
+    assert _progress(subscription) == {'a': 10}
+    broadcaster._poll()
+    assert _progress(subscription) == {}
+    db.progress['a'] = 30
+    broadcaster._poll()
+    assert _progress(subscription) == {'a': 30}
+
+
+def test_failed_subscription_is_unregistered():
+    db = FakeDatabase({'a': 10})
+    broadcaster = _broadcaster(db)
+
+    def fail():
+        raise RuntimeError('database unavailable')
+
+    db.on_fetch = fail
+    with pytest.raises(RuntimeError):
+        broadcaster.subscribe(['a'])
+    assert broadcaster.subscriber_count() == 0
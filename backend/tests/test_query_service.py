@@ -0,0 +1,79 @@
+import pytest
+from services.query_service import collapse_segments, format_media_time, parse_media_time, parse_time_window
+
+
+def _frame(frame_id, timestamp_ms, video_id='video'):
+    return {'frame_id': frame_id, 'video_id': video_id, 'timestamp_ms': timestamp_ms}
+
+
+def _segments(frames, max_gap_ms):
+    return [(best['frame_id'], [frame['frame_id'] for frame in frames]) for best, frames in collapse_segments(frames, max_gap_ms)]
+
+
+def test_collapse_segments_merges_frames_up_to_the_gap():
+    frames = [_frame('b', 2000), _frame('a', 1000), _frame('d', 5000), _frame('c', 3000)]
+    # 1000 -> 2000 -> 3000 are exactly max_gap_ms apart, 3000 -> 5000 is further
+    assert _segments(frames, 1000) == [('b', ['a', 'b', 'c']), ('d', ['d'])]
+
+
+def test_collapse_segments_orders_segments_by_their_best_frame():
+    frames = [_frame('late', 60000), _frame('early', 1000), _frame('late2', 61000)]
+    assert _segments(frames, 2000) == [('late', ['late', 'late2']), ('early', ['early'])]
+
+
+def test_collapse_segments_keeps_frames_without_timestamp_alone():
+    frames = [_frame('untimed', None), _frame('a', 1000), _frame('untimed2', None), _frame('b', 1500)]
+    assert _segments(frames, 2000) == [('untimed', ['untimed']), ('a', ['a', 'b']), ('untimed2', ['untimed2'])]
+
+
+def test_collapse_segments_does_not_merge_across_videos():
+    frames = [_frame('x1', 1000, 'x'), _frame('y1', 1000, 'y'), _frame('x2', 1500, 'x')]
+    assert _segments(frames, 2000) == [('x1', ['x1', 'x2']), ('y1', ['y1'])]
+
+
+def test_collapse_segments_of_no_frames():
+    assert collapse_segments([], 2000) == []
+
+
+@pytest.mark.parametrize('timestamp_ms, expected', [
+    (0, '0:00.00'),
+    (1500, '0:01.50'),
+    (840000, '14:00.00'),
+    (59999, '1:00.00'),
+    (3599990, '59:59.99'),
+    (3599999, '1:00:00.00'),
+    (5025500, '1:23:45.50'),
+])
+def test_format_media_time(timestamp_ms, expected):
+    assert format_media_time(timestamp_ms) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    (0, 0),
+    (12.5, 12500),
+    ('90', 90000),
+    ('14:00', 840000),
+    ('14:30.25', 870250),
+    ('90:00', 5400000),
+    ('1:14:00', 4440000),
+])
+def test_parse_media_time(value, expected):
+    assert parse_media_time(value) == expected
+
+
+@pytest.mark.parametrize('value', ['1:-5', '1:60', '1:60:00', 'nan', 'inf', -1, 'abc', '', ':', '1::2', True, None, [1], 10 ** 400])
+def test_parse_media_time_rejects(value):
+    with pytest.raises(ValueError):
+        parse_media_time(value)
+
+
+def test_parse_time_window():
+    assert parse_time_window('14:00', '14:30') == (840000, 870000)
+    assert parse_time_window(None, 60) == (None, 60000)
+    assert parse_time_window('', None) == (None, None)
+
+
+@pytest.mark.parametrize('start, end', [('14:30', '14:00'), (60, '1:00')])
+def test_parse_time_window_rejects_empty_windows(start, end):
+    with pytest.raises(ValueError, match='end must be after start'):
+        parse_time_window(start, end)
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from benchmarks.synthetic_video import write_video
+from services.frame_source import FrameSource
+from services.segmented_frame_source import DecodePool, SegmentedFrameSource
+
+SHM_DIR = '/dev/shm'
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    return write_video(str(tmp_path_factory.mktemp('video') / 'clip.mp4'), duration=4.0, fps=30.0, width=160, height=120)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = DecodePool(2)
+    yield pool
+    pool.shutdown()
+
+
+def _shared_memory_blocks():
+    return {name for name in os.listdir(SHM_DIR) if name.startswith('psm_')}
+
+
+@pytest.mark.parametrize('mode', ['grab', 'timestamp'])
+@pytest.mark.parametrize('handoff', ['shared_memory', 'bytes'])
+@pytest.mark.parametrize('start_index, start_ms', [(0, 0), (37, 1234)])
+def test_segments_merge_into_the_frames_of_a_single_pass(video, pool, mode, handoff, start_index, start_ms):
+    with FrameSource(video, 5, mode) as source:
+        expected = list(source.frames(start_index=start_index, start_ms=start_ms))
+    with SegmentedFrameSource(video, 5, mode, pool, segment_frames=3, handoff=handoff) as source:
+        frames = list(source.frames(start_index=start_index, start_ms=start_ms))
+        assert source.progress == 100
+
+    assert expected
+    assert [(frame.index, frame.timestamp_ms) for frame in frames] == [(frame.index, frame.timestamp_ms) for frame in expected]
+    assert all(np.array_equal(frame.image, single.image) for frame, single in zip(frames, expected))
+
+
+@pytest.mark.skipif(not os.path.isdir(SHM_DIR), reason='POSIX shared memory is not listed under /dev/shm')
+def test_cancelled_decode_releases_its_shared_memory(video, pool):
+    before = _shared_memory_blocks()
+    cancel_event = threading.Event()
+    with SegmentedFrameSource(video, 5, 'grab', pool, segment_frames=2, lookahead=4) as source:
+        for position, _ in enumerate(source.frames(cancel_event)):
+            if position == 2:
+                cancel_event.set() # Segments decoded ahead are still pending
+    assert position == 2
+    for future in [pool.submit(time.sleep, 0.1) for _ in range(pool.processes * 2)]:
+        future.result() # Segments still running when the decode was cancelled have finished
+    assert _shared_memory_blocks() - before == set()
+
+
+def test_broken_pool_is_replaced_on_the_next_submit(video):
+    pool = DecodePool(2)
+    try:
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result(timeout=30) # A crashed decode process breaks the executor
+        assert pool.submit(os.getpid).result(timeout=30) != os.getpid()
+        with SegmentedFrameSource(video, 5, 'grab', pool, segment_frames=4) as source:
+            assert len(list(source.frames())) == 20
+    finally:
+        pool.shutdown()
+
+
+def test_handed_off_blocks_are_not_reported_as_leaked(video):
+    # The resource tracker prints a KeyError for a block unregistered under the wrong name, and warns at exit about blocks left registered
+    script = (
+        "from services.segmented_frame_source import DecodePool, SegmentedFrameSource\n"
+        "if __name__ == '__main__':\n"
+        "    pool = DecodePool(2)\n"
+        f"    with SegmentedFrameSource({video!r}, 5, 'grab', pool, segment_frames=4) as source:\n"
+        "        assert len(list(source.frames())) == 20\n"
+        "    pool.shutdown()\n"
+    )
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', script], cwd=backend, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'Traceback' not in result.stderr and 'leaked' not in result.stderr, result.stderr
@@ -0,0 +1,133 @@
+import os
+import threading
+from services.embedder import LocalHashEmbedder
+from services.vector_index import VectorIndexManager
+
+WORDS = ['cat', 'dog', 'car', 'tree', 'boat', 'bird']
+
+
+class FakeFrameDatabase:
+    def __init__(self):
+        self.frames = []
+
+    def store(self, *indexes):
+        frames = [{
+            'frame_id': f'frame-{i}', 'video_id': 'video', 'frame_gcs_uri': f'gs://frames/{i}.jpg', 'timeframe': f'Frame {i}.00s',
+            'timestamp_ms': i * 1000, 'detected_objects': [], 'text_description': WORDS[i],
+        } for i in indexes]
+        self.frames.extend(frames)
+        return frames
+
+    def get_frames_by_video_id(self, video_id):
+        return [dict(frame, detected_objects_json='[]') for frame in self.frames if frame['video_id'] == video_id]
+
+
+def _manager(db, root, **kwargs):
+    return VectorIndexManager(db, LocalHashEmbedder(dim=256), str(root), **kwargs)
+
+
+def _best(manager, text, **window):
+    hits = manager.search('video', LocalHashEmbedder(dim=256).embed_query(text), top_k=1, **window)
+    return hits[0]['frame_id'] if hits else None
+
+
+def _saved_count(root):
+    with open(os.path.join(root, 'video', 'description', 'frames.json')) as f:
+        return len(f.read().split('"frame_id"')) - 1
+
+
+def test_added_frames_are_searchable_and_saved_on_flush(tmp_path):
+    db = FakeFrameDatabase()
+    db.store(0, 1)
+    manager = _manager(db, tmp_path)
+    assert _best(manager, 'cat') == 'frame-0' # Builds and saves the index
+
+    manager.add_frames(db.store(2, 3))
+    assert _best(manager, 'tree') == 'frame-3'
+    assert _saved_count(tmp_path) == 2
+    assert os.path.exists(os.path.join(tmp_path, 'video', 'description', 'dirty'))
+
+    manager.flush('video')
+    assert _saved_count(tmp_path) == 4
+    assert not os.path.exists(os.path.join(tmp_path, 'video', 'description', 'dirty'))
+
+
+def test_save_interval_saves_during_the_analysis(tmp_path):
+    db = FakeFrameDatabase()
+    db.store(0)
+    manager = _manager(db, tmp_path, save_interval=0)
+    _best(manager, 'cat')
+    manager.add_frames(db.store(1))
+    assert _saved_count(tmp_path) == 2
+
+
+def test_index_saved_by_another_process_is_reloaded(tmp_path):
+    db = FakeFrameDatabase()
+    db.store(0, 1)
+    api, worker = _manager(db, tmp_path), _manager(db, tmp_path)
+    assert _best(api, 'boat') != 'frame-4'
+    _best(worker, 'cat')
+
+    worker.add_frames(db.store(4))
+    assert _best(api, 'boat') != 'frame-4' # Not saved yet, the API keeps its copy
+    worker.flush('video')
+    assert _best(api, 'boat') == 'frame-4'
+
+
+def test_unsaved_index_is_rebuilt_from_the_database(tmp_path):
+    db = FakeFrameDatabase()
+    db.store(0, 1)
+    worker = _manager(db, tmp_path)
+    _best(worker, 'cat')
+    worker.add_frames(db.store(5)) # The process stops before saving
+
+    restarted = _manager(db, tmp_path)
+    assert _best(restarted, 'bird') == 'frame-5'
+
+
+def test_time_window_search(tmp_path):
+    db = FakeFrameDatabase()
+    db.store(0, 1, 2, 3)
+    manager = _manager(db, tmp_path)
+    assert _best(manager, 'cat') == 'frame-0'
+    assert _best(manager, 'cat', start_ms=1000, end_ms=3000) in ('frame-1', 'frame-2')
+    assert _best(manager, 'cat', start_ms=10000) is None
+
+
+class SlowFrameDatabase(FakeFrameDatabase):
+    """Holds the frame reads of video 'slow' until released, counting them."""
+
+    def __init__(self):
+        super().__init__()
+        self.reading = threading.Event()
+        self.release = threading.Event()
+        self.slow_reads = 0
+
+    def get_frames_by_video_id(self, video_id):
+        if video_id == 'slow':
+            self.slow_reads += 1
+            self.reading.set()
+            self.release.wait(timeout=10)
+        return super().get_frames_by_video_id(video_id)
+
+
+def test_building_one_index_does_not_block_searches_of_others(tmp_path):
+    db = SlowFrameDatabase()
+    db.store(0, 1)
+    manager = _manager(db, tmp_path)
+    query = LocalHashEmbedder(dim=256).embed_query('cat')
+    builders = [threading.Thread(target=manager.search, args=('slow', query)) for _ in range(2)]
+    for builder in builders:
+        builder.start()
+    assert db.reading.wait(timeout=10)
+    try:
+        results = []
+        searcher = threading.Thread(target=lambda: results.append(_best(manager, 'cat')))
+        searcher.start()
+        searcher.join(timeout=5)
+        assert results == ['frame-0'] # Answered while 'slow' is still being built
+    finally:
+        db.release.set()
+        for builder in builders:
+            builder.join(timeout=10)
+    assert db.slow_reads == 1 # The second search waited for the first build
@@ -0,0 +1,62 @@
+"""run_analysis end to end on a synthetic clip, with the benchmark's local stand-ins for Gemini, GCS and AlloyDB."""
+import os
+import threading
+import uuid
+import pytest
+from config import Config
+from benchmarks.fakes import FakeDatabase, FakeGenerativeModel, FakeStorageService
+from benchmarks.synthetic_video import write_video
+from services.video_analysis_service import VideoAnalysisService
+
+
+class FailingDatabase(FakeDatabase):
+    """FakeDatabase that refuses to store the row of the nth distinct frame it is given."""
+
+    def __init__(self, bad_frame):
+        super().__init__()
+        self.bad_frame = bad_frame
+        self.seen = [] # frame ids in the order they were first written
+
+    def store_frame_metadata_batch(self, frames_metadata):
+        for frame_metadata in frames_metadata:
+            if frame_metadata['frame_id'] not in self.seen:
+                self.seen.append(frame_metadata['frame_id'])
+        if self.bad_frame is not None and any(self.seen.index(row['frame_id']) == self.bad_frame for row in frames_metadata):
+            raise ValueError('row rejected')
+        super().store_frame_metadata_batch(frames_metadata)
+
+
+@pytest.fixture
+def analysis(tmp_path):
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    config.update(
+        LLM_CACHE_ENABLED=False, LLM_CACHE_PATH='', VECTOR_SEARCH_BACKEND='alloydb',
+        GCS_BUCKET_NAME_VIDEOS='videos', GCS_BUCKET_NAME_FRAMES='frames',
+        LOCAL_STORAGE_ROOT=str(tmp_path / 'storage'), VIDEO_CACHE_DIR=str(tmp_path / 'video_cache'),
+        UPLOAD_SESSION_DIR=str(tmp_path / 'upload_sessions'),
+        VIDEO_SAMPLING_RATE=5, VIDEO_FRAME_SEEK_MODE='grab', FRAME_SAMPLER='fixed', LLM_BATCH_SIZE=1,
+        VIDEO_DECODE_PROCESSES=0, ANALYSIS_CHECKPOINT_INTERVAL=0,
+    )
+    db = FailingDatabase(bad_frame=3)
+    storage_service = FakeStorageService(config, db)
+    video_id = str(uuid.uuid4())
+    video_path = write_video(str(tmp_path / 'clip.mp4'), duration=2.0, fps=10.0, width=160, height=120)
+    storage_service.ingest_video_file(video_path, os.path.basename(video_path), video_id)
+    service = VideoAnalysisService(config, storage_service, db)
+    service.llm_service.model = FakeGenerativeModel(latency=0, jitter=0)
+    yield service, db, video_id
+    db.close()
+
+
+def test_dropped_frame_row_fails_the_run_and_keeps_it_resumable(analysis):
+    service, db, video_id = analysis
+    with pytest.raises(IOError):
+        service.run_analysis(video_id, threading.Event(), resume=True)
+    assert db.count_frames(video_id) == len(db.seen) - 1
+    checkpoint = db.get_analysis_checkpoint(video_id)
+    assert checkpoint is not None and checkpoint['frame_index'] < 3 * 2 # Before the rejected frame, the fourth sample
+
+    db.bad_frame = None
+    assert service.run_analysis(video_id, threading.Event(), resume=True) == 'Completed'
+    assert db.count_frames(video_id) == len(db.seen) == 10
+    assert db.get_analysis_checkpoint(video_id) is None
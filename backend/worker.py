@@ -0,0 +1,50 @@
+"""Standalone analysis worker: claims jobs queued by the API from the analysis_jobs table and runs them.
+
+Run as many copies as needed, on as many machines as needed, against the same database:
+
+    python worker.py
+
+SIGTERM / SIGINT stop claiming, interrupt the running analyses and hand them back to the
+queue so another worker resumes them.
+"""
+import logging
+import signal
+from config import Config
+from db.database import Database
+from services.storage_service import StorageService
+from services.embedder import create_embedder
+from services.vector_index import create_vector_index
+from services.video_analysis_service import VideoAnalysisService
+from services.segmented_frame_source import create_decode_pool
+from services.analysis_worker import AnalysisWorker
+from services import metrics
+
+logging.basicConfig(level=Config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()} # Same keys as Flask's app.config
+    decode_pool = create_decode_pool(config) # Started before any thread (database pool, uploads, analyses) exists
+    db = Database(config)
+    storage_service = StorageService(config, db)
+    vector_index = create_vector_index(config, db, create_embedder(config, db))
+    video_analysis_service = VideoAnalysisService(config, storage_service, db, vector_index=vector_index, decode_pool=decode_pool)
+    worker = AnalysisWorker(config, db, video_analysis_service)
+    if config.get('WORKER_METRICS_PORT'):
+        metrics.start_metrics_server(int(config['WORKER_METRICS_PORT']))
+
+    def shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, stopping analysis worker {worker.worker_id}")
+        worker.stop(timeout=float(config.get('ANALYSIS_JOB_LEASE_SECONDS', 60)))
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    worker.run()
+    if decode_pool is not None:
+        decode_pool.shutdown()
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,58 +6,68 @@ function AnalysisProgress({ selectedVideoId }) {
     const [isAnalyzing, setIsAnalyzing] = useState(false);
     const [analysisStatus, setAnalysisStatus] = useState(''); // e.g., "Analyzing", "Completed", "Cancelled", "Error"
 
+    const [framesPerSecond, setFramesPerSecond] = useState(null);
+    const [etaSeconds, setEtaSeconds] = useState(null);
+
     useEffect(() => {
         if (selectedVideoId) {
-            startProgressCheck();
+            startProgressStream();
         }
-        return () => stopProgressCheck(); // Cleanup on unmount
+        return () => stopProgressStream(); // Cleanup on unmount
     }, [selectedVideoId]);
-// }, [selectedVideoId, isAnalyzing]);
 
-    const progressCheckInterval = React.useRef(null);
+    const progressStream = React.useRef(null);
 
-    const startProgressCheck = () => {
-        console.log('Start Progress Check !')
-        // if (!isAnalyzing && progress < 100 ) {
-        //     setIsAnalyzing(true)
-        // } else if (progress == 100 ){
-        //     stopProgressCheck();
-        //     setIsAnalyzing(false);
-        //     setAnalysisStatus("Completed");
-        //     return
-        // }
+    const startProgressStream = () => {
+        console.log('Start Progress Stream !')
+        stopProgressStream();
         setIsAnalyzing(true)
         setAnalysisStatus("Analyzing");
-        progressCheckInterval.current = setInterval(async () => {
-            try {
-                const response = await axios.get(`/api/videos/${selectedVideoId}/analysis-progress`);
-                setProgress(response.data.progress || 0);
-                setAnalysisStatus(response.data.status || "Analyzing"); // Update status from backend
+        // The backend pushes a progress event whenever the status, progress or throughput changes
+        const eventSource = new EventSource(`/api/analysis-progress/stream?video_ids=${encodeURIComponent(selectedVideoId)}`);
+        progressStream.current = eventSource;
+        eventSource.addEventListener('progress', (event) => {
+            const data = JSON.parse(event.data);
+            setProgress(data.progress || 0);
+            setAnalysisStatus(data.status || "Analyzing"); // Update status from backend
+            setFramesPerSecond(data.frames_per_second);
+            setEtaSeconds(data.eta_seconds);
 
-                if (response.data.status === 'Completed' || response.data.status === 'Error' || response.data.status === 'Cancelled') {
-                    stopProgressCheck();
-                    setIsAnalyzing(false);
-                    if (response.data.status === 'Completed') {
-                        alert("Video analysis completed successfully!");
-                    } else if (response.data.status === 'Error') {
-                        alert("Video analysis encountered an error.");
-                    } else if (response.data.status === 'Cancelled') {
-                        alert("Video analysis was cancelled.");
-                    }
+            if (data.status === 'Completed' || data.status === 'Error' || data.status === 'Cancelled') {
+                stopProgressStream();
+                setIsAnalyzing(false);
+                if (data.status === 'Completed') {
+                    alert("Video analysis completed successfully!");
+                } else if (data.status === 'Error') {
+                    alert("Video analysis encountered an error.");
+                } else if (data.status === 'Cancelled') {
+                    alert("Video analysis was cancelled.");
                 }
-            } catch (error) {
-                console.error('Error fetching analysis progress:', error);
-                stopProgressCheck();
+            }
+        });
+        eventSource.onerror = (error) => {
+            // EventSource reconnects by itself, only give up once it closed the stream
+            if (eventSource.readyState === EventSource.CLOSED) {
+                console.error('Error streaming analysis progress:', error);
+                stopProgressStream();
                 setIsAnalyzing(false);
                 setAnalysisStatus("Error");
                 alert("Error fetching analysis progress.");
             }
-        }, 2000); // Check progress every 2 seconds
+        };
     };
 
-    const stopProgressCheck = () => {
-        console.log("Stop Progress Check");
-        clearInterval(progressCheckInterval.current);
+    const stopProgressStream = () => {
+        if (progressStream.current) {
+            console.log("Stop Progress Stream");
+            progressStream.current.close();
+            progressStream.current = null;
+        }
+    };
+
+    const formatEta = (seconds) => {
+        const minutes = Math.floor(seconds / 60);
+        return minutes > 0 ? `${minutes}m ${Math.round(seconds % 60)}s` : `${Math.round(seconds)}s`;
     };
 
     const handleCancelAnalysis = async () => {
@@ -65,9 +75,7 @@ function AnalysisProgress({ selectedVideoId }) {
             try {
                 await axios.post(`/api/videos/${selectedVideoId}/cancel-analysis`);
                 console.log('Analysis cancellation requested for video:', selectedVideoId);
-                stopProgressCheck();
-                setIsAnalyzing(false);
-                setAnalysisStatus("Cancelled");
+                setAnalysisStatus("Cancelling"); // The stream reports Cancelled once the worker stopped
                 alert("Analysis cancellation requested.");
             } catch (error) {
                 console.error('Error cancelling analysis:', error);
@@ -83,10 +91,12 @@ function AnalysisProgress({ selectedVideoId }) {
     return (
         <div>
             <h2>Video Analysis Progress</h2>
-            {isAnalyzing && analysisStatus === "Analyzing" ? (
+            {isAnalyzing ? (
                 <div>
                     <p>Analysis Status: {analysisStatus}</p>
                     <progress value={progress} max="100" /> {progress}%
+                    {framesPerSecond != null && <span> | {framesPerSecond.toFixed(1)} frames/s</span>}
+                    {etaSeconds != null && <span> | {formatEta(etaSeconds)} left</span>}
                     <button onClick={handleCancelAnalysis}>Cancel Analysis</button>
                 </div>
             ) : (
@@ -9,17 +9,18 @@ function QueryResults({ results }) {
         return <p>{results.message}</p>; // Display error or "no results" messages
     }
 
-    if (!results.frames || results.frames.length === 0) {
+    const frames = results.segments || results.frames; // Segments are shown by their best frame
+    if (!frames || frames.length === 0) {
         return <p>Sorry, no relevant video frames found for your query.</p>;
     }
 
     return (
         <div>
             <h2>Query Results</h2>
-            {results.frames.map((frame, index) => (
+            {frames.map((frame, index) => (
                 <div key={index} style={{ marginBottom: '20px', border: '1px solid #ccc', padding: '10px' }}>
                     <img src={frame.frame_url} alt={`Frame ${index}`} style={{ maxWidth: '300px' }} />
-                    <p>Timeframe: {frame.timeframe}</p>
+                    <p>Timeframe: {frame.timeframe}{frame.frame_count > 1 && ` (${frame.frame_count} matching frames)`}</p>
                     <p>Image Link:<a href={frame.frame_url} target="_blank" rel="noopener noreferrer">View Frame</a></p>
                     <p>Video Link: <a href={frame.video_link} target="_blank" rel="noopener noreferrer">View Video</a></p>
                     <p>Text Description: {frame.text_description}</p>
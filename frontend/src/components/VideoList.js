@@ -1,17 +1,32 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 
+const PAGE_SIZE = 50;
+const STATUSES = ['NotAnalyzed', 'Pending', 'Running', 'Cancelling', 'Completed', 'Cancelled', 'Error'];
+
 function VideoList({ onVideoSelected, onVideoDeleted, refresh }) {
     const [videos, setVideos] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [sort, setSort] = useState('upload_date');
+    const [status, setStatus] = useState('');
 
     useEffect(() => {
         fetchVideos();
-    }, [refresh]);
+    }, [refresh, sort, status]);
 
-    const fetchVideos = async () => {
+    // Without a cursor the list restarts from the first page, with one the page is appended
+    const fetchVideos = async (cursor = null) => {
         try {
-            const response = await axios.get('/api/videos');
-            setVideos(response.data);
+            const params = { limit: PAGE_SIZE, sort };
+            if (status) {
+                params.status = status;
+            }
+            if (cursor) {
+                params.cursor = cursor;
+            }
+            const response = await axios.get('/api/videos', { params });
+            setVideos((previous) => (cursor ? [...previous, ...response.data.videos] : response.data.videos));
+            setNextCursor(response.data.next_cursor);
         } catch (error) {
             console.error('Error fetching videos:', error);
         }
@@ -48,16 +63,33 @@ function VideoList({ onVideoSelected, onVideoDeleted, refresh }) {
     return (
         <div>
             <h2>Available Videos</h2>
+            <div>
+                <label>Sort by </label>
+                <select value={sort} onChange={(e) => setSort(e.target.value)}>
+                    <option value="upload_date">Newest first</option>
+                    <option value="filename">Filename</option>
+                </select>
+                <label> Status </label>
+                <select value={status} onChange={(e) => setStatus(e.target.value)}>
+                    <option value="">All</option>
+                    {STATUSES.map((value) => (
+                        <option key={value} value={value}>{value}</option>
+                    ))}
+                </select>
+            </div>
             <ul>
                 {videos.map((video) => (
                     <li key={video.video_id}>
                         <td width="150px">{video.filename}</td>
+                        <td width="100px">{video.analysis_status}</td>
+                        <td width="80px">{video.frame_count} frames</td>
                         <td><button onClick={() => onVideoSelected(video.video_id)}>Select</button></td>
                         <td><button onClick={() => handleAnalyzeVideo(video.video_id)}>Analyze</button></td>
                         <td><button onClick={() => handleDeleteVideo(video.video_id)}>Delete</button></td>
                     </li>
                 ))}
             </ul>
+            {nextCursor && <button onClick={() => fetchVideos(nextCursor)}>Load more</button>}
         </div>
     );
 }
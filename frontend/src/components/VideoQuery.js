@@ -3,6 +3,10 @@ import axios from 'axios';
 
 function VideoQuery({ selectedVideoId, onQueryResults }) {
     const [queryText, setQueryText] = useState('');
+    const [searchMode, setSearchMode] = useState('hybrid');
+    const [startTime, setStartTime] = useState(''); // Seconds or 14:00, empty for the start of the video
+    const [endTime, setEndTime] = useState('');
+    const [groupSegments, setGroupSegments] = useState(false);
 
     const handleQuerySubmit = async () => {
         if (!selectedVideoId) {
@@ -17,6 +21,10 @@ function VideoQuery({ selectedVideoId, onQueryResults }) {
         try {
             const response = await axios.post(`/api/videos/${selectedVideoId}/query`, {
                 query: queryText,
+                mode: searchMode,
+                start: startTime || undefined,
+                end: endTime || undefined,
+                group: groupSegments ? 'segments' : 'frames',
             });
             console.log('Query results:', response.data);
             onQueryResults(response.data); // Pass results to parent component
@@ -46,6 +54,31 @@ function VideoQuery({ selectedVideoId, onQueryResults }) {
                         onChange={(e) => setQueryText(e.target.value)}
                         onKeyPress={handleKeyPress}
                     />
+                    <select value={searchMode} onChange={(e) => setSearchMode(e.target.value)}>
+                        <option value="hybrid">Description + objects</option>
+                        <option value="description">Description</option>
+                        <option value="objects">Objects</option>
+                    </select>
+                    <input
+                        type="text"
+                        placeholder="From (e.g. 14:00)"
+                        value={startTime}
+                        onChange={(e) => setStartTime(e.target.value)}
+                        onKeyPress={handleKeyPress}
+                        size={10}
+                    />
+                    <input
+                        type="text"
+                        placeholder="To (e.g. 14:30)"
+                        value={endTime}
+                        onChange={(e) => setEndTime(e.target.value)}
+                        onKeyPress={handleKeyPress}
+                        size={10}
+                    />
+                    <label>
+                        <input type="checkbox" checked={groupSegments} onChange={(e) => setGroupSegments(e.target.checked)} />
+                        Group into segments
+                    </label>
                     <button onClick={handleQuerySubmit}>Search</button>
                 </div>
             ) : (
@@ -1,6 +1,18 @@
 import React, { useState } from 'react';
 import axios from 'axios';
 
+const MAX_CHUNK_RETRIES = 5;
+
+const toHex = (buffer) => Array.from(new Uint8Array(buffer)).map((b) => b.toString(16).padStart(2, '0')).join('');
+
+// SHA-256 of one chunk, lets the backend verify every chunk without hashing the whole file in the browser
+const sha256 = async (blob) => {
+    if (!window.crypto || !window.crypto.subtle) {
+        return null; // Not available on insecure origins, the backend still checksums the full file
+    }
+    return toHex(await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer()));
+};
+
 function VideoUpload({ onVideoUploaded }) {
     const [selectedFile, setSelectedFile] = useState(null);
     const [uploadProgress, setUploadProgress] = useState(0);
@@ -10,6 +22,43 @@ function VideoUpload({ onVideoUploaded }) {
         setSelectedFile(event.target.files[0]);
     };
 
+    // Sends the file in chunks, asking the backend for its offset and resuming from there after a failure
+    const uploadInChunks = async (file) => {
+        const session = await axios.post('/api/uploads', { filename: file.name, size: file.size });
+        const uploadId = session.data.upload_id;
+        const chunkSize = session.data.chunk_size;
+        let offset = session.data.offset;
+        let retries = 0;
+
+        while (offset < file.size) {
+            const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size));
+            const end = offset + chunk.size - 1;
+            try {
+                const headers = {
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Range': `bytes ${offset}-${end}/${file.size}`,
+                };
+                const chunkChecksum = await sha256(chunk);
+                if (chunkChecksum) {
+                    headers['X-Chunk-SHA256'] = chunkChecksum;
+                }
+                const response = await axios.put(`/api/uploads/${uploadId}`, chunk, { headers });
+                offset = response.data.offset;
+                retries = 0;
+                setUploadProgress(Math.round((offset * 100) / file.size));
+            } catch (error) {
+                if (++retries > MAX_CHUNK_RETRIES) {
+                    throw error;
+                }
+                console.warn(`Chunk upload failed, resuming (attempt ${retries})`, error);
+                const status = await axios.get(`/api/uploads/${uploadId}`);
+                offset = status.data.offset;
+            }
+        }
+
+        return axios.post(`/api/uploads/${uploadId}/complete`, {});
+    };
+
     const handleUpload = async () => {
         if (!selectedFile) {
             alert('Please select a video file.');
@@ -17,19 +66,9 @@ function VideoUpload({ onVideoUploaded }) {
         }
 
         setIsUploading(true);
-        const formData = new FormData();
-        formData.append('video', selectedFile);
 
         try {
-            const response = await axios.post('/api/videos', formData, {
-                headers: {
-                    'Content-Type': 'multipart/form-data',
-                },
-                onUploadProgress: (progressEvent) => {
-                    const progress = Math.round((progressEvent.loaded * 100) / progressEvent.total);
-                    setUploadProgress(progress);
-                },
-            });
+            const response = await uploadInChunks(selectedFile);
             console.log('Video uploaded successfully:', response.data);
             setSelectedFile(null);
             setUploadProgress(0);
@@ -60,4 +99,4 @@ function VideoUpload({ onVideoUploaded }) {
     );
 }
 
-export default VideoUpload;
\ No newline at end of file
+export default VideoUpload;